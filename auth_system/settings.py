@@ -1,8 +1,9 @@
 import os
 from pathlib import Path
 
+import django
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
-from drf_spectacular.utils import OpenApiExample
 
 load_dotenv()
 
@@ -10,59 +11,140 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = os.getenv('SECRET_KEY')
 
-DEBUG = True
+# Профиль запуска: 'dev' — полный стек Django (admin, сессии, CSRF,
+# сообщения) и OpenAPI-схема со Swagger; 'production' — только API:
+# без contrib.auth, сессий и drf-spectacular, меньше импортов при старте
+# и middleware на запрос. API_DOCS=True включает схему и в production.
+APP_PROFILE = os.getenv('APP_PROFILE', 'dev')
+if APP_PROFILE not in ('dev', 'production'):
+    raise ImproperlyConfigured(f'Unsupported APP_PROFILE: {APP_PROFILE}')
+DEV_PROFILE = APP_PROFILE == 'dev'
+API_DOCS = os.getenv('API_DOCS', str(DEV_PROFILE)) == 'True'
 
-ALLOWED_HOSTS = []
+DEBUG = os.getenv('DEBUG', str(DEV_PROFILE)) == 'True'
 
-INSTALLED_APPS = [
-    'django.contrib.admin',
-    'django.contrib.auth',
-    'django.contrib.contenttypes',
-    'django.contrib.sessions',
-    'django.contrib.messages',
-    'django.contrib.staticfiles',
-    'rest_framework',
-    'drf_spectacular',
-    'core',
+ALLOWED_HOSTS = [
+    host.strip()
+    for host in os.getenv('ALLOWED_HOSTS', '').split(',')
+    if host.strip()
 ]
 
-MIDDLEWARE = [
-    'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
-    'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'core.middleware.AuthMiddleware',
-]
+if DEV_PROFILE:
+    INSTALLED_APPS = [
+        'django.contrib.admin',
+        'django.contrib.auth',
+        'django.contrib.contenttypes',
+        'django.contrib.sessions',
+        'django.contrib.messages',
+        'django.contrib.staticfiles',
+        'rest_framework',
+        'core',
+    ]
+    MIDDLEWARE = [
+        'core.instrumentation.InstrumentationMiddleware',
+        'django.middleware.security.SecurityMiddleware',
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.middleware.common.CommonMiddleware',
+        'django.middleware.csrf.CsrfViewMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'django.contrib.messages.middleware.MessageMiddleware',
+        'django.middleware.clickjacking.XFrameOptionsMiddleware',
+        'core.middleware.AuthMiddleware',
+        'core.middleware.PermissionCacheMiddleware',
+    ]
+else:
+    # API работает по Bearer-токену: сессии, CSRF и сообщения не нужны.
+    INSTALLED_APPS = [
+        'rest_framework',
+        'core',
+    ]
+    MIDDLEWARE = [
+        'core.instrumentation.InstrumentationMiddleware',
+        'django.middleware.security.SecurityMiddleware',
+        'django.middleware.common.CommonMiddleware',
+        'core.middleware.AuthMiddleware',
+        'core.middleware.PermissionCacheMiddleware',
+    ]
+if API_DOCS:
+    INSTALLED_APPS.insert(-1, 'drf_spectacular')
 
 ROOT_URLCONF = 'auth_system.urls'
 
+_context_processors = [
+    'django.template.context_processors.debug',
+    'django.template.context_processors.request',
+]
+if DEV_PROFILE:
+    _context_processors += [
+        'django.contrib.auth.context_processors.auth',
+        'django.contrib.messages.context_processors.messages',
+    ]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
-            'context_processors': [
-                'django.template.context_processors.debug',
-                'django.template.context_processors.request',
-                'django.contrib.auth.context_processors.auth',
-                'django.contrib.messages.context_processors.messages',
-            ],
+            'context_processors': _context_processors,
         },
     },
 ]
 
 WSGI_APPLICATION = 'auth_system.wsgi.application'
 
-DATABASES = {
-    'default': {
+# DB_ENGINE=postgresql: постоянные соединения (DB_CONN_MAX_AGE) с
+# проверкой перед использованием или пул psycopg (DB_POOL, Django 5.1+).
+# DB_REPLICA_HOSTS — реплики через запятую: чтение пользователей и ролей
+# уходит на них (core.db_routers.ReplicaRouter).
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite')
+if DB_ENGINE == 'postgresql':
+    _default_db = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.getenv('DB_NAME', 'auth_system'),
+        'USER': os.getenv('DB_USER', 'postgres'),
+        'PASSWORD': os.getenv('DB_PASSWORD', ''),
+        'HOST': os.getenv('DB_HOST', 'localhost'),
+        'PORT': os.getenv('DB_PORT', '5432'),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': (
+            os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True'
+        ),
+        'OPTIONS': {},
+    }
+    if os.getenv('DB_POOL', 'False') == 'True':
+        if django.VERSION < (5, 1):
+            raise ImproperlyConfigured('DB_POOL requires Django 5.1+.')
+        # Соединения живут в пуле, CONN_MAX_AGE с ним несовместим.
+        _default_db['CONN_MAX_AGE'] = 0
+        _default_db['OPTIONS']['pool'] = {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+            'timeout': int(os.getenv('DB_POOL_TIMEOUT', '10')),
+        }
+elif DB_ENGINE == 'sqlite':
+    _default_db = {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    },
-}
+        'NAME': os.getenv('DB_NAME', BASE_DIR / 'db.sqlite3'),
+    }
+else:
+    raise ImproperlyConfigured(f'Unsupported DB_ENGINE: {DB_ENGINE}')
+
+DATABASES = {'default': _default_db}
+DATABASE_REPLICAS = []
+for _index, _host in enumerate(
+    host.strip()
+    for host in os.getenv('DB_REPLICA_HOSTS', '').split(',')
+    if host.strip()
+):
+    _alias = f'replica_{_index}'
+    DATABASES[_alias] = {
+        **_default_db,
+        'HOST': _host,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(_alias)
+DATABASE_ROUTERS = ['core.db_routers.ReplicaRouter']
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -95,32 +177,189 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Окна неудачных входов: по умолчанию LocMemCache хранит 300 ключей
+    # и при заполнении вытесняет треть — перебор с сотен IP сбрасывал бы
+    # счётчики. Ключи живут LOGIN_THROTTLE_WINDOW, лимит — с запасом.
+    'login_throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'login-throttle',
+        'OPTIONS': {
+            'MAX_ENTRIES': int(
+                os.getenv('LOGIN_THROTTLE_MAX_ENTRIES', '1000000'),
+            ),
+        },
+    },
+    # L2 кэша прав; в кластере — общий бэкенд, например
+    # django.core.cache.backends.redis.RedisCache или PyMemcacheCache.
+    'permissions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'permissions',
+    },
+}
+
+# Кэш прав: L1 в памяти процесса, L2 — CACHES[PERMISSION_CACHE],
+# сброс L1 во всех воркерах — через канал pub/sub.
+PERMISSION_CACHE = 'permissions'
+PERMISSION_CACHE_L1_SIZE = int(os.getenv('PERMISSION_CACHE_L1_SIZE', '10000'))
+PERMISSION_CACHE_L1_TTL = int(os.getenv('PERMISSION_CACHE_L1_TTL', '60'))
+PERMISSION_CACHE_L2_TTL = int(os.getenv('PERMISSION_CACHE_L2_TTL', '600'))
+PERMISSION_CACHE_CHANNEL = os.getenv(
+    'PERMISSION_CACHE_CHANNEL',
+    'core.permission_cache.LocalChannel',
+)
+PERMISSION_CACHE_CHANNEL_URL = os.getenv(
+    'PERMISSION_CACHE_CHANNEL_URL',
+    'redis://localhost:6379/0',
+)
+
+# Действия проверки прав: action -> (флаг «на все объекты», флаг «только
+# на свои»). Новое действие добавляется здесь, без правок check_permission.
+PERMISSION_ACTIONS = {
+    'read': ('read_all', 'read_own'),
+    'create': ('create', None),
+    'update': ('update_all', 'update_own'),
+    'delete': ('delete_all', 'delete_own'),
+}
+# Решения PolicyEngine по (роли, элемент, действие, владелец).
+PERMISSION_DECISION_CACHE_SIZE = int(
+    os.getenv('PERMISSION_DECISION_CACHE_SIZE', '100000'),
+)
+
 AUTH_USER_MODEL = 'core.CustomUser'
 
+# Время жизни токенов (сек.) и период подгрузки отозванных jti из БД.
+ACCESS_TOKEN_LIFETIME = int(os.getenv('ACCESS_TOKEN_LIFETIME', '900'))
+REFRESH_TOKEN_LIFETIME = int(
+    os.getenv('REFRESH_TOKEN_LIFETIME', str(7 * 24 * 3600)),
+)
+TOKEN_DENYLIST_SYNC_INTERVAL = int(
+    os.getenv('TOKEN_DENYLIST_SYNC_INTERVAL', '5'),
+)
+# Каждая синхронизация перечитывает отзывы за столько секунд до
+# предыдущей: покрывает долгие транзакции и расхождение часов воркеров.
+TOKEN_DENYLIST_SYNC_OVERLAP = int(
+    os.getenv('TOKEN_DENYLIST_SYNC_OVERLAP', '60'),
+)
+
+# Подпись токенов: HS256 на SECRET_KEY или EdDSA/RS256 закрытым ключом
+# с kid в заголовке. JWT_JWKS_FILE — открытые ключи, которые ещё
+# принимаются при проверке (ротация); все они отдаются на /api/auth/jwks/.
+# Ключи создаются командой manage.py generate_signing_key.
+JWT_ALGORITHM = os.getenv('JWT_ALGORITHM', 'HS256')
+JWT_PRIVATE_KEY_FILE = os.getenv('JWT_PRIVATE_KEY_FILE')
+JWT_KEY_ID = os.getenv('JWT_KEY_ID')
+JWT_JWKS_FILE = os.getenv('JWT_JWKS_FILE')
+JWT_JWKS_MAX_AGE = int(os.getenv('JWT_JWKS_MAX_AGE', '300'))
+
+# Журнал аудита: входы, отклонённые токены и отказы в доступе.
+# События копятся в кольцевом буфере процесса и пишутся фоновым потоком
+# пачками в таблицу AuditEvent (AUDIT_SINK=database) или JSONL-файл
+# с ротацией (AUDIT_SINK=jsonl). При заполнении буфера на 80% успешные
+# события сэмплируются с долей AUDIT_SAMPLE_RATE, при переполнении
+# новые события отбрасываются. Выгрузка: manage.py audit_export.
+AUDIT_ENABLED = os.getenv('AUDIT_ENABLED', 'False') == 'True'
+AUDIT_SINK = os.getenv('AUDIT_SINK', 'database')
+# {pid}: у каждого воркера свой файл и своя ротация.
+AUDIT_FILE = os.getenv('AUDIT_FILE', str(BASE_DIR / 'audit-{pid}.jsonl'))
+AUDIT_FILE_MAX_BYTES = int(
+    os.getenv('AUDIT_FILE_MAX_BYTES', str(50 * 1024 * 1024)),
+)
+AUDIT_FILE_BACKUPS = int(os.getenv('AUDIT_FILE_BACKUPS', '5'))
+AUDIT_BUFFER_SIZE = int(os.getenv('AUDIT_BUFFER_SIZE', '100000'))
+AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '1000'))
+AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', '1.0'))
+AUDIT_SAMPLE_RATE = float(os.getenv('AUDIT_SAMPLE_RATE', '0.1'))
+# Записывать и разрешённые проверки прав, а не только отказы.
+AUDIT_LOG_ALLOWED = os.getenv('AUDIT_LOG_ALLOWED', 'False') == 'True'
+
+# Сколько проверенных access-токенов держать в LRU процесса (0 — выкл.).
+VERIFIED_TOKEN_CACHE_SIZE = int(
+    os.getenv('VERIFIED_TOKEN_CACHE_SIZE', '10000'),
+)
+
+# Токен несёт снимок пользователя (id, роли, версия прав),
+# и middleware не загружает CustomUser на каждый запрос.
+AUTH_STATELESS_TOKENS = os.getenv('AUTH_STATELESS_TOKENS', 'False') == 'True'
+AUTH_USER_STATUS_TTL = int(os.getenv('AUTH_USER_STATUS_TTL', '30'))
+
+# Неудачные входы за окно (сек.), после которых вход блокируется (429).
+LOGIN_THROTTLE_CACHE = 'login_throttle'
+LOGIN_THROTTLE_WINDOW = int(os.getenv('LOGIN_THROTTLE_WINDOW', '300'))
+LOGIN_THROTTLE_EMAIL = int(os.getenv('LOGIN_THROTTLE_EMAIL', '5'))
+LOGIN_THROTTLE_IP = int(os.getenv('LOGIN_THROTTLE_IP', '50'))
+
+# Стоимость bcrypt; подобрать под железо: manage.py bcrypt_benchmark.
+# Хэши с другой стоимостью пересчитываются при успешном входе.
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+
+# Async-версии login/register и products (включается в asgi.py):
+# пользователь и права — через async ORM, bcrypt — в 'thread' или
+# 'process' пуле, при переполнении очереди — 503 с Retry-After.
+ASYNC_AUTH_VIEWS = os.getenv('ASYNC_AUTH_VIEWS', 'False') == 'True'
+PASSWORD_HASHER_POOL = os.getenv('PASSWORD_HASHER_POOL', 'thread')
+PASSWORD_HASHER_WORKERS = int(os.getenv('PASSWORD_HASHER_WORKERS', '0'))
+PASSWORD_HASHER_QUEUE = int(os.getenv('PASSWORD_HASHER_QUEUE', '32'))
+PASSWORD_HASHER_RETRY_AFTER = int(
+    os.getenv('PASSWORD_HASHER_RETRY_AFTER', '1'),
+)
+
+# Замеры запросов: заголовок Server-Timing, JSON-лог в логгер
+# core.instrumentation и гистограммы на /api/metrics/ (Prometheus).
+# При False middleware не подключается и таймеры не работают.
+INSTRUMENTATION_ENABLED = (
+    os.getenv('INSTRUMENTATION_ENABLED', 'False') == 'True'
+)
+
+# Пользователя по Bearer-токену определяет AuthMiddleware, DRF только
+# забирает его: без сессий, CSRF и AnonymousUser из contrib.auth.
 REST_FRAMEWORK = {
-    'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'core.authentication.MiddlewareAuthentication',
+    ],
+    'UNAUTHENTICATED_USER': None,
 }
+if API_DOCS:
+    REST_FRAMEWORK['DEFAULT_SCHEMA_CLASS'] = (
+        'drf_spectacular.openapi.AutoSchema'
+    )
+if not DEV_PROFILE:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = [
+        'rest_framework.renderers.JSONRenderer',
+    ]
 
 SPECTACULAR_SETTINGS = {
     'TITLE': 'API системы',
     'DESCRIPTION': 'Кастомная аутентификация и авторизация',
     'VERSION': '1.0.0',
     'SERVE_INCLUDE_SCHEMA': False,
+    # Документации не нужен пользователь: AuthMiddleware его не вычисляет.
+    'SERVE_AUTHENTICATION': [],
 }
 
-MOCK_PRODUCTS = [
-    {'id': 1, 'name': 'Laptop', 'owner_id': 1},
-    {'id': 2, 'name': 'Phone', 'owner_id': 2},
-]
+# Схема OpenAPI, заранее собранная manage.py build_api_schema в файлы
+# openapi-<VERSION>.json/.yaml: /api/schema/ отдаёт их из памяти
+# с ETag и gzip. Без файлов схема генерируется на лету только при DEBUG.
+API_SCHEMA_DIR = os.getenv('API_SCHEMA_DIR', BASE_DIR / 'openapi')
+API_SCHEMA_MAX_AGE = int(os.getenv('API_SCHEMA_MAX_AGE', '300'))
+
 PRODUCT_SCHEMA = {
-    'type': 'array',
-    'items': {
-        'type': 'object',
-        'properties': {
-            'id': {'type': 'integer'},
-            'name': {'type': 'string'},
-            'owner_id': {'type': 'integer'},
-        },
+    'type': 'object',
+    'properties': {
+        'id': {'type': 'integer'},
+        'name': {'type': 'string'},
+        'owner_id': {'type': 'integer'},
+    },
+}
+PRODUCT_PAGE_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'next': {'type': 'string', 'nullable': True},
+        'previous': {'type': 'string', 'nullable': True},
+        'results': {'type': 'array', 'items': PRODUCT_SCHEMA},
     },
 }
 USER_REQUEST_SCHEMA = {
@@ -134,21 +373,42 @@ USER_REQUEST_SCHEMA = {
     },
 }
 USER_RESPONSES_SCHEMA = {
-    200: {'type': 'object', 'properties': {'token': {'type': 'string'}}},
+    200: {
+        'type': 'object',
+        'properties': {
+            'token': {'type': 'string'},
+            'refresh': {'type': 'string'},
+        },
+    },
     401: {'type': 'object', 'properties': {'error': {'type': 'string'}}},
 }
+REFRESH_REQUEST_SCHEMA = {
+    'application/json': {
+        'type': 'object',
+        'properties': {'refresh': {'type': 'string'}},
+        'required': ['refresh'],
+    },
+}
 USER_RESPONSES_SCHEMA_201 = {
     201: {'type': 'object', 'properties': {'message': {'type': 'string'}}},
 }
+MESSAGE_RESPONSE_SCHEMA = {
+    200: {'type': 'object', 'properties': {'message': {'type': 'string'}}},
+}
+# Примеры для Swagger: OpenApiExample из них собирает core.schema,
+# только когда документация включена.
 EXAMPLES_LOGIN = [
-    OpenApiExample(
-        'Успешный вход',
-        value={'email': 'admin@myapp.com', 'password': 'my_secure_pass'},
-        request_only=True,
-    ),
-    OpenApiExample(
-        'Ответ при успехе',
-        value={'token': 'eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9...'},
-        response_only=True,
-    ),
+    {
+        'name': 'Успешный вход',
+        'value': {'email': 'admin@myapp.com', 'password': 'my_secure_pass'},
+        'request_only': True,
+    },
+    {
+        'name': 'Ответ при успехе',
+        'value': {
+            'token': 'eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9...',
+            'refresh': 'eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9...',
+        },
+        'response_only': True,
+    },
 ]
@@ -1,14 +1,25 @@
-from django.contrib import admin
+from django.conf import settings
 from django.urls import include, path
-from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
-
-urlpatterns = [
-    path('admin/', admin.site.urls),
-    path('api/', include('core.urls')),
-    path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
-    path(
-        'api/docs/',
-        SpectacularSwaggerView.as_view(url_name='schema'),
-        name='swagger-ui',
-    ),
-]
+
+urlpatterns = []
+
+if settings.DEV_PROFILE:
+    from django.contrib import admin
+
+    urlpatterns.append(path('admin/', admin.site.urls))
+
+urlpatterns.append(path('api/', include('core.urls')))
+
+if settings.API_DOCS:
+    from drf_spectacular.views import SpectacularSwaggerView
+
+    from core.views import api_schema
+
+    urlpatterns += [
+        path('api/schema/', api_schema, name='schema'),
+        path(
+            'api/docs/',
+            SpectacularSwaggerView.as_view(url_name='schema'),
+            name='swagger-ui',
+        ),
+    ]
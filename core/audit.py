@@ -0,0 +1,250 @@
+import atexit
+import collections
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+
+logger = logging.getLogger('core.audit')
+
+# При заполнении буфера выше HIGH_WATERMARK успешные события
+# сэмплируются (AUDIT_SAMPLE_RATE), отказы сохраняются до конца буфера.
+HIGH_WATERMARK = 0.8
+SAMPLED_OUTCOMES = frozenset({'success', 'allow'})
+
+
+def as_dict(entry):
+    timestamp, event, outcome, user_id, ip, detail = entry
+    return {
+        'timestamp': datetime.fromtimestamp(timestamp, timezone.utc)
+        .isoformat(),
+        'event': event,
+        'outcome': outcome,
+        'user_id': user_id,
+        'ip': ip,
+        'detail': detail,
+    }
+
+
+class DatabaseSink:
+    """Пачка событий — один INSERT в таблицу AuditEvent."""
+
+    def write(self, entries):
+        from core.models import AuditEvent
+
+        AuditEvent.objects.bulk_create(
+            [
+                AuditEvent(
+                    created_at=datetime.fromtimestamp(timestamp, timezone.utc),
+                    event=event,
+                    outcome=outcome,
+                    user_id=user_id,
+                    ip=ip or None,
+                    detail=detail,
+                )
+                for timestamp, event, outcome, user_id, ip, detail in entries
+            ],
+            batch_size=500,
+        )
+
+
+class JsonlSink:
+    """
+    JSONL-файл с ротацией по размеру: path, path.1 ... path.<backups>.
+    {pid} в пути даёт каждому воркеру свой файл.
+    """
+
+    def __init__(self, path, max_bytes, backups):
+        self.template = str(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+    @property
+    def path(self):
+        # pid подставляется при записи, а не при импорте: воркеры,
+        # форкнутые от мастера с preload, получают каждый свой файл.
+        return self.template.replace('{pid}', str(os.getpid()))
+
+    def write(self, entries):
+        path = self.path
+        with open(path, 'a', encoding='utf-8') as target:
+            for entry in entries:
+                target.write(json.dumps(as_dict(entry), ensure_ascii=False))
+                target.write('\n')
+            size = target.tell()
+        if self.max_bytes and size >= self.max_bytes:
+            self.rotate(path)
+
+    def rotate(self, path=None):
+        path = path or self.path
+        for index in range(self.backups - 1, 0, -1):
+            source = f'{path}.{index}'
+            if os.path.exists(source):
+                os.replace(source, f'{path}.{index + 1}')
+        if self.backups:
+            os.replace(path, f'{path}.1')
+        else:
+            os.remove(path)
+
+    def paths(self):
+        """Файлы от старых к новым."""
+        paths = [
+            f'{self.path}.{index}'
+            for index in range(self.backups, 0, -1)
+        ]
+        paths.append(self.path)
+        return [path for path in paths if os.path.exists(path)]
+
+
+def make_sink():
+    if settings.AUDIT_SINK == 'database':
+        return DatabaseSink()
+    if settings.AUDIT_SINK == 'jsonl':
+        return JsonlSink(
+            settings.AUDIT_FILE,
+            settings.AUDIT_FILE_MAX_BYTES,
+            settings.AUDIT_FILE_BACKUPS,
+        )
+    raise ImproperlyConfigured(
+        f'Unsupported AUDIT_SINK: {settings.AUDIT_SINK}',
+    )
+
+
+class AuditLog:
+    """
+    Журнал аудита без обращений к БД на горячем пути: record() кладёт
+    кортеж в кольцевой буфер в памяти, фоновый поток раз в
+    AUDIT_FLUSH_INTERVAL (или при накоплении AUDIT_BATCH_SIZE событий)
+    пишет их пачкой в sink. При переполнении новые события
+    отбрасываются и учитываются в stats().
+    """
+
+    def __init__(self, sink=None, autostart=True):
+        self._sink_override = sink
+        self.autostart = autostart
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.failed = 0
+        self.configure()
+
+    def configure(self):
+        """Перечитать настройки AUDIT_*."""
+        self.enabled = settings.AUDIT_ENABLED
+        self.log_allowed = settings.AUDIT_LOG_ALLOWED
+        self.buffer_size = settings.AUDIT_BUFFER_SIZE
+        self.batch_size = settings.AUDIT_BATCH_SIZE
+        self.interval = settings.AUDIT_FLUSH_INTERVAL
+        self.sample_rate = settings.AUDIT_SAMPLE_RATE
+        self._high_watermark = int(self.buffer_size * HIGH_WATERMARK)
+        self._buffer = collections.deque(maxlen=self.buffer_size)
+        self.sink = self._sink_override
+        if self.sink is None and self.enabled:
+            self.sink = make_sink()
+
+    def record(self, event, outcome, user_id=None, ip=None, **detail):
+        if not self.enabled:
+            return
+        size = len(self._buffer)
+        if size >= self._high_watermark:
+            if size >= self.buffer_size:
+                self.dropped += 1
+                return
+            if (
+                outcome in SAMPLED_OUTCOMES
+                and random.random() >= self.sample_rate
+            ):
+                self.sampled_out += 1
+                return
+        self._buffer.append((time.time(), event, outcome, user_id, ip, detail))
+        if size + 1 >= self.batch_size:
+            self._wake.set()
+        if self._thread is None and self.autostart:
+            self._start()
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run,
+                name='audit-flusher',
+                daemon=True,
+            )
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self._flush_in_thread()
+
+    def _flush_in_thread(self):
+        # Фоновый поток держит своё соединение с БД: как и после
+        # запроса, закрываем его, если оно оборвалось или устарело.
+        close_old_connections()
+        try:
+            self.flush()
+        finally:
+            close_old_connections()
+
+    def flush(self):
+        """Записать всё накопленное; возвращает число записанных событий."""
+        written = 0
+        with self._flush_lock:
+            while self._buffer:
+                batch = []
+                try:
+                    while len(batch) < self.batch_size:
+                        batch.append(self._buffer.popleft())
+                except IndexError:
+                    pass
+                try:
+                    self.sink.write(batch)
+                except Exception:
+                    # Повторная попытка могла бы переполнить буфер:
+                    # пачка теряется, но учитывается.
+                    self.failed += len(batch)
+                    logger.exception('Audit flush failed')
+                    continue
+                written += len(batch)
+        self.written += written
+        return written
+
+    def stats(self):
+        return {
+            'buffered': len(self._buffer),
+            'written': self.written,
+            'dropped': self.dropped,
+            'sampled_out': self.sampled_out,
+            'failed': self.failed,
+        }
+
+
+audit_log = AuditLog()
+
+
+def record(event, outcome, user_id=None, ip=None, **detail):
+    audit_log.record(event, outcome, user_id, ip, **detail)
+
+
+@receiver(setting_changed)
+def _reconfigure_on_setting_change(setting, **kwargs):
+    if setting.startswith('AUDIT_'):
+        if audit_log.sink is not None:
+            audit_log.flush()
+        audit_log.configure()
@@ -0,0 +1,18 @@
+from rest_framework.authentication import BaseAuthentication
+
+
+class MiddlewareAuthentication(BaseAuthentication):
+    """
+    Пользователь, определённый AuthMiddleware по Bearer-токену.
+    В отличие от SessionAuthentication не требует CSRF-токена
+    и не зависит от django.contrib.auth.
+    """
+
+    def authenticate(self, request):
+        user = getattr(request._request, 'user', None)
+        if not user:
+            return None
+        return user, None
+
+    def authenticate_header(self, request):
+        return 'Bearer'
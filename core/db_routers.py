@@ -0,0 +1,56 @@
+import contextlib
+import contextvars
+import random
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Модели, которые читаются с реплик: пользователи, роли и права.
+REPLICA_MODELS = frozenset({
+    'customuser',
+    'userrole',
+    'role',
+    'accessrule',
+    'businesselement',
+})
+
+_force_primary = contextvars.ContextVar('force_primary', default=False)
+
+
+@contextlib.contextmanager
+def use_primary():
+    """Чтение внутри блока идёт с основной БД (нужны свежие данные)."""
+    token = _force_primary.set(True)
+    try:
+        yield
+    finally:
+        _force_primary.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Чтение пользователей и ролей — со случайной реплики из
+    DATABASE_REPLICAS; запись, отозванные токены, продукты и чтение
+    внутри транзакции — с основной БД.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if (
+            not replicas
+            or model._meta.app_label != 'core'
+            or model._meta.model_name not in REPLICA_MODELS
+            or _force_primary.get()
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,88 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import bcrypt
+from django.conf import settings
+
+from core.instrumentation import timer
+
+
+class HasherPoolSaturated(Exception):
+    pass
+
+
+def hash_password(password, rounds=None):
+    return bcrypt.hashpw(
+        password.encode('utf-8'),
+        bcrypt.gensalt(rounds=rounds or settings.BCRYPT_ROUNDS),
+    ).decode('utf-8')
+
+
+def verify_password(password, password_hash):
+    return bcrypt.checkpw(
+        password.encode('utf-8'),
+        password_hash.encode('utf-8'),
+    )
+
+
+def hash_rounds(password_hash):
+    try:
+        return int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def needs_rehash(password_hash):
+    return hash_rounds(password_hash) != settings.BCRYPT_ROUNDS
+
+
+class HasherPool:
+    """
+    Пул для bcrypt с ограниченной очередью: когда заняты все воркеры
+    и очередь, задача сразу отклоняется с HasherPoolSaturated.
+    """
+
+    def __init__(self, kind='thread', workers=None, max_queue=32):
+        workers = workers or os.cpu_count() or 1
+        executor_class = (
+            ProcessPoolExecutor if kind == 'process' else ThreadPoolExecutor
+        )
+        self.executor = executor_class(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherPoolSaturated()
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    async def run(self, fn, *args):
+        with timer('password'):
+            return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_hasher_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = HasherPool(
+                    kind=settings.PASSWORD_HASHER_POOL,
+                    workers=settings.PASSWORD_HASHER_WORKERS,
+                    max_queue=settings.PASSWORD_HASHER_QUEUE,
+                )
+    return _pool
@@ -0,0 +1,276 @@
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger('core.instrumentation')
+
+DURATION_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    2.5,
+)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+
+# Замеры текущего запроса; None — инструментирование выключено
+# или вызов вне запроса, и таймеры ничего не делают.
+_request_stats = contextvars.ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('started', 'spans', 'queries', 'active')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.queries = 0
+        self.active = set()
+
+    def add(self, name, duration):
+        self.spans[name] = self.spans.get(name, 0.0) + duration
+
+
+@contextlib.contextmanager
+def timer(name):
+    """
+    Добавляет время блока к участку name текущего запроса.
+    Вложенные замеры того же участка не суммируются дважды.
+    """
+    stats = _request_stats.get()
+    if stats is None or name in stats.active:
+        yield
+        return
+    stats.active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.active.discard(name)
+        stats.add(name, time.perf_counter() - started)
+
+
+def timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _request_stats.get() is None:
+                return func(*args, **kwargs)
+            with timer(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count_queries(execute, sql, params, many, context):
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.add('db', time.perf_counter() - started)
+
+
+def install_query_counter(sender=None, connection=None, **kwargs):
+    """
+    Обёртка execute_wrapper ставится на соединение один раз, а не на
+    каждый запрос: так учитываются и запросы из sync_to_async-потоков.
+    """
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+def _escape(value):
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('"', '\\"')
+        .replace('\n', '\\n')
+    )
+
+
+def _labels(pairs):
+    return ','.join(f'{key}="{_escape(value)}"' for key, value in pairs)
+
+
+class Histogram:
+    """Гистограмма в памяти процесса в формате Prometheus."""
+
+    def __init__(self, name, description, buckets, labelnames):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [
+                    [0] * len(self.buckets),
+                    0.0,
+                    0,
+                ]
+            counts = series[0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} histogram',
+        ]
+        with self._lock:
+            series = sorted(
+                (labels, counts[:], total, count)
+                for labels, (counts, total, count) in self._series.items()
+            )
+        for labels, counts, total, count in series:
+            pairs = list(zip(self.labelnames, labels))
+            for bound, bucket_count in zip(self.buckets, counts):
+                bucket_labels = _labels([*pairs, ('le', bound)])
+                lines.append(
+                    f'{self.name}_bucket{{{bucket_labels}}} {bucket_count}',
+                )
+            inf_labels = _labels([*pairs, ('le', '+Inf')])
+            lines.append(f'{self.name}_bucket{{{inf_labels}}} {count}')
+            lines.append(f'{self.name}_sum{{{_labels(pairs)}}} {total}')
+            lines.append(f'{self.name}_count{{{_labels(pairs)}}} {count}')
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds',
+    'Request duration by view.',
+    DURATION_BUCKETS,
+    ('view', 'method'),
+)
+SPAN_DURATION = Histogram(
+    'http_request_span_duration_seconds',
+    'Time spent per request in jwt, auth, permission, password and db.',
+    DURATION_BUCKETS,
+    ('view', 'span'),
+)
+REQUEST_QUERIES = Histogram(
+    'http_request_db_queries',
+    'Database queries per request.',
+    QUERY_BUCKETS,
+    ('view',),
+)
+HISTOGRAMS = (REQUEST_DURATION, SPAN_DURATION, REQUEST_QUERIES)
+
+
+def render_metrics():
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    return '\n'.join(lines) + '\n'
+
+
+def reset_metrics():
+    for histogram in HISTOGRAMS:
+        histogram.clear()
+
+
+class InstrumentationMiddleware:
+    """
+    Замеры запроса: Server-Timing, строка лога в JSON и гистограммы
+    для /api/metrics/. При INSTRUMENTATION_ENABLED=False убирается
+    из цепочки целиком.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTATION_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        connection_created.connect(
+            install_query_counter,
+            dispatch_uid='core.instrumentation.install_query_counter',
+        )
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        stats, token = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        stats, token = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        return self.finish(request, response, stats)
+
+    def start(self):
+        for connection in connections.all(initialized_only=True):
+            install_query_counter(connection=connection)
+        stats = RequestStats()
+        return stats, _request_stats.set(stats)
+
+    def finish(self, request, response, stats):
+        total = time.perf_counter() - stats.started
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        REQUEST_DURATION.observe(total, view, request.method)
+        REQUEST_QUERIES.observe(stats.queries, view)
+        for name, duration in stats.spans.items():
+            SPAN_DURATION.observe(duration, view, name)
+
+        timings = [
+            f'{name};dur={duration * 1000:.3f}'
+            for name, duration in sorted(stats.spans.items())
+            if name != 'db'
+        ]
+        timings.append(
+            f'db;dur={stats.spans.get("db", 0.0) * 1000:.3f};'
+            f'desc="{stats.queries} queries"',
+        )
+        timings.append(f'total;dur={total * 1000:.3f}')
+        response['Server-Timing'] = ', '.join(timings)
+        logger.info(
+            json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'view': view,
+                'status': response.status_code,
+                'duration_ms': round(total * 1000, 3),
+                'queries': stats.queries,
+                'spans_ms': {
+                    name: round(duration * 1000, 3)
+                    for name, duration in stats.spans.items()
+                },
+            }),
+        )
+        return response
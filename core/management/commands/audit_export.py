@@ -0,0 +1,165 @@
+import csv
+import fnmatch
+import glob
+import json
+import re
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.audit import JsonlSink
+from core.models import AuditEvent
+
+FIELDS = ('timestamp', 'event', 'outcome', 'user_id', 'ip', 'detail')
+
+
+def parse_moment(value):
+    moment = parse_datetime(value)
+    if moment is None:
+        raise CommandError(f'Некорректная дата: {value}')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгрузка журнала аудита из таблицы AuditEvent или JSONL-файлов '
+        'с фильтрами по событию, результату, пользователю и времени'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            choices=('database', 'jsonl'),
+            help='Откуда читать (по умолчанию AUDIT_SINK)',
+        )
+        parser.add_argument('--event', type=str)
+        parser.add_argument('--outcome', type=str)
+        parser.add_argument('--user-id', type=int)
+        parser.add_argument('--since', type=str, help='ISO 8601')
+        parser.add_argument('--until', type=str, help='ISO 8601')
+        parser.add_argument('--limit', type=int)
+        parser.add_argument(
+            '--format',
+            choices=('jsonl', 'csv'),
+            default='jsonl',
+        )
+        parser.add_argument('--output', type=str, help='Путь для файла')
+
+    def handle(self, *args, **options):
+        for key in ('since', 'until'):
+            if options[key]:
+                options[key] = parse_moment(options[key])
+        source = options['source'] or settings.AUDIT_SINK
+        if source == 'database':
+            events = self.from_database(options)
+        else:
+            events = self.from_jsonl(options)
+        if options['output']:
+            with open(
+                options['output'],
+                'w',
+                encoding='utf-8',
+                newline='',
+            ) as target:
+                count = self.write(events, target, options['format'])
+            self.stdout.write(f'Выгружено событий: {count}')
+        else:
+            self.write(events, self.stdout, options['format'])
+
+    def from_database(self, options):
+        queryset = AuditEvent.objects.order_by('created_at', 'id')
+        filters = {
+            'event': options['event'],
+            'outcome': options['outcome'],
+            'user_id': options['user_id'],
+            'created_at__gte': options['since'],
+            'created_at__lt': options['until'],
+        }
+        queryset = queryset.filter(
+            **{
+                key: value
+                for key, value in filters.items()
+                if value is not None
+            },
+        )
+        if options['limit']:
+            queryset = queryset[:options['limit']]
+        for event in queryset.iterator(chunk_size=2000):
+            yield {
+                'timestamp': event.created_at.isoformat(),
+                'event': event.event,
+                'outcome': event.outcome,
+                'user_id': event.user_id,
+                'ip': event.ip,
+                'detail': event.detail,
+            }
+
+    def jsonl_paths(self):
+        # С {pid} в AUDIT_FILE у каждого воркера свой файл: читаем все.
+        # Базовый файл после ротации или у завершённого воркера может
+        # отсутствовать, поэтому ищем и резервные копии (path.N).
+        pattern = str(settings.AUDIT_FILE)
+        if '{pid}' in pattern:
+            pattern = pattern.replace('{pid}', '*')
+            bases = sorted({
+                base
+                for base in (
+                    re.sub(r'\.\d+$', '', path)
+                    for path in glob.glob(f'{pattern}*')
+                )
+                if fnmatch.fnmatch(base, pattern)
+            })
+        else:
+            bases = [pattern]
+        for base in bases:
+            yield from JsonlSink(
+                base,
+                settings.AUDIT_FILE_MAX_BYTES,
+                settings.AUDIT_FILE_BACKUPS,
+            ).paths()
+
+    def from_jsonl(self, options):
+        count = 0
+        for path in self.jsonl_paths():
+            with open(path, encoding='utf-8') as source:
+                for line in source:
+                    event = json.loads(line)
+                    if not self.matches(event, options):
+                        continue
+                    yield event
+                    count += 1
+                    if options['limit'] and count >= options['limit']:
+                        return
+
+    def matches(self, event, options):
+        for key in ('event', 'outcome', 'user_id'):
+            if options[key] is not None and event[key] != options[key]:
+                return False
+        if options['since'] or options['until']:
+            moment = datetime.fromisoformat(event['timestamp'])
+            if options['since'] and moment < options['since']:
+                return False
+            if options['until'] and moment >= options['until']:
+                return False
+        return True
+
+    def write(self, events, target, output_format):
+        count = 0
+        if output_format == 'csv':
+            writer = csv.DictWriter(target, fieldnames=FIELDS)
+            writer.writeheader()
+            for event in events:
+                writer.writerow(
+                    {**event, 'detail': json.dumps(event['detail'])},
+                )
+                count += 1
+            return count
+        for event in events:
+            target.write(json.dumps(event, ensure_ascii=False) + '\n')
+            count += 1
+        return count
@@ -0,0 +1,52 @@
+import statistics
+import time
+
+import bcrypt
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Замеряет время bcrypt по стоимостям и рекомендует BCRYPT_ROUNDS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-rounds', type=int, default=10)
+        parser.add_argument('--max-rounds', type=int, default=15)
+        parser.add_argument('--samples', type=int, default=3)
+        parser.add_argument(
+            '--target-ms',
+            type=float,
+            default=250.0,
+            help='Допустимое время одного хэширования, мс',
+        )
+
+    def handle(self, *args, **options):
+        password = b'benchmark-password'
+        recommended = None
+        self.stdout.write(f'{"rounds":>6}  {"median, ms":>10}')
+        for rounds in range(options['min_rounds'], options['max_rounds'] + 1):
+            timings = []
+            for _ in range(options['samples']):
+                started = time.perf_counter()
+                bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+                timings.append((time.perf_counter() - started) * 1000)
+            median = statistics.median(timings)
+            self.stdout.write(f'{rounds:>6}  {median:>10.1f}')
+            if median <= options['target_ms']:
+                recommended = rounds
+            else:
+                break
+        if recommended is None:
+            self.stdout.write(
+                self.style.WARNING(
+                    'Ни одна стоимость не укладывается в '
+                    f'{options["target_ms"]} мс',
+                ),
+            )
+            return
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Рекомендуется BCRYPT_ROUNDS={recommended} '
+                f'(сейчас {settings.BCRYPT_ROUNDS})',
+            ),
+        )
@@ -0,0 +1,359 @@
+import itertools
+import json
+import platform
+import statistics
+import time
+from datetime import datetime, timezone
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from core.hashing import hash_password
+from core.middleware import AuthMiddleware
+from core.models import (
+    AccessRule,
+    BusinessElement,
+    CustomUser,
+    Product,
+    Role,
+    UserRole,
+)
+from core.permissions import permission_matrix
+from core.tokens import denylist, issue_token
+
+PASSWORD = 'benchmark-password'
+EMAIL = 'bench-{}@benchmark.local'
+ENDPOINTS = (
+    'login',
+    'auth_middleware',
+    'products_list',
+    'products_list_all',
+    'product_detail',
+)
+
+
+class _Rollback(Exception):
+    pass
+
+
+def percentile(quantiles, p):
+    return quantiles[p - 1]
+
+
+def summarize(timings, queries, elapsed):
+    quantiles = statistics.quantiles(timings, n=100, method='inclusive')
+    return {
+        'requests': len(timings),
+        'p50_ms': round(percentile(quantiles, 50), 3),
+        'p95_ms': round(percentile(quantiles, 95), 3),
+        'p99_ms': round(percentile(quantiles, 99), 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'rps': round(len(timings) / elapsed, 1),
+        'queries_per_request': round(sum(queries) / len(queries), 2),
+    }
+
+
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        limit = previous['p95_ms'] * (1 + tolerance)
+        if current['p95_ms'] > limit:
+            regressions.append(
+                f'{name}: p95 {current["p95_ms"]} мс > {limit:.3f} мс',
+            )
+        if current['queries_per_request'] > previous['queries_per_request']:
+            regressions.append(
+                f'{name}: запросов к БД {current["queries_per_request"]} '
+                f'> {previous["queries_per_request"]}',
+            )
+    return regressions
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный бенчмарк login, AuthMiddleware и products: '
+        'p50/p95/p99, запросы к БД и RPS на синтетических данных. '
+        'Данные создаются в транзакции и откатываются после прогона'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--roles', type=int, default=10)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument(
+            '--login-requests',
+            type=int,
+            default=20,
+            help='Число логинов: каждый стоит одного bcrypt',
+        )
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument(
+            '--bcrypt-rounds',
+            type=int,
+            help='Стоимость bcrypt для синтетических пользователей',
+        )
+        parser.add_argument(
+            '--endpoint',
+            action='append',
+            choices=ENDPOINTS,
+            dest='endpoints',
+            help='Замерять только указанные сценарии (можно повторять)',
+        )
+        parser.add_argument('--output', type=str, help='Путь для JSON')
+        parser.add_argument(
+            '--baseline',
+            type=str,
+            help='JSON предыдущего прогона для сравнения',
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.2,
+            help='Допустимый рост p95 относительно baseline (0.2 = 20%%)',
+        )
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['products'], options['requests']) < 2:
+            raise CommandError(
+                'Нужно минимум 2 пользователя, 2 продукта и 2 запроса',
+            )
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as source:
+                    baseline = json.load(source)['results']
+            except (OSError, ValueError, KeyError) as exc:
+                raise CommandError(f'Некорректный baseline: {exc}') from exc
+        rounds = options['bcrypt_rounds'] or settings.BCRYPT_ROUNDS
+        endpoints = options['endpoints'] or list(ENDPOINTS)
+
+        results = {}
+        overrides = override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+            BCRYPT_ROUNDS=rounds,
+        )
+        try:
+            with overrides, transaction.atomic():
+                started = time.perf_counter()
+                fixtures = self.seed(options, rounds)
+                self.stdout.write(
+                    f'Данные созданы за {time.perf_counter() - started:.1f} с',
+                )
+                for name in endpoints:
+                    results[name] = getattr(self, f'bench_{name}')(
+                        fixtures,
+                        options,
+                    )
+                    self.report(name, results[name])
+                raise _Rollback
+        except _Rollback:
+            pass
+        finally:
+            permission_matrix.invalidate()
+            denylist.reset()
+
+        document = {
+            'meta': {
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'users': options['users'],
+                'roles': options['roles'],
+                'products': options['products'],
+                'bcrypt_rounds': rounds,
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as target:
+                json.dump(document, target, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Результаты записаны в {options["output"]}')
+        if baseline is not None:
+            regressions = find_regressions(
+                results,
+                baseline,
+                options['tolerance'],
+            )
+            if regressions:
+                raise CommandError(
+                    'Регрессия относительно baseline:\n'
+                    + '\n'.join(regressions),
+                )
+            self.stdout.write(self.style.SUCCESS('Регрессий нет'))
+
+    def seed(self, options, rounds):
+        admin_role = Role.objects.create(name='bench-admin')
+        user_role = Role.objects.create(name='bench-user')
+        extra_roles = Role.objects.bulk_create(
+            Role(name=f'bench-role-{i}') for i in range(options['roles'])
+        )
+        products, _ = BusinessElement.objects.get_or_create(name='products')
+        elements = BusinessElement.objects.bulk_create(
+            BusinessElement(name=f'bench-element-{i}')
+            for i in range(options['roles'])
+        )
+        AccessRule.objects.bulk_create(
+            [
+                AccessRule(
+                    role=admin_role,
+                    element=products,
+                    read_all=True,
+                    create=True,
+                    update_all=True,
+                    delete_all=True,
+                ),
+                AccessRule(
+                    role=user_role,
+                    element=products,
+                    read_own=True,
+                    create=True,
+                    update_own=True,
+                    delete_own=True,
+                ),
+                *(
+                    AccessRule(role=role, element=element, read_all=True)
+                    for role, element in zip(extra_roles, elements)
+                ),
+            ],
+        )
+        password_hash = hash_password(PASSWORD, rounds)
+        users = CustomUser.objects.bulk_create(
+            (
+                CustomUser(
+                    email=EMAIL.format(i),
+                    password_hash=password_hash,
+                    first_name='Bench',
+                    last_name=str(i),
+                )
+                for i in range(options['users'])
+            ),
+            batch_size=1000,
+        )
+        if not users[0].pk:
+            users = list(
+                CustomUser.objects.filter(
+                    email__endswith='@benchmark.local',
+                ).order_by('id'),
+            )
+        admin, owner = users[0], users[1]
+        extra = itertools.cycle(extra_roles or [user_role])
+        UserRole.objects.bulk_create(
+            (
+                UserRole(user=user, role=role)
+                for user in users
+                for role in {
+                    admin_role if user is admin else user_role,
+                    next(extra),
+                }
+            ),
+            batch_size=1000,
+        )
+        Product.objects.bulk_create(
+            (
+                Product(name=f'Bench {i}', owner=users[i % len(users)])
+                for i in range(options['products'])
+            ),
+            batch_size=1000,
+        )
+        permission_matrix.on_change()
+        return {
+            'users': users,
+            'admin_token': issue_token(admin),
+            'owner_token': issue_token(owner),
+            'owner_product': Product.objects.filter(owner=owner)
+            .values_list('id', flat=True)
+            .first(),
+        }
+
+    def measure(self, call, count, warmup):
+        for i in range(warmup):
+            call(i)
+        timings, queries = [], []
+        started = time.perf_counter()
+        for i in range(count):
+            with CaptureQueriesContext(connection) as captured:
+                request_started = time.perf_counter()
+                status = call(i)
+                timings.append((time.perf_counter() - request_started) * 1000)
+            queries.append(len(captured))
+            if status >= 400:
+                raise CommandError(f'Неожиданный ответ {status}')
+        return summarize(timings, queries, time.perf_counter() - started)
+
+    def report(self, name, result):
+        self.stdout.write(
+            f'{name:<18} p50 {result["p50_ms"]:>8.2f} мс  '
+            f'p95 {result["p95_ms"]:>8.2f} мс  '
+            f'p99 {result["p99_ms"]:>8.2f} мс  '
+            f'{result["rps"]:>8.1f} RPS  '
+            f'{result["queries_per_request"]:>5.2f} SQL/запрос',
+        )
+
+    def bench_login(self, fixtures, options):
+        client = Client()
+        users = fixtures['users']
+
+        def call(i):
+            response = client.post(
+                '/api/auth/login/',
+                {'email': users[i % len(users)].email, 'password': PASSWORD},
+                content_type='application/json',
+            )
+            return response.status_code
+
+        return self.measure(
+            call,
+            max(2, options['login_requests']),
+            min(options['warmup'], 1),
+        )
+
+    def bench_auth_middleware(self, fixtures, options):
+        factory = RequestFactory()
+        middleware = AuthMiddleware(lambda request: HttpResponse())
+        header = f'Bearer {fixtures["owner_token"]}'
+
+        def call(i):
+            request = factory.get('/', HTTP_AUTHORIZATION=header)
+            middleware(request)
+            return 200 if request.user else 401
+
+        return self.measure(call, options['requests'], options['warmup'])
+
+    def _bench_get(self, path, token, options):
+        client = Client(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        def call(i):
+            return client.get(path).status_code
+
+        return self.measure(call, options['requests'], options['warmup'])
+
+    def bench_products_list(self, fixtures, options):
+        return self._bench_get(
+            '/api/products/',
+            fixtures['owner_token'],
+            options,
+        )
+
+    def bench_products_list_all(self, fixtures, options):
+        return self._bench_get(
+            '/api/products/',
+            fixtures['admin_token'],
+            options,
+        )
+
+    def bench_product_detail(self, fixtures, options):
+        return self._bench_get(
+            f'/api/products/{fixtures["owner_product"]}/',
+            fixtures['owner_token'],
+            options,
+        )
@@ -0,0 +1,100 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.schema import (
+    SCHEMA_FORMATS,
+    compress,
+    schema_artifacts,
+    schema_path,
+)
+
+
+def render_schema(schema_formats):
+    from drf_spectacular.renderers import (
+        OpenApiJsonRenderer,
+        OpenApiYamlRenderer,
+    )
+    from drf_spectacular.settings import spectacular_settings
+
+    renderers = {'json': OpenApiJsonRenderer, 'yaml': OpenApiYamlRenderer}
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+    schema = generator.get_schema(request=None, public=True)
+    return {
+        schema_format: renderers[schema_format]().render(
+            schema,
+            renderer_context={},
+        )
+        for schema_format in schema_formats
+    }
+
+
+def write_atomic(path, content):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as target:
+        target.write(content)
+    os.replace(tmp_path, path)
+
+
+class Command(BaseCommand):
+    help = (
+        'Собирает схему OpenAPI в файлы openapi-<VERSION>.json/.yaml '
+        'и их gzip-версии; /api/schema/ отдаёт их без генерации. '
+        'Запускается при сборке, после изменения views'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dir',
+            type=str,
+            help='Каталог для файлов (по умолчанию API_SCHEMA_DIR)',
+        )
+        parser.add_argument(
+            '--format',
+            action='append',
+            choices=SCHEMA_FORMATS,
+            dest='formats',
+            help='Только указанные форматы (можно повторять)',
+        )
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Не записывать, а завершиться с ошибкой, если файлы '
+            'устарели',
+        )
+
+    def handle(self, *args, **options):
+        if not settings.API_DOCS:
+            raise CommandError(
+                'drf-spectacular отключён: запустите с APP_PROFILE=dev '
+                'или API_DOCS=True',
+            )
+        directory = options['dir'] or settings.API_SCHEMA_DIR
+        rendered = render_schema(options['formats'] or list(SCHEMA_FORMATS))
+        if options['check']:
+            stale = []
+            for schema_format, body in rendered.items():
+                path = schema_path(schema_format, directory)
+                try:
+                    with open(path, 'rb') as source:
+                        if source.read() == body:
+                            continue
+                except FileNotFoundError:
+                    pass
+                stale.append(path)
+            if stale:
+                raise CommandError(
+                    'Схема устарела: ' + ', '.join(stale)
+                    + '. Запустите manage.py build_api_schema',
+                )
+            self.stdout.write(self.style.SUCCESS('Схема актуальна'))
+            return
+
+        os.makedirs(directory, exist_ok=True)
+        for schema_format, body in rendered.items():
+            path = schema_path(schema_format, directory)
+            write_atomic(path, body)
+            write_atomic(f'{path}.gz', compress(body))
+            self.stdout.write(f'{path}: {len(body)} байт')
+        schema_artifacts.reset()
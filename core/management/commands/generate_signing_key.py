@@ -0,0 +1,82 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.signing_keys import ASYMMETRIC_ALGORITHMS, public_jwk
+
+
+def generate_private_key(algorithm):
+    try:
+        from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+    except ImportError as exc:
+        raise CommandError('Нужен пакет "cryptography"') from exc
+    if algorithm == 'EdDSA':
+        return ed25519.Ed25519PrivateKey.generate()
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def private_pem(private_key):
+    from cryptography.hazmat.primitives import serialization
+
+    return private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт закрытый ключ подписи JWT и добавляет открытый ключ '
+        'в JWKS. Старые ключи остаются в JWKS, пока не истекут выданные '
+        'ими токены (REFRESH_TOKEN_LIFETIME)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--algorithm',
+            choices=ASYMMETRIC_ALGORITHMS,
+            default='EdDSA',
+        )
+        parser.add_argument('--private-key', type=str, required=True)
+        parser.add_argument('--jwks', type=str, required=True)
+        parser.add_argument('--kid', type=str)
+
+    def handle(self, *args, **options):
+        if os.path.exists(options['private_key']):
+            raise CommandError(
+                f'Файл уже существует: {options["private_key"]}',
+            )
+        jwks = {'keys': []}
+        if os.path.exists(options['jwks']):
+            with open(options['jwks'], encoding='utf-8') as source:
+                jwks = json.load(source)
+        private_key = generate_private_key(options['algorithm'])
+        jwk = public_jwk(
+            private_key.public_key(),
+            options['algorithm'],
+            options['kid'],
+        )
+        if any(key.get('kid') == jwk['kid'] for key in jwks['keys']):
+            raise CommandError(f'kid уже есть в JWKS: {jwk["kid"]}')
+
+        descriptor = os.open(
+            options['private_key'],
+            os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+            0o600,
+        )
+        with os.fdopen(descriptor, 'wb') as target:
+            target.write(private_pem(private_key))
+        jwks['keys'].append(jwk)
+        tmp_path = f'{options["jwks"]}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as target:
+            json.dump(jwks, target, indent=2)
+        os.replace(tmp_path, options['jwks'])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Ключ {jwk["kid"]} создан. Укажите JWT_ALGORITHM='
+                f'{options["algorithm"]}, JWT_PRIVATE_KEY_FILE, '
+                f'JWT_KEY_ID={jwk["kid"]} и JWT_JWKS_FILE',
+            ),
+        )
@@ -25,12 +25,13 @@ class Command(BaseCommand):
             defaults={'description': 'Правила управления доступом'},
         )
 
+        # admin наследует правила user и добавляет доступ ко всем объектам.
+        admin_role.parents.add(user_role)
         AccessRule.objects.get_or_create(
             role=admin_role,
             element=products,
             defaults={
                 'read_all': True,
-                'create': True,
                 'update_all': True,
                 'delete_all': True,
             },
@@ -38,7 +39,12 @@ class Command(BaseCommand):
         AccessRule.objects.get_or_create(
             role=admin_role,
             element=access_rules_el,
-            defaults={'read_all': True, 'create': True},
+            defaults={
+                'read_all': True,
+                'create': True,
+                'update_all': True,
+                'delete_all': True,
+            },
         )
 
         AccessRule.objects.get_or_create(
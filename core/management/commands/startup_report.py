@@ -0,0 +1,184 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+PROFILES = ('dev', 'production')
+
+# Выполняется в отдельном процессе: холодный старт нельзя замерить
+# в процессе, где Django уже загружен.
+PROBE = '''
+import json
+import statistics
+import sys
+import time
+
+started = time.perf_counter()
+import django
+
+django.setup()
+from django.conf import settings
+from django.core.handlers.base import BaseHandler
+from django.urls import get_resolver
+
+handler = BaseHandler()
+handler.load_middleware()
+get_resolver().url_patterns
+startup = time.perf_counter() - started
+
+from django.test import RequestFactory
+from django.urls import resolve
+
+factory = RequestFactory()
+count = int(sys.argv[1])
+
+
+def median_us(call):
+    for _ in range(min(count, 20)):
+        call()
+    timings = []
+    for _ in range(count):
+        call_started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - call_started)
+    return statistics.median(timings) * 1e6
+
+
+paths = {}
+for path in sys.argv[2:]:
+    view = resolve(path).func
+    status = handler.get_response(factory.get(path)).status_code
+    full = median_us(lambda: handler.get_response(factory.get(path)))
+    bare = median_us(lambda: view(factory.get(path)))
+    paths[path] = {
+        'status': status,
+        'request_us': round(full, 1),
+        'view_us': round(bare, 1),
+        'middleware_us': round(full - bare, 1),
+    }
+
+print(json.dumps({
+    'startup_ms': round(startup * 1000, 1),
+    'modules': len(sys.modules),
+    'middleware': list(settings.MIDDLEWARE),
+    'loaded': {
+        name: name in sys.modules
+        for name in (
+            'drf_spectacular',
+            'django.contrib.auth.models',
+            'django.contrib.sessions',
+        )
+    },
+    'paths': paths,
+}))
+'''
+PATHS = ('/api/auth/jwks/', '/api/products/')
+
+
+class Command(BaseCommand):
+    help = (
+        'Холодный старт (django.setup, urls, middleware) и накладные '
+        'расходы middleware на запрос для профилей APP_PROFILE. Каждый '
+        'прогон — отдельный процесс; в отчёте медианы по прогонам'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profile',
+            action='append',
+            choices=PROFILES,
+            dest='profiles',
+            help='Замерять только указанные профили (можно повторять)',
+        )
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=500,
+            help='Запросов на URL в каждом прогоне',
+        )
+        parser.add_argument('--output', type=str, help='Путь для JSON')
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1 or options['requests'] < 1:
+            raise CommandError('Нужен минимум 1 прогон и 1 запрос')
+        results = {}
+        for profile in options['profiles'] or PROFILES:
+            runs = [
+                self.probe(profile, options['requests'])
+                for _ in range(options['runs'])
+            ]
+            results[profile] = self.aggregate(runs)
+            self.report(profile, results[profile])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as target:
+                json.dump(results, target, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Результаты записаны в {options["output"]}')
+
+    def probe(self, profile, requests):
+        env = {
+            **os.environ,
+            'APP_PROFILE': profile,
+            'ALLOWED_HOSTS': ','.join(
+                filter(None, [os.getenv('ALLOWED_HOSTS'), 'testserver']),
+            ),
+        }
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'auth_system.settings')
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, '-c', PROBE, str(requests), *PATHS],
+            capture_output=True,
+            env=env,
+            text=True,
+        )
+        elapsed = time.perf_counter() - started
+        if completed.returncode:
+            raise CommandError(
+                f'Профиль {profile} не запустился:\n{completed.stderr}',
+            )
+        result = json.loads(completed.stdout)
+        result['process_ms'] = round(elapsed * 1000, 1)
+        return result
+
+    def aggregate(self, runs):
+        def median(values):
+            return round(statistics.median(values), 1)
+
+        paths = {}
+        for path in runs[0]['paths']:
+            samples = [run['paths'][path] for run in runs]
+            paths[path] = {
+                'status': samples[0]['status'],
+                **{
+                    key: median(sample[key] for sample in samples)
+                    for key in ('request_us', 'view_us', 'middleware_us')
+                },
+            }
+        return {
+            'runs': len(runs),
+            'process_ms': median(run['process_ms'] for run in runs),
+            'startup_ms': median(run['startup_ms'] for run in runs),
+            'modules': runs[0]['modules'],
+            'middleware': runs[0]['middleware'],
+            'loaded': runs[0]['loaded'],
+            'paths': paths,
+        }
+
+    def report(self, profile, result):
+        self.stdout.write(
+            f'{profile:<11} процесс {result["process_ms"]:>7.1f} мс  '
+            f'старт Django {result["startup_ms"]:>7.1f} мс  '
+            f'модулей {result["modules"]:>5}  '
+            f'middleware {len(result["middleware"])}',
+        )
+        for path, timing in result['paths'].items():
+            self.stdout.write(
+                f'  {path:<18} {timing["status"]}  '
+                f'запрос {timing["request_us"]:>7.1f} мкс  '
+                f'view {timing["view_us"]:>7.1f} мкс  '
+                f'middleware {timing["middleware_us"]:>7.1f} мкс',
+            )
@@ -1,31 +1,237 @@
+import functools
+
 import jwt
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.conf import settings
-from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import LazyObject, SimpleLazyObject, empty
 
+from . import audit
+from .instrumentation import timed, timer
 from .models import CustomUser
+from .permissions import (
+    end_request_cache,
+    permission_matrix,
+    start_request_cache,
+)
+from .throttling import dummy_password_hash, get_client_ip
+from .tokens import (
+    adecode_token,
+    ais_user_active,
+    decode_token,
+    get_bearer_token,
+    is_user_active,
+)
+
+
+class SnapshotUser(LazyObject):
+    """
+    Пользователь из снимка в токене: id и роли доступны сразу,
+    CustomUser загружается из БД только при обращении к полям модели.
+    """
+
+    is_anonymous = False
+    is_authenticated = True
+
+    def __init__(self, user_id, role_ids=None):
+        super().__init__()
+        self.__dict__['_user_id'] = user_id
+        if role_ids is not None:
+            self.__dict__['role_ids'] = tuple(role_ids)
+
+    def _setup(self):
+        self._wrapped = CustomUser.objects.get(id=self._user_id)
+
+    @property
+    def id(self):
+        return self._user_id
+
+    pk = id
+
+    @property
+    def has_loaded_roles(self):
+        return 'role_ids' in self.__dict__
+
+    @property
+    def is_active(self):
+        if self._wrapped is empty:
+            return True
+        return self._wrapped.is_active
+
+    def __bool__(self):
+        return True
+
+    def __copy__(self):
+        if self._wrapped is empty:
+            return type(self)(self._user_id, self.__dict__.get('role_ids'))
+        return super().__copy__()
+
+    def __deepcopy__(self, memo):
+        if self._wrapped is empty:
+            result = type(self)(
+                self._user_id,
+                self.__dict__.get('role_ids'),
+            )
+            memo[id(self)] = result
+            return result
+        return super().__deepcopy__(memo)
+
+
+def audit_token_failure(request, reason, user_id=None):
+    """Отклонённый токен в журнал аудита; reason — исключение или строка."""
+    if isinstance(reason, jwt.ExpiredSignatureError):
+        reason = 'expired'
+    elif isinstance(reason, jwt.InvalidTokenError):
+        reason = 'invalid'
+    audit.record(
+        'token',
+        'failure',
+        user_id,
+        get_client_ip(request),
+        reason=reason,
+    )
+
+
+class HybridMiddleware:
+    """
+    Middleware и для WSGI, и для ASGI: под ASGI запрос не уходит
+    в поток через sync_to_async, как у MiddlewareMixin.
+    """
+
+    sync_capable = True
+    async_capable = True
 
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        self.process_request(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        self.process_request(request)
+        response = await self.get_response(request)
+        return self.process_response(request, response)
 
-class AuthMiddleware(MiddlewareMixin):
     def process_request(self, request):
-        request.user = None
-        auth_header = request.META.get('HTTP_AUTHORIZATION')
-        if auth_header and auth_header.startswith('Bearer '):
-            token = auth_header.split(' ')[1]
+        pass
+
+    def process_response(self, request, response):
+        return response
+
+
+class AuthMiddleware(HybridMiddleware):
+    """
+    request.user вычисляется лениво: подпись токена проверяется и
+    пользователь загружается только при первом обращении из view.
+    Async-views получают пользователя через await request.auser().
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        # bcrypt-хэш для неизвестных email считается при загрузке
+        # middleware, а не на первом таком входе в event loop.
+        dummy_password_hash()
+
+    def process_request(self, request):
+        request.user = SimpleLazyObject(lambda: self.get_user(request))
+        request.auser = functools.partial(self.auser, request)
+
+    @timed('auth')
+    def get_user(self, request):
+        token = get_bearer_token(request)
+        if not token:
+            return None
+        try:
+            payload = decode_token(token)
+        except jwt.InvalidTokenError as exc:
+            audit_token_failure(request, exc)
+            return None
+        user_id = payload.get('user_id')
+        if not user_id:
+            return None
+        if settings.AUTH_STATELESS_TOKENS and 'roles' in payload:
+            user = self.get_snapshot_user(user_id, payload)
+        else:
             try:
-                payload = jwt.decode(
-                    token,
-                    settings.SECRET_KEY,
-                    algorithms=['HS256'],
+                user = CustomUser.objects.get_with_permissions(
+                    id=user_id,
+                    is_active=True,
                 )
-                user_id = payload.get('user_id')
-                if user_id:
-                    try:
-                        user = CustomUser.objects.get(
-                            id=user_id,
-                            is_active=True,
-                        )
-                        request.user = user
-                    except CustomUser.DoesNotExist:
-                        pass
-            except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
-                pass
+            except CustomUser.DoesNotExist:
+                user = None
+        if user is None:
+            audit_token_failure(request, 'inactive_user', user_id)
+        return user
+
+    async def auser(self, request):
+        if not hasattr(request, '_acached_user'):
+            with timer('auth'):
+                request._acached_user = await self.aget_user(request)
+        return request._acached_user
+
+    async def aget_user(self, request):
+        token = get_bearer_token(request)
+        if not token:
+            return None
+        try:
+            payload = await adecode_token(token)
+        except jwt.InvalidTokenError as exc:
+            audit_token_failure(request, exc)
+            return None
+        user_id = payload.get('user_id')
+        if not user_id:
+            return None
+        if settings.AUTH_STATELESS_TOKENS and 'roles' in payload:
+            if not await ais_user_active(user_id):
+                audit_token_failure(request, 'inactive_user', user_id)
+                return None
+            snapshot = await permission_matrix.aensure_snapshot()
+            trusted = await permission_matrix.atrusts_token_roles(
+                user_id,
+                payload.get('pv'),
+                snapshot[0],
+                payload.get('iat'),
+            )
+            return self.snapshot_user(user_id, payload, trusted)
+        try:
+            return await CustomUser.objects.aget_with_permissions(
+                id=user_id,
+                is_active=True,
+            )
+        except CustomUser.DoesNotExist:
+            audit_token_failure(request, 'inactive_user', user_id)
+            return None
+
+    def get_snapshot_user(self, user_id, payload):
+        if not is_user_active(user_id):
+            return None
+        trusted = permission_matrix.trusts_token_roles(
+            user_id,
+            payload.get('pv'),
+            payload.get('iat'),
+        )
+        return self.snapshot_user(user_id, payload, trusted)
+
+    def snapshot_user(self, user_id, payload, trusted):
+        # Недоверенные роли загружаются через permission_matrix.role_ids.
+        role_ids = payload['roles'] if trusted else None
+        return SnapshotUser(user_id, role_ids)
+
+
+class PermissionCacheMiddleware(HybridMiddleware):
+    """
+    Кэш проверок прав на время запроса: набор ролей каждого
+    пользователя разрешается не больше одного раза.
+    """
+
+    def process_request(self, request):
+        request.permission_cache = start_request_cache()
+
+    def process_response(self, request, response):
+        end_request_cache()
+        return response
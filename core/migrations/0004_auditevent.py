@@ -0,0 +1,45 @@
+# Generated by Django 5.0 on 2026-10-18 08:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_product'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditEvent',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                ('created_at', models.DateTimeField(db_index=True)),
+                ('event', models.CharField(max_length=32)),
+                ('outcome', models.CharField(max_length=32)),
+                ('user_id', models.BigIntegerField(null=True)),
+                ('ip', models.GenericIPAddressField(null=True)),
+                ('detail', models.JSONField(default=dict)),
+            ],
+            options={
+                'indexes': [
+                    models.Index(
+                        fields=['event', 'created_at'],
+                        name='core_audite_event_b49bf6_idx',
+                    ),
+                    models.Index(
+                        fields=['user_id', 'created_at'],
+                        name='core_audite_user_id_69cb1f_idx',
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_auditevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accessrule',
+            name='conditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
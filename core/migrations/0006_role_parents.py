@@ -0,0 +1,22 @@
+# Generated by Django 5.0 on 2026-10-18 08:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_accessrule_conditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='role',
+            name='parents',
+            field=models.ManyToManyField(
+                blank=True,
+                related_name='children',
+                to='core.role',
+            ),
+        ),
+    ]
@@ -1,5 +1,60 @@
-import bcrypt
 from django.db import models
+from django.utils.functional import cached_property
+
+from core.hashing import hash_password, needs_rehash, verify_password
+from core.instrumentation import timed
+
+
+class CustomUserQuerySet(models.QuerySet):
+    def with_permissions(self):
+        """Роли пользователей подгружаются одним запросом на выборку."""
+        return self.prefetch_related(
+            models.Prefetch(
+                'userrole_set',
+                queryset=UserRole.objects.only('id', 'user_id', 'role_id'),
+            ),
+        )
+
+
+class CustomUserManager(models.Manager.from_queryset(CustomUserQuerySet)):
+    def _with_roles_rows(self, filters):
+        field_names = [
+            field.attname for field in self.model._meta.concrete_fields
+        ]
+        rows = self.filter(**filters).values_list(
+            *field_names,
+            'userrole__role_id',
+        )
+        return field_names, rows
+
+    def get_with_permissions(self, **filters):
+        """
+        Пользователь и id его ролей за один запрос (LEFT JOIN UserRole).
+        """
+        field_names, rows = self._with_roles_rows(filters)
+        return self._user_from_rows(field_names, list(rows))
+
+    async def aget_with_permissions(self, **filters):
+        field_names, rows = self._with_roles_rows(filters)
+        return self._user_from_rows(field_names, [row async for row in rows])
+
+    def _user_from_rows(self, field_names, rows):
+        if not rows:
+            raise self.model.DoesNotExist(
+                f'{self.model._meta.object_name} matching query '
+                'does not exist.',
+            )
+        pk_index = field_names.index(self.model._meta.pk.attname)
+        if len({row[pk_index] for row in rows}) > 1:
+            raise self.model.MultipleObjectsReturned(
+                f'get_with_permissions() returned more than one '
+                f'{self.model._meta.object_name}.',
+            )
+        user = self.model.from_db(self.db, field_names, rows[0][:-1])
+        user.role_ids = tuple(
+            row[-1] for row in rows if row[-1] is not None
+        )
+        return user
 
 
 class CustomUser(models.Model):
@@ -15,20 +70,51 @@ class CustomUser(models.Model):
     is_anonymous = False
     is_authenticated = True
 
+    objects = CustomUserManager()
+
     class Meta:
         app_label = 'core'
 
+    @property
+    def has_loaded_roles(self):
+        prefetched = getattr(self, '_prefetched_objects_cache', {})
+        return 'role_ids' in self.__dict__ or 'userrole_set' in prefetched
+
+    @cached_property
+    def role_ids(self):
+        prefetched = getattr(self, '_prefetched_objects_cache', {})
+        if 'userrole_set' in prefetched:
+            return tuple(
+                user_role.role_id
+                for user_role in prefetched['userrole_set']
+            )
+        return tuple(
+            UserRole.objects.filter(user=self).values_list(
+                'role_id',
+                flat=True,
+            ),
+        )
+
+    @cached_property
+    def effective_rules(self):
+        """element_name -> маска прав с учётом всех ролей пользователя."""
+        from core.permissions import permission_matrix
+
+        return permission_matrix.effective_masks(self.role_ids)
+
+    @timed('password')
     def set_password(self, password):
-        self.password_hash = bcrypt.hashpw(
-            password.encode('utf-8'),
-            bcrypt.gensalt(),
-        ).decode('utf-8')
+        self.password_hash = hash_password(password)
 
+    @timed('password')
     def check_password(self, password):
-        return bcrypt.checkpw(
-            password.encode('utf-8'),
-            self.password_hash.encode('utf-8'),
-        )
+        if not verify_password(password, self.password_hash):
+            return False
+        if needs_rehash(self.password_hash):
+            self.set_password(password)
+            if self.pk:
+                self.save(update_fields=['password_hash'])
+        return True
 
     def __str__(self):
         return self.email
@@ -37,6 +123,14 @@ class CustomUser(models.Model):
 class Role(models.Model):
     name = models.CharField(max_length=50, unique=True)
     description = models.TextField(blank=True)
+    # Роль получает все правила родителей (и их родителей): транзитивное
+    # замыкание и объединённые маски собираются в матрице прав.
+    parents = models.ManyToManyField(
+        'self',
+        symmetrical=False,
+        related_name='children',
+        blank=True,
+    )
 
     def __str__(self):
         return self.name
@@ -68,6 +162,57 @@ class AccessRule(models.Model):
     update_all = models.BooleanField(default=False)
     delete_own = models.BooleanField(default=False)
     delete_all = models.BooleanField(default=False)
+    # Условия правила (см. core.policies): {'hours': [9, 18],
+    # 'weekdays': [0, 1, 2, 3, 4], 'attributes': {'ip': ['10.0.0.1']}}.
+    conditions = models.JSONField(default=dict, blank=True)
 
     class Meta:
         unique_together = ('role', 'element')
+
+
+class RevokedToken(models.Model):
+    jti = models.CharField(max_length=32, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.jti
+
+
+class AuditEvent(models.Model):
+    """
+    Журнал аудита: входы, отклонённые токены и отказы в доступе.
+    Только добавление; пишется пачками из core.audit, user_id без FK —
+    записи переживают удаление пользователя.
+    """
+
+    created_at = models.DateTimeField(db_index=True)
+    event = models.CharField(max_length=32)
+    outcome = models.CharField(max_length=32)
+    user_id = models.BigIntegerField(null=True)
+    ip = models.GenericIPAddressField(null=True)
+    detail = models.JSONField(default=dict)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['event', 'created_at']),
+            models.Index(fields=['user_id', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.event}:{self.outcome}'
+
+
+class Product(models.Model):
+    name = models.CharField(max_length=255)
+    owner = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Keyset-пагинация по id внутри объектов владельца.
+            models.Index(fields=['owner', 'id']),
+        ]
+
+    def __str__(self):
+        return self.name
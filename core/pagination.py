@@ -0,0 +1,49 @@
+from rest_framework.pagination import Cursor, CursorPagination
+from rest_framework.request import Request
+
+
+class ProductCursorPagination(CursorPagination):
+    """Keyset-пагинация по id: стоимость страницы не зависит от её номера."""
+
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    async def apaginate(self, queryset, request):
+        """
+        Async-вариант для уникального ordering='id': страница читается
+        через async ORM, курсоры совместимы с sync-версией.
+        Возвращает страницу и ссылки {'next', 'previous'}.
+        """
+        self.request = Request(request)
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(self.request)
+        cursor = self.decode_cursor(self.request)
+        reverse = cursor.reverse if cursor else False
+        position = cursor.position if cursor else None
+
+        queryset = queryset.order_by('-id' if reverse else 'id')
+        if position is not None:
+            lookup = 'id__lt' if reverse else 'id__gt'
+            queryset = queryset.filter(**{lookup: position})
+        page = [obj async for obj in queryset[:page_size + 1]]
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if reverse:
+            page.reverse()
+
+        links = {'next': None, 'previous': None}
+        if page:
+            has_next = position is not None if reverse else has_more
+            has_previous = has_more if reverse else position is not None
+            if has_next:
+                links['next'] = self._link(page[-1].id, False)
+            if has_previous:
+                links['previous'] = self._link(page[0].id, True)
+        return page, links
+
+    def _link(self, position, reverse):
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=reverse, position=str(position)),
+        )
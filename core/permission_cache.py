@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+_missing = object()
+
+
+class LRUCache:
+    """Локальный (L1) кэш процесса: LRU с ограничением размера и TTL."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _missing)
+            if item is _missing:
+                return default
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def __len__(self):
+        return len(self._data)
+
+
+class LocalChannel:
+    """
+    Pub/sub в пределах процесса. Подходит для одного воркера и тестов;
+    в кластере используется RedisChannel.
+    """
+
+    def __init__(self):
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def publish(self, message):
+        for callback in list(self._subscribers):
+            callback(message)
+
+
+class RedisChannel:
+    """Pub/sub через Redis: сообщения доходят до всех воркеров всех узлов."""
+
+    def __init__(self, url=None, name='permissions'):
+        try:
+            import redis
+        except ImportError as exc:
+            raise ImproperlyConfigured(
+                'RedisChannel requires the "redis" package.',
+            ) from exc
+        self._client = redis.Redis.from_url(
+            url or settings.PERMISSION_CACHE_CHANNEL_URL,
+        )
+        self._name = name
+        self._subscribers = []
+        self._thread = None
+
+    def _dispatch(self, message):
+        data = message['data']
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        for callback in list(self._subscribers):
+            callback(data)
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+        if self._thread is None:
+            pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self._name: self._dispatch})
+            self._thread = pubsub.run_in_thread(
+                sleep_time=0.01,
+                daemon=True,
+            )
+
+    def publish(self, message):
+        self._client.publish(self._name, message)
+
+
+_channel = None
+_channel_lock = threading.Lock()
+
+
+def get_channel():
+    global _channel
+    if _channel is None:
+        with _channel_lock:
+            if _channel is None:
+                _channel = import_string(settings.PERMISSION_CACHE_CHANNEL)()
+    return _channel
@@ -1,37 +1,656 @@
-from rest_framework.exceptions import AuthenticationFailed, PermissionDenied
+import contextlib
+import contextvars
+import threading
+import time
+import uuid
 
-from core.models import AccessRule, BusinessElement, UserRole
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from rest_framework.exceptions import (
+    AuthenticationFailed,
+    PermissionDenied,
+    ValidationError,
+)
 
+from core.audit import audit_log
+from core.db_routers import use_primary
+from core.instrumentation import timed
+from core.models import AccessRule, BusinessElement, CustomUser, Role, UserRole
+from core.permission_cache import LRUCache, get_channel
+from core.policies import PolicyEngine, compile_actions
+from core.throttling import get_client_ip
 
-def check_permission(user, element_name, action, obj_owner_id=None):
+RULE_FLAGS = (
+    'read_own',
+    'read_all',
+    'create',
+    'update_own',
+    'update_all',
+    'delete_own',
+    'delete_all',
+)
+FLAG_BITS = {flag: 1 << index for index, flag in enumerate(RULE_FLAGS)}
+
+SCOPE_ALL = 'all'
+SCOPE_OWN = 'own'
+
+GENERATION_KEY = 'permissions:generation'
+# v3: маски ролей объединены с масками предков.
+MATRIX_KEY = 'permissions:matrix:v3:{}'
+ROLES_KEY = 'permissions:roles:{}:{}'
+# Время последней смены ролей пользователя: общее для всех воркеров,
+# живёт столько же, сколько access-токен.
+ROLES_CHANGED_KEY = 'permissions:roles-changed:{}'
+MATRIX_MESSAGE = 'matrix'
+ROLES_MESSAGE = 'roles:'
+
+_pending_changes = contextvars.ContextVar('permission_changes', default=None)
+
+
+def role_closure(edges):
+    """
+    [(role_id, parent_id)] -> {role_id: frozenset(роль и все её предки)}.
+    Циклы не зацикливают обход: роли цикла получают права друг друга.
+    """
+    parents = {}
+    for role_id, parent_id in edges:
+        parents.setdefault(role_id, set()).add(parent_id)
+        parents.setdefault(parent_id, set())
+    closure = {}
+    for role_id in parents:
+        seen = {role_id}
+        stack = [role_id]
+        while stack:
+            for parent_id in parents[stack.pop()]:
+                if parent_id not in seen:
+                    seen.add(parent_id)
+                    stack.append(parent_id)
+        closure[role_id] = frozenset(seen)
+    return closure
+
+
+class PermissionMatrix:
+    """
+    Скомпилированная матрица прав: (role_id, element_name) -> mask.
+
+    Двухуровневый кэш: L1 — память процесса (LRU с TTL), L2 — общий
+    Django cache (PERMISSION_CACHE). Снимок матрицы в L2 хранится под
+    ключом текущего поколения; при изменении прав поколение меняется,
+    а воркеры получают сообщение через канал pub/sub и сбрасывают L1.
+    """
+
+    def __init__(self, channel=None):
+        self._lock = threading.Lock()
+        self._channel = channel
+        self._subscribed = False
+        self._snapshot = None
+        self._built_at = 0.0
+        self._epoch = 0
+        self._user_roles = LRUCache(
+            settings.PERMISSION_CACHE_L1_SIZE,
+            settings.PERMISSION_CACHE_L1_TTL,
+        )
+        self._role_changes = LRUCache(
+            settings.PERMISSION_CACHE_L1_SIZE,
+            settings.ACCESS_TOKEN_LIFETIME,
+        )
+
+    @property
+    def l2(self):
+        return caches[settings.PERMISSION_CACHE]
+
+    @property
+    def channel(self):
+        self._ensure_subscribed()
+        return self._channel
+
+    def _ensure_subscribed(self):
+        if self._subscribed:
+            return
+        if self._channel is None:
+            self._channel = get_channel()
+        self._subscribed = True
+        self._channel.subscribe(self.handle_message)
+
+    @property
+    def generation(self):
+        return self._get_snapshot()[0]
+
+    def handle_message(self, message):
+        if message == MATRIX_MESSAGE:
+            self._epoch += 1
+            self._snapshot = None
+            self._user_roles.clear()
+        elif message.startswith(ROLES_MESSAGE):
+            for user_id in message[len(ROLES_MESSAGE):].split(','):
+                user_id = int(user_id)
+                self._user_roles.pop(user_id)
+                self._role_changes.set(user_id, True)
+
+    def invalidate(self):
+        """Изменились правила, роли или элементы: новое поколение."""
+        self.l2.set(GENERATION_KEY, uuid.uuid4().hex, None)
+        self.handle_message(MATRIX_MESSAGE)
+        self.channel.publish(MATRIX_MESSAGE)
+
+    def invalidate_users(self, user_ids):
+        """Изменились роли пользователей: одно сообщение на всех."""
+        user_ids = sorted(set(user_ids))
+        if not user_ids:
+            return
+        generation = self.l2.get(GENERATION_KEY)
+        if generation is not None:
+            self.l2.delete_many(
+                [ROLES_KEY.format(generation, pk) for pk in user_ids],
+            )
+        # Воркер, пропустивший сообщение (или перезапущенный), узнает
+        # о смене ролей из L2 и не поверит ролям в старом токене.
+        changed_at = time.time()
+        self.l2.set_many(
+            {ROLES_CHANGED_KEY.format(pk): changed_at for pk in user_ids},
+            settings.ACCESS_TOKEN_LIFETIME,
+        )
+        message = ROLES_MESSAGE + ','.join(map(str, user_ids))
+        self.handle_message(message)
+        self.channel.publish(message)
+
+    def invalidate_user(self, user_id):
+        self.invalidate_users([user_id])
+
+    def on_change(self, user_ids=None):
+        """
+        Сброс после изменения в БД: сразу и повторно после коммита —
+        другие воркеры могли собрать кэш до того, как изменения стали
+        видны. Внутри batch_changes() сброс откладывается до выхода.
+        """
+        pending = _pending_changes.get()
+        if pending is not None:
+            if user_ids is None:
+                pending['matrix'] = True
+            else:
+                pending['users'].update(user_ids)
+            return
+        user_ids = None if user_ids is None else tuple(user_ids)
+        self._apply_change(user_ids)
+        transaction.on_commit(lambda: self._apply_change(user_ids))
+
+    def _apply_change(self, user_ids):
+        if user_ids is None:
+            self.invalidate()
+        else:
+            self.invalidate_users(user_ids)
+
+    @contextlib.contextmanager
+    def batch_changes(self):
+        """Один сброс кэша на всю пачку изменений вместо сброса на строку."""
+        pending = {'matrix': False, 'users': set()}
+        token = _pending_changes.set(pending)
+        try:
+            yield
+        finally:
+            _pending_changes.reset(token)
+        if pending['matrix']:
+            self.on_change()
+        elif pending['users']:
+            self.on_change(pending['users'])
+
+    def _current_generation(self):
+        generation = uuid.uuid4().hex
+        if not self.l2.add(GENERATION_KEY, generation, None):
+            generation = self.l2.get(GENERATION_KEY)
+        return generation
+
+    def _build(self):
+        # Снимок попадает в общий L2 под новым поколением: читаем
+        # с основной БД, чтобы не закэшировать отставшую реплику.
+        with use_primary():
+            rows = list(
+                AccessRule.objects.values_list(
+                    'role_id',
+                    'element__name',
+                    'conditions',
+                    *RULE_FLAGS,
+                ),
+            )
+            edges = list(
+                Role.parents.through.objects.values_list(
+                    'from_role_id',
+                    'to_role_id',
+                ),
+            )
+            elements = frozenset(
+                BusinessElement.objects.values_list('name', flat=True),
+            )
+        own_rules = {}
+        for role_id, element_name, conditions, *flags in rows:
+            mask = 0
+            for bit, enabled in zip(FLAG_BITS.values(), flags):
+                if enabled:
+                    mask |= bit
+            own_rules.setdefault(role_id, []).append(
+                (element_name, mask, conditions),
+            )
+        # Наследование разворачивается здесь, при смене поколения:
+        # на проверке права вложенной роли стоят столько же, сколько
+        # права роли без родителей.
+        closure = role_closure(edges)
+        masks = {}
+        conditional = {}
+        for role_id in own_rules.keys() | closure.keys():
+            for source_id in closure.get(role_id, (role_id,)):
+                for element_name, mask, conditions in own_rules.get(
+                    source_id,
+                    (),
+                ):
+                    key = (role_id, element_name)
+                    if conditions:
+                        # Условные правила не входят в маску: их
+                        # проверяет PolicyEngine на каждый запрос.
+                        conditional.setdefault(key, []).append(
+                            (mask, conditions),
+                        )
+                    else:
+                        masks[key] = masks.get(key, 0) | mask
+        conditional = {
+            key: tuple(rules) for key, rules in conditional.items()
+        }
+        return elements, masks, conditional
+
+    def _get_snapshot(self):
+        self._ensure_subscribed()
+        snapshot = self._snapshot
+        ttl = settings.PERMISSION_CACHE_L1_TTL
+        if snapshot is not None and time.monotonic() - self._built_at < ttl:
+            return snapshot
+        with self._lock:
+            if self._snapshot is not None and snapshot is not self._snapshot:
+                return self._snapshot
+            epoch = self._epoch
+            generation = self._current_generation()
+            key = MATRIX_KEY.format(generation)
+            built = self.l2.get(key)
+            if built is None:
+                built = self._build()
+                self.l2.set(key, built, settings.PERMISSION_CACHE_L2_TTL)
+            snapshot = (generation, *built)
+            # Инвалидация во время сборки: снимок не запоминаем.
+            if epoch == self._epoch:
+                self._snapshot = snapshot
+                self._built_at = time.monotonic()
+            return snapshot
+
+    async def aensure_snapshot(self):
+        """
+        Для async-кода: снимок собирается в потоке, только если его нет
+        в L1; дальше проверки прав работают без обращений к БД.
+        Возвращает снимок — поколение берётся из него, а не из
+        self.generation, который при истёкшем TTL пошёл бы в БД.
+        """
+        snapshot = self._snapshot
+        ttl = settings.PERMISSION_CACHE_L1_TTL
+        if snapshot is None or time.monotonic() - self._built_at >= ttl:
+            snapshot = await sync_to_async(self._get_snapshot)()
+        return snapshot
+
+    def snapshot(self):
+        """(поколение, элементы, маски, условные правила)."""
+        return self._get_snapshot()
+
+    def has_element(self, element_name):
+        return element_name in self._get_snapshot()[1]
+
+    def role_ids(self, user_id):
+        role_ids = self._user_roles.get(user_id)
+        if role_ids is not None:
+            return role_ids
+        key = ROLES_KEY.format(self.generation, user_id)
+        role_ids = self.l2.get(key)
+        if role_ids is None:
+            # Результат попадает в общий L2: отставшая реплика вернула
+            # бы отозванную роль всем воркерам.
+            with use_primary():
+                role_ids = tuple(
+                    UserRole.objects.filter(user_id=user_id).values_list(
+                        'role_id',
+                        flat=True,
+                    ),
+                )
+            self.l2.set(key, role_ids, settings.PERMISSION_CACHE_L2_TTL)
+        self._user_roles.set(user_id, role_ids)
+        return role_ids
+
+    async def arole_ids(self, user_id):
+        role_ids = self._user_roles.get(user_id)
+        if role_ids is not None:
+            return role_ids
+        generation = (await self.aensure_snapshot())[0]
+        key = ROLES_KEY.format(generation, user_id)
+        role_ids = await self.l2.aget(key)
+        if role_ids is None:
+            with use_primary():
+                role_ids = tuple([
+                    role_id
+                    async for role_id in UserRole.objects.filter(
+                        user_id=user_id,
+                    ).values_list('role_id', flat=True)
+                ])
+            await self.l2.aset(
+                key,
+                role_ids,
+                settings.PERMISSION_CACHE_L2_TTL,
+            )
+        self._user_roles.set(user_id, role_ids)
+        return role_ids
+
+    def _trusts_locally(self, user_id, generation, current):
+        return generation == current and user_id not in self._role_changes
+
+    @staticmethod
+    def _issued_after(issued_at, changed_at):
+        return changed_at is None or (
+            issued_at is not None and issued_at > changed_at
+        )
+
+    def trusts_token_roles(self, user_id, generation, issued_at=None):
+        """
+        Роли из токена актуальны, если он выпущен в текущем поколении
+        и после последней смены ролей пользователя (ROLES_CHANGED_KEY).
+        """
+        if not self._trusts_locally(user_id, generation, self.generation):
+            return False
+        changed_at = self.l2.get(ROLES_CHANGED_KEY.format(user_id))
+        return self._issued_after(issued_at, changed_at)
+
+    async def atrusts_token_roles(
+        self,
+        user_id,
+        generation,
+        current,
+        issued_at=None,
+    ):
+        """trusts_token_roles для async-кода: current — поколение снимка."""
+        if not self._trusts_locally(user_id, generation, current):
+            return False
+        changed_at = await self.l2.aget(ROLES_CHANGED_KEY.format(user_id))
+        return self._issued_after(issued_at, changed_at)
+
+    def mask_for_roles(self, role_ids, element_name):
+        masks = self._get_snapshot()[2]
+        mask = 0
+        for role_id in role_ids:
+            mask |= masks.get((role_id, element_name), 0)
+        return mask
+
+    def effective_masks(self, role_ids):
+        """element_name -> объединённая маска для набора ролей."""
+        role_ids = set(role_ids)
+        result = {}
+        for (role_id, element_name), mask in self._get_snapshot()[2].items():
+            if role_id in role_ids:
+                result[element_name] = result.get(element_name, 0) | mask
+        return result
+
+    def mask(self, user_id, element_name):
+        return self.mask_for_roles(self.role_ids(user_id), element_name)
+
+
+permission_matrix = PermissionMatrix()
+policy_engine = PolicyEngine(
+    settings.PERMISSION_ACTIONS,
+    FLAG_BITS,
+    settings.PERMISSION_DECISION_CACHE_SIZE,
+)
+
+
+@receiver(setting_changed)
+def _reset_policy_engine(setting, **kwargs):
+    if setting == 'PERMISSION_ACTIONS':
+        policy_engine.actions = compile_actions(
+            settings.PERMISSION_ACTIONS,
+            FLAG_BITS,
+        )
+        policy_engine.clear()
+
+
+# Наборы ролей на время одного запроса: user_id -> frozenset(role_ids).
+_request_cache = contextvars.ContextVar('permission_cache', default=None)
+
+
+def start_request_cache():
+    cache = {}
+    _request_cache.set(cache)
+    return cache
+
+
+def end_request_cache():
+    _request_cache.set(None)
+
+
+def _resolve_role_key(user):
+    # Роли, загруженные вместе с пользователем, не требуют поиска в кэше.
+    if getattr(user, 'has_loaded_roles', False):
+        return frozenset(user.role_ids)
+    return frozenset(permission_matrix.role_ids(user.id))
+
+
+def role_key(user):
+    cache = _request_cache.get()
+    if cache is None:
+        return _resolve_role_key(user)
+    key = cache.get(user.id)
+    if key is None:
+        key = cache[user.id] = _resolve_role_key(user)
+    return key
+
+
+async def aprepare_permissions(user):
+    """
+    Прогревает матрицу и роли пользователя из async-кода, после чего
+    check_permission и permission_scope не обращаются к БД.
+    """
+    await permission_matrix.aensure_snapshot()
+    if user and not getattr(user, 'has_loaded_roles', False):
+        await permission_matrix.arole_ids(user.id)
+
+
+def permission_context(request):
+    """Атрибуты запроса для условных правил (см. CONTEXT_ATTRIBUTES)."""
+    return {'ip': get_client_ip(request)}
+
+
+def _check_element(user, element_name):
     if not user:
         raise AuthenticationFailed('Authentication required.')
-    try:
-        element = BusinessElement.objects.get(name=element_name)
-    except BusinessElement.DoesNotExist:
+    snapshot = permission_matrix.snapshot()
+    if element_name not in snapshot[1]:
+        return None
+    return snapshot
+
+
+@timed('permission')
+def check_permission(
+    user,
+    element_name,
+    action,
+    obj_owner_id=None,
+    context=None,
+):
+    """
+    context — атрибуты запроса для условных правил (permission_context);
+    время проверки берётся из context['now'] или текущее.
+    """
+    snapshot = _check_element(user, element_name)
+    if snapshot is None:
+        audit_log.record(
+            'permission',
+            'deny',
+            user.id,
+            element=element_name,
+            action=action,
+            reason='not_configured',
+        )
         raise PermissionDenied('Resource not configured.')
-    user_role_ids = UserRole.objects.filter(user=user).values_list(
-        'role_id',
-        flat=True,
-    )
-    rules = AccessRule.objects.filter(
-        role_id__in=user_role_ids,
-        element=element,
+    if policy_engine.decide(
+        snapshot,
+        role_key(user),
+        element_name,
+        action,
+        obj_owner_id is not None and obj_owner_id == user.id,
+        context,
+    ):
+        if audit_log.log_allowed:
+            audit_log.record(
+                'permission',
+                'allow',
+                user.id,
+                element=element_name,
+                action=action,
+            )
+        return True
+    audit_log.record(
+        'permission',
+        'deny',
+        user.id,
+        element=element_name,
+        action=action,
+        owner_id=obj_owner_id,
     )
-    for rule in rules:
-        if action == 'read':
-            if rule.read_all or (rule.read_own and obj_owner_id == user.id):
-                return True
-        elif action == 'create' and rule.create:
-            return True
-        elif action == 'update':
-            if rule.update_all or (
-                rule.update_own and obj_owner_id == user.id
-            ):
-                return True
-        elif action == 'delete':
-            if rule.delete_all or (
-                rule.delete_own and obj_owner_id == user.id
-            ):
-                return True
     raise PermissionDenied('Access denied.')
+
+
+@timed('permission')
+def permission_scope(user, element_name, action, context=None):
+    """
+    Возвращает SCOPE_ALL, SCOPE_OWN или None (доступа нет).
+    Правило пользователя разрешается один раз для всей выборки.
+    """
+    snapshot = _check_element(user, element_name)
+    if snapshot is None:
+        raise PermissionDenied('Resource not configured.')
+    roles = role_key(user)
+    if policy_engine.decide(
+        snapshot,
+        roles,
+        element_name,
+        action,
+        False,
+        context,
+    ):
+        return SCOPE_ALL
+    if policy_engine.decide(
+        snapshot,
+        roles,
+        element_name,
+        action,
+        True,
+        context,
+    ):
+        return SCOPE_OWN
+    return None
+
+
+def _owner_id(obj):
+    if isinstance(obj, dict):
+        return obj.get('owner_id')
+    if isinstance(obj, int):
+        return obj
+    return getattr(obj, 'owner_id', None)
+
+
+def filter_permitted(user, element_name, action, objects, context=None):
+    """
+    Отбирает из objects (dict, модели или сами owner_id) те,
+    над которыми пользователю разрешено action.
+    """
+    scope = permission_scope(user, element_name, action, context)
+    if scope == SCOPE_ALL:
+        return list(objects)
+    if scope == SCOPE_OWN:
+        return [obj for obj in objects if _owner_id(obj) == user.id]
+    return []
+
+
+def filter_permitted_queryset(
+    user,
+    element_name,
+    action,
+    queryset,
+    owner_field='owner_id',
+    context=None,
+):
+    scope = permission_scope(user, element_name, action, context)
+    if scope == SCOPE_ALL:
+        return queryset
+    if scope == SCOPE_OWN:
+        return queryset.filter(**{owner_field: user.id})
+    return queryset.none()
+
+
+def _ids_by_name(model, names):
+    ids = dict(model.objects.filter(name__in=names).values_list('name', 'id'))
+    missing = sorted(set(names) - set(ids))
+    if missing:
+        raise ValidationError({model.__name__: [f'Unknown: {missing}']})
+    return ids
+
+
+def upsert_access_rules(rows):
+    """
+    Создаёт или обновляет правила одним INSERT ... ON CONFLICT
+    и сбрасывает кэш прав один раз на всю пачку (on_change повторяет
+    сброс после коммита).
+    """
+    role_ids = _ids_by_name(Role, {row['role'] for row in rows})
+    element_ids = _ids_by_name(
+        BusinessElement,
+        {row['element'] for row in rows},
+    )
+    rules = {}
+    for row in rows:
+        key = (role_ids[row['role']], element_ids[row['element']])
+        rules[key] = AccessRule(
+            role_id=key[0],
+            element_id=key[1],
+            conditions=row.get('conditions') or {},
+            **{flag: row[flag] for flag in RULE_FLAGS},
+        )
+    with transaction.atomic():
+        AccessRule.objects.bulk_create(
+            rules.values(),
+            update_conflicts=True,
+            unique_fields=['role', 'element'],
+            update_fields=[*RULE_FLAGS, 'conditions'],
+        )
+        permission_matrix.on_change()
+    return len(rules)
+
+
+def grant_role(role_name, user_ids):
+    role_id = _ids_by_name(Role, {role_name})[role_name]
+    user_ids = list(
+        CustomUser.objects.filter(id__in=user_ids).values_list(
+            'id',
+            flat=True,
+        ),
+    )
+    with transaction.atomic():
+        UserRole.objects.bulk_create(
+            [UserRole(user_id=pk, role_id=role_id) for pk in user_ids],
+            ignore_conflicts=True,
+        )
+        permission_matrix.on_change(user_ids)
+    return len(user_ids)
+
+
+def revoke_role(role_name, user_ids):
+    role_id = _ids_by_name(Role, {role_name})[role_name]
+    with transaction.atomic(), permission_matrix.batch_changes():
+        deleted, _ = UserRole.objects.filter(
+            role_id=role_id,
+            user_id__in=user_ids,
+        ).delete()
+    return deleted
@@ -0,0 +1,208 @@
+"""
+Движок политик: правила AccessRule и их условия компилируются в решения,
+а решение для (набор ролей, элемент, действие, владелец) запоминается
+до смены поколения матрицы прав.
+"""
+from django.utils import timezone
+
+from core.permission_cache import LRUCache
+
+# Решения привязаны к поколению матрицы в ключе и не устаревают по времени.
+DECISION_TTL = float('inf')
+
+# Атрибуты, которые views кладут в контекст проверки
+# (permissions.permission_context). Условие на другой атрибут никогда
+# не выполнится, поэтому такие правила отклоняются.
+CONTEXT_ATTRIBUTES = frozenset({'ip'})
+
+
+def compile_actions(actions, flag_bits):
+    """
+    PERMISSION_ACTIONS -> {action: (бит «на все», бит «на свои»)}.
+    Новое действие — новая строка в настройках, а не ветка в коде.
+    """
+    compiled = {}
+    for action, (all_flag, own_flag) in actions.items():
+        compiled[action] = (
+            flag_bits[all_flag] if all_flag else 0,
+            flag_bits[own_flag] if own_flag else 0,
+        )
+    return compiled
+
+
+def _now(context):
+    now = context.get('now')
+    return timezone.localtime(now) if now else timezone.localtime()
+
+
+def _hours(value):
+    start, end = value
+    if start <= end:
+        return lambda context: start <= _now(context).hour < end
+    # Окно через полночь, например [22, 6].
+    return lambda context: not end <= _now(context).hour < start
+
+
+def _weekdays(value):
+    days = frozenset(value)
+    return lambda context: _now(context).weekday() in days
+
+
+def _attributes(value):
+    expected = {
+        name: frozenset(allowed if isinstance(allowed, list) else [allowed])
+        for name, allowed in value.items()
+    }
+
+    def check(context):
+        return all(
+            context.get(name) in allowed
+            for name, allowed in expected.items()
+        )
+
+    return check
+
+
+CONDITIONS = {
+    'hours': _hours,
+    'weekdays': _weekdays,
+    'attributes': _attributes,
+}
+
+
+SCALARS = (str, int, float, bool, type(None))
+
+
+def _is_int(value):
+    # bool — подкласс int, но [True, False] не часы.
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def validate_conditions(spec):
+    """ValueError, если условия правила нельзя скомпилировать."""
+    if not isinstance(spec, dict):
+        raise ValueError('Conditions must be an object.')
+    unknown = sorted(set(spec) - set(CONDITIONS))
+    if unknown:
+        raise ValueError(f'Unknown conditions: {unknown}')
+    hours = spec.get('hours')
+    if hours is not None and not (
+        isinstance(hours, list)
+        and len(hours) == 2
+        and all(_is_int(hour) and 0 <= hour <= 24 for hour in hours)
+    ):
+        raise ValueError('hours must be [start, end] within 0..24.')
+    weekdays = spec.get('weekdays')
+    if weekdays is not None and not (
+        isinstance(weekdays, list)
+        and all(_is_int(day) and 0 <= day <= 6 for day in weekdays)
+    ):
+        raise ValueError('weekdays must be a list of 0..6.')
+    attributes = spec.get('attributes', {})
+    if not isinstance(attributes, dict):
+        raise ValueError('attributes must be an object.')
+    unknown = sorted(set(attributes) - CONTEXT_ATTRIBUTES)
+    if unknown:
+        raise ValueError(
+            f'Unknown attributes: {unknown}; '
+            f'available: {sorted(CONTEXT_ATTRIBUTES)}',
+        )
+    for name, allowed in attributes.items():
+        values = allowed if isinstance(allowed, list) else [allowed]
+        if not all(isinstance(value, SCALARS) for value in values):
+            raise ValueError(
+                f'attributes.{name} must be a scalar or a list of scalars.',
+            )
+
+
+def _never(context):
+    return False
+
+
+def compile_conditions(spec):
+    """Условия правила -> предикат от контекста проверки."""
+    try:
+        validate_conditions(spec)
+        checks = [CONDITIONS[name](value) for name, value in spec.items()]
+    except (ValueError, TypeError):
+        # Некорректное условие не должно ни открывать доступ, ни ломать
+        # проверку остальных правил поколения.
+        return _never
+    return lambda context: all(check(context) for check in checks)
+
+
+class PolicyEngine:
+    """
+    Решение складывается из объединённой маски безусловных правил ролей
+    и, если её не хватило, условных правил (время, атрибуты контекста).
+    Безусловная часть и список подходящих условных правил кэшируются
+    по (поколение, роли, элемент, действие, владелец); условия
+    вычисляются на каждой проверке.
+    """
+
+    def __init__(self, actions, flag_bits, cache_size):
+        self.actions = compile_actions(actions, flag_bits)
+        self._decisions = LRUCache(cache_size, DECISION_TTL)
+        self._conditional = (None, {})
+
+    def clear(self):
+        self._decisions.clear()
+        self._conditional = (None, {})
+
+    def _compiled_conditions(self, generation, conditional):
+        compiled_generation, compiled = self._conditional
+        if compiled_generation != generation:
+            compiled = {
+                key: tuple(
+                    (mask, compile_conditions(spec)) for mask, spec in rules
+                )
+                for key, rules in conditional.items()
+            }
+            self._conditional = (generation, compiled)
+        return compiled
+
+    def compile(self, snapshot, role_key, element_name, action, is_owner):
+        """True, False или кортеж предикатов (разрешено, если любой)."""
+        generation, _, masks, conditional = snapshot
+        if action not in self.actions:
+            return False
+        all_bit, own_bit = self.actions[action]
+        needed = all_bit | (own_bit if is_owner else 0)
+        mask = 0
+        for role_id in role_key:
+            mask |= masks.get((role_id, element_name), 0)
+        if mask & needed:
+            return True
+        rules = self._compiled_conditions(generation, conditional)
+        predicates = tuple(
+            predicate
+            for role_id in role_key
+            for rule_mask, predicate in rules.get((role_id, element_name), ())
+            if rule_mask & needed
+        )
+        return predicates or False
+
+    def decide(
+        self,
+        snapshot,
+        role_key,
+        element_name,
+        action,
+        is_owner=False,
+        context=None,
+    ):
+        key = (snapshot[0], role_key, element_name, action, is_owner)
+        decision = self._decisions.get(key)
+        if decision is None:
+            decision = self.compile(
+                snapshot,
+                role_key,
+                element_name,
+                action,
+                is_owner,
+            )
+            self._decisions.set(key, decision)
+        if decision is True or decision is False:
+            return decision
+        context = context or {}
+        return any(predicate(context) for predicate in decision)
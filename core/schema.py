@@ -0,0 +1,131 @@
+"""
+Декораторы OpenAPI и заранее собранные файлы схемы.
+drf-spectacular импортируется, только если документация включена
+(API_DOCS); иначе extend_schema ничего не делает.
+"""
+import gzip
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+SCHEMA_FORMATS = {
+    'yaml': 'application/vnd.oai.openapi',
+    'json': 'application/vnd.oai.openapi+json',
+}
+
+if settings.API_DOCS:
+    from drf_spectacular.extensions import OpenApiAuthenticationExtension
+    from drf_spectacular.plumbing import build_bearer_security_scheme_object
+    from drf_spectacular.types import OpenApiTypes
+    from drf_spectacular.utils import OpenApiExample, extend_schema
+
+    ANY_OBJECT = OpenApiTypes.OBJECT
+
+    class MiddlewareAuthenticationScheme(OpenApiAuthenticationExtension):
+        target_class = 'core.authentication.MiddlewareAuthentication'
+        name = 'bearerAuth'
+
+        def get_security_definition(self, auto_schema):
+            return build_bearer_security_scheme_object(
+                header_name='Authorization',
+                token_prefix='Bearer',
+                bearer_format='JWT',
+            )
+else:
+    ANY_OBJECT = None
+
+    def extend_schema(*args, **kwargs):
+        def decorator(view):
+            return view
+
+        return decorator
+
+
+def examples(specs):
+    """OpenApiExample из описаний в settings (EXAMPLES_LOGIN и т.п.)."""
+    if not settings.API_DOCS:
+        return []
+    return [OpenApiExample(**spec) for spec in specs]
+
+
+def schema_path(schema_format, directory=None):
+    """Файл схемы текущей версии API: openapi-<VERSION>.<format>."""
+    version = settings.SPECTACULAR_SETTINGS['VERSION']
+    return os.path.join(
+        directory or settings.API_SCHEMA_DIR,
+        f'openapi-{version}.{schema_format}',
+    )
+
+
+def compress(body):
+    # mtime=0: одинаковая схема даёт одинаковые байты и ETag.
+    return gzip.compress(body, compresslevel=9, mtime=0)
+
+
+class SchemaArtifact:
+    """Тело схемы и его gzip-версия с ETag, прочитанные один раз."""
+
+    __slots__ = ('body', 'gzip_body', 'etag', 'gzip_etag', 'content_type')
+
+    def __init__(self, body, gzip_body, content_type):
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.body = body
+        self.gzip_body = gzip_body
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gzip"'
+        self.content_type = content_type
+
+
+class SchemaArtifacts:
+    """
+    Файлы build_api_schema в памяти процесса: на запрос не тратится
+    ни генерация, ни чтение с диска, ни сжатие.
+    """
+
+    def __init__(self):
+        self._loaded = {}
+
+    def get(self, schema_format):
+        try:
+            return self._loaded[schema_format]
+        except KeyError:
+            pass
+        artifact = self._load(schema_format)
+        # Отсутствие файла не запоминаем: build_api_schema, запущенный
+        # после старта процесса, подхватывается без перезапуска.
+        if artifact is not None:
+            self._loaded[schema_format] = artifact
+        return artifact
+
+    def _load(self, schema_format):
+        path = schema_path(schema_format)
+        try:
+            with open(path, 'rb') as source:
+                body = source.read()
+        except FileNotFoundError:
+            return None
+        try:
+            with open(f'{path}.gz', 'rb') as source:
+                gzip_body = source.read()
+        except FileNotFoundError:
+            gzip_body = compress(body)
+        return SchemaArtifact(
+            body,
+            gzip_body,
+            f'{SCHEMA_FORMATS[schema_format]}; charset=utf-8',
+        )
+
+    def reset(self):
+        self._loaded = {}
+
+
+schema_artifacts = SchemaArtifacts()
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    if setting in ('API_SCHEMA_DIR', 'SPECTACULAR_SETTINGS'):
+        schema_artifacts.reset()
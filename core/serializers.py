@@ -1,6 +1,7 @@
 from rest_framework import serializers
 
-from core.models import CustomUser, Role, UserRole
+from core.models import AccessRule, CustomUser, Product, Role, UserRole
+from core.policies import validate_conditions
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -29,8 +30,12 @@ class RegisterSerializer(serializers.Serializer):
     def create(self, validated_data):
         password = validated_data.pop('password')
         validated_data.pop('password_repeat', None)
+        password_hash = validated_data.pop('password_hash', None)
         user = CustomUser(**validated_data)
-        user.set_password(password)
+        if password_hash:
+            user.password_hash = password_hash
+        else:
+            user.set_password(password)
         user.save()
         user_role, created = Role.objects.get_or_create(
             name='user',
@@ -61,3 +66,59 @@ class UserUpdateSerializer(serializers.ModelSerializer):
                 'Пользователь с таким email уже существует.',
             )
         return value
+
+
+class ProductSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'owner_id']
+        read_only_fields = ['id', 'owner_id']
+
+
+class AccessRuleSerializer(serializers.ModelSerializer):
+    role = serializers.CharField(source='role.name', read_only=True)
+    element = serializers.CharField(source='element.name', read_only=True)
+
+    class Meta:
+        model = AccessRule
+        fields = [
+            'id',
+            'role',
+            'element',
+            'read_own',
+            'read_all',
+            'create',
+            'update_own',
+            'update_all',
+            'delete_own',
+            'delete_all',
+            'conditions',
+        ]
+
+
+class AccessRuleUpsertSerializer(serializers.Serializer):
+    role = serializers.CharField()
+    element = serializers.CharField()
+    read_own = serializers.BooleanField(default=False)
+    read_all = serializers.BooleanField(default=False)
+    create = serializers.BooleanField(default=False)
+    update_own = serializers.BooleanField(default=False)
+    update_all = serializers.BooleanField(default=False)
+    delete_own = serializers.BooleanField(default=False)
+    delete_all = serializers.BooleanField(default=False)
+    conditions = serializers.JSONField(default=dict)
+
+    def validate_conditions(self, value):
+        try:
+            validate_conditions(value)
+        except ValueError as error:
+            raise serializers.ValidationError(str(error))
+        return value
+
+
+class RoleAssignmentSerializer(serializers.Serializer):
+    role = serializers.CharField()
+    user_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+    )
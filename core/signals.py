@@ -0,0 +1,54 @@
+from django.core.exceptions import ValidationError
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from core.models import AccessRule, BusinessElement, CustomUser, Role, UserRole
+from core.permissions import permission_matrix, role_closure
+from core.tokens import remember_user_status
+
+PERMISSION_MODELS = (AccessRule, Role, BusinessElement)
+
+
+def invalidate_permission_matrix(sender, **kwargs):
+    permission_matrix.on_change()
+
+
+def invalidate_user_roles(sender, instance, **kwargs):
+    permission_matrix.on_change([instance.user_id])
+
+
+for model in PERMISSION_MODELS:
+    post_save.connect(invalidate_permission_matrix, sender=model)
+    post_delete.connect(invalidate_permission_matrix, sender=model)
+post_save.connect(invalidate_user_roles, sender=UserRole)
+post_delete.connect(invalidate_user_roles, sender=UserRole)
+
+
+def check_role_hierarchy(sender, instance, action, reverse, pk_set, **kwargs):
+    """Новые связи роль -> родитель не должны замыкать цикл."""
+    if action != 'pre_add':
+        return
+    if reverse:
+        new_edges = [(child_id, instance.pk) for child_id in pk_set]
+    else:
+        new_edges = [(instance.pk, parent_id) for parent_id in pk_set]
+    edges = list(sender.objects.values_list('from_role_id', 'to_role_id'))
+    ancestors = role_closure(edges + new_edges)
+    for role_id, parent_id in new_edges:
+        if role_id in ancestors[parent_id]:
+            raise ValidationError('Role inheritance cycle.')
+
+
+def invalidate_role_hierarchy(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        permission_matrix.on_change()
+
+
+m2m_changed.connect(check_role_hierarchy, sender=Role.parents.through)
+m2m_changed.connect(invalidate_role_hierarchy, sender=Role.parents.through)
+
+
+def refresh_user_status(sender, instance, **kwargs):
+    remember_user_status(instance.id, instance.is_active)
+
+
+post_save.connect(refresh_user_status, sender=CustomUser)
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import threading
+
+import jwt
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from jwt.algorithms import get_default_algorithms
+
+SYMMETRIC_ALGORITHM = 'HS256'
+ASYMMETRIC_ALGORITHMS = ('EdDSA', 'RS256')
+KTY_ALGORITHMS = {'OKP': 'EdDSA', 'RSA': 'RS256'}
+
+
+def load_private_key(pem, algorithm):
+    if algorithm not in ASYMMETRIC_ALGORITHMS:
+        raise ImproperlyConfigured(
+            f'JWT_ALGORITHM must be one of {ASYMMETRIC_ALGORITHMS} '
+            'when a private key is configured.',
+        )
+    try:
+        return get_default_algorithms()[algorithm].prepare_key(pem)
+    except KeyError as exc:
+        raise ImproperlyConfigured(
+            f'{algorithm} signing requires the "cryptography" package.',
+        ) from exc
+
+
+def public_jwk(public_key, algorithm, kid=None):
+    jwk = get_default_algorithms()[algorithm].to_jwk(public_key, as_dict=True)
+    if kid is None:
+        canonical = json.dumps(jwk, sort_keys=True, separators=(',', ':'))
+        kid = hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+    jwk.update({'kid': kid, 'alg': algorithm, 'use': 'sig'})
+    return jwk
+
+
+class KeyRing:
+    """
+    Ключи подписи и проверки JWT. PEM и JWKS разбираются один раз при
+    загрузке; при проверке ключ берётся из dict по kid из заголовка.
+    В режиме HS256 подпись и проверка идут по SECRET_KEY, без kid.
+    """
+
+    def __init__(self, algorithm, signing_key, kid=None, public_keys=()):
+        self.algorithm = algorithm
+        self.signing_key = signing_key
+        self.kid = kid
+        self._keys = {}
+        self._jwks = []
+        for jwk in public_keys:
+            self.add_public_key(jwk)
+
+    @classmethod
+    def from_settings(cls):
+        algorithm = settings.JWT_ALGORITHM
+        if algorithm == SYMMETRIC_ALGORITHM:
+            return cls(algorithm, settings.SECRET_KEY)
+        if not settings.JWT_PRIVATE_KEY_FILE:
+            raise ImproperlyConfigured(
+                f'JWT_PRIVATE_KEY_FILE is required for {algorithm}.',
+            )
+        with open(settings.JWT_PRIVATE_KEY_FILE, 'rb') as source:
+            private_key = load_private_key(source.read(), algorithm)
+        own_jwk = public_jwk(
+            private_key.public_key(),
+            algorithm,
+            settings.JWT_KEY_ID,
+        )
+        public_keys = [own_jwk]
+        if settings.JWT_JWKS_FILE:
+            with open(settings.JWT_JWKS_FILE, encoding='utf-8') as source:
+                public_keys.extend(
+                    jwk
+                    for jwk in json.load(source).get('keys', [])
+                    if jwk.get('kid') != own_jwk['kid']
+                )
+        return cls(algorithm, private_key, own_jwk['kid'], public_keys)
+
+    def add_public_key(self, jwk):
+        algorithm = jwk.get('alg') or KTY_ALGORITHMS.get(jwk.get('kty'))
+        if algorithm not in ASYMMETRIC_ALGORITHMS or not jwk.get('kid'):
+            raise ImproperlyConfigured(
+                f'Unsupported JWKS entry: kid={jwk.get("kid")!r}',
+            )
+        key = jwt.PyJWK(jwk, algorithm).key
+        self._keys[jwk['kid']] = (key, [algorithm])
+        self._jwks.append(
+            {name: value for name, value in jwk.items() if name != 'd'},
+        )
+
+    def encode(self, payload):
+        headers = {'kid': self.kid} if self.kid else None
+        return jwt.encode(
+            payload,
+            self.signing_key,
+            algorithm=self.algorithm,
+            headers=headers,
+        )
+
+    def verification_key(self, token):
+        if self.algorithm == SYMMETRIC_ALGORITHM:
+            return self.signing_key, [SYMMETRIC_ALGORITHM]
+        kid = jwt.get_unverified_header(token).get('kid')
+        try:
+            return self._keys[kid]
+        except KeyError:
+            raise jwt.InvalidTokenError('Unknown signing key.') from None
+
+    def decode(self, token, **kwargs):
+        key, algorithms = self.verification_key(token)
+        return jwt.decode(token, key, algorithms=algorithms, **kwargs)
+
+    def jwks(self):
+        return {'keys': list(self._jwks)}
+
+
+_key_ring = None
+_key_ring_lock = threading.Lock()
+
+
+def get_key_ring():
+    global _key_ring
+    if _key_ring is None:
+        with _key_ring_lock:
+            if _key_ring is None:
+                _key_ring = KeyRing.from_settings()
+    return _key_ring
+
+
+def reset_key_ring():
+    """Перечитать ключи (ротация, смена настроек в тестах)."""
+    global _key_ring
+    with _key_ring_lock:
+        _key_ring = None
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    if setting.startswith('JWT_') or setting == 'SECRET_KEY':
+        reset_key_ring()
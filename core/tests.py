@@ -1,8 +1,68 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+import jwt
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import connections, transaction
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.test import APIClient
 
-from core.models import CustomUser
+from core import (
+    audit,
+    instrumentation,
+    middleware,
+    permissions,
+    throttling,
+    views,
+)
+from core.audit import AuditLog, DatabaseSink, JsonlSink
+from core.db_routers import ReplicaRouter, use_primary
+from core.hashing import HasherPool, hash_password, hash_rounds
+from core.models import (
+    AccessRule,
+    AuditEvent,
+    BusinessElement,
+    CustomUser,
+    Product,
+    RevokedToken,
+    Role,
+    UserRole,
+)
+from core.permission_cache import LocalChannel, LRUCache
+from core.permissions import (
+    FLAG_BITS,
+    PermissionMatrix,
+    check_permission,
+    filter_permitted,
+    filter_permitted_queryset,
+    permission_matrix,
+    policy_engine,
+    revoke_role,
+)
+from core.policies import validate_conditions
+from core.schema import schema_path
+from core.signing_keys import get_key_ring
+from core.tokens import (
+    REFRESH,
+    decode_token,
+    denylist,
+    issue_token,
+    revoke_token,
+    verified_tokens,
+)
 
 
 class AuthBasicTests(TestCase):
@@ -51,6 +111,19 @@ class AuthBasicTests(TestCase):
             format='json',
         )
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        for payload in (
+            {'email': 'wrong@test.com', 'password': 12345},
+            {'email': ['wrong@test.com'], 'password': 'correctpass'},
+        ):
+            response = self.client.post(
+                '/api/auth/login/',
+                payload,
+                format='json',
+            )
+            self.assertEqual(
+                response.status_code,
+                status.HTTP_401_UNAUTHORIZED,
+            )
 
     def test_delete_account(self):
         """Удаление аккаунта (мягкое) TTP_200_OK + is_active=False"""
@@ -97,3 +170,1960 @@ class AuthBasicTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data['first_name'], 'New')
         self.assertEqual(response.data['email'], 'new@test.com')
+
+
+class PermissionMatrixTests(TestCase):
+    def setUp(self):
+        permission_matrix.invalidate()
+        self.user = CustomUser.objects.create(
+            email='owner@test.com',
+            first_name='Owner',
+            last_name='User',
+        )
+        self.role = Role.objects.create(name='user')
+        self.element = BusinessElement.objects.create(name='products')
+        self.rule = AccessRule.objects.create(
+            role=self.role,
+            element=self.element,
+            read_own=True,
+        )
+        UserRole.objects.create(user=self.user, role=self.role)
+
+    def test_own_and_foreign_objects(self):
+        """read_own разрешает только свои объекты"""
+        self.assertTrue(
+            check_permission(self.user, 'products', 'read', self.user.id),
+        )
+        with self.assertRaises(PermissionDenied):
+            check_permission(self.user, 'products', 'read', self.user.id + 1)
+        with self.assertRaises(PermissionDenied):
+            check_permission(self.user, 'orders', 'read')
+
+    def test_warm_check_makes_no_queries(self):
+        """Повторная проверка не обращается к БД"""
+        check_permission(self.user, 'products', 'read', self.user.id)
+        with self.assertNumQueries(0):
+            for owner_id in range(100):
+                try:
+                    check_permission(self.user, 'products', 'read', owner_id)
+                except PermissionDenied:
+                    pass
+
+    def test_rule_change_invalidates_matrix(self):
+        """Изменение AccessRule сбрасывает матрицу"""
+        with self.assertRaises(PermissionDenied):
+            check_permission(self.user, 'products', 'delete', 0)
+        self.rule.delete_all = True
+        self.rule.save()
+        self.assertTrue(check_permission(self.user, 'products', 'delete', 0))
+        UserRole.objects.filter(user=self.user).delete()
+        with self.assertRaises(PermissionDenied):
+            check_permission(self.user, 'products', 'delete', 0)
+
+
+class PolicyEngineTests(TestCase):
+    def setUp(self):
+        permission_matrix.invalidate()
+        policy_engine.clear()
+        self.user = CustomUser.objects.create(
+            email='policy@test.com',
+            first_name='Policy',
+            last_name='User',
+        )
+        self.role = Role.objects.create(name='user')
+        self.element = BusinessElement.objects.create(name='products')
+        UserRole.objects.create(user=self.user, role=self.role)
+
+    def at(self, hour):
+        return timezone.localtime().replace(hour=hour, minute=0)
+
+    def test_conditional_rule(self):
+        """Условное правило разрешает доступ только в своё окно"""
+        AccessRule.objects.create(
+            role=self.role,
+            element=self.element,
+            read_all=True,
+            conditions={'hours': [9, 18], 'attributes': {'ip': '10.0.0.1'}},
+        )
+        context = {'now': self.at(10), 'ip': '10.0.0.1'}
+        self.assertTrue(
+            check_permission(self.user, 'products', 'read', context=context),
+        )
+        for context in (
+            {'now': self.at(20), 'ip': '10.0.0.1'},
+            {'now': self.at(10), 'ip': '10.0.0.2'},
+            None,
+        ):
+            with self.assertRaises(PermissionDenied):
+                check_permission(
+                    self.user,
+                    'products',
+                    'read',
+                    context=context,
+                )
+
+    def test_views_pass_request_context(self):
+        """Атрибуты условия берутся из запроса во views"""
+        AccessRule.objects.create(
+            role=self.role,
+            element=self.element,
+            read_all=True,
+            conditions={'attributes': {'ip': ['10.0.0.1']}},
+        )
+        client = APIClient()
+        token = issue_token(self.user)
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        response = client.get('/api/products/', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = client.get('/api/products/', REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_invalid_conditions_rejected(self):
+        for spec in (
+            {'hours': [9]},
+            {'hours': [True, False]},
+            {'weekdays': [False]},
+            {'attributes': {'tenant': 'acme'}},
+        ):
+            with self.assertRaises(ValueError):
+                validate_conditions(spec)
+
+    def test_new_action_is_configuration(self):
+        """Новое действие описывается в PERMISSION_ACTIONS"""
+        AccessRule.objects.create(
+            role=self.role,
+            element=self.element,
+            update_all=True,
+        )
+        with self.assertRaises(PermissionDenied):
+            check_permission(self.user, 'products', 'publish')
+        actions = {'publish': ('update_all', None)}
+        with override_settings(PERMISSION_ACTIONS=actions):
+            self.assertTrue(
+                check_permission(self.user, 'products', 'publish'),
+            )
+            with self.assertRaises(PermissionDenied):
+                check_permission(self.user, 'products', 'read')
+
+    def test_decisions_cached_until_rules_change(self):
+        """Решение берётся из кэша до смены поколения матрицы"""
+        rule = AccessRule.objects.create(
+            role=self.role,
+            element=self.element,
+            read_own=True,
+        )
+        check_permission(self.user, 'products', 'read', self.user.id)
+        with mock.patch.object(
+            policy_engine,
+            'compile',
+            wraps=policy_engine.compile,
+        ) as compile_decision, self.assertNumQueries(0):
+            for _ in range(100):
+                check_permission(self.user, 'products', 'read', self.user.id)
+            self.assertEqual(compile_decision.call_count, 0)
+        rule.read_own = False
+        rule.save()
+        with self.assertRaises(PermissionDenied):
+            check_permission(self.user, 'products', 'read', self.user.id)
+
+
+class RoleHierarchyTests(TestCase):
+    def setUp(self):
+        permission_matrix.invalidate()
+        self.user = CustomUser.objects.create(
+            email='nested@test.com',
+            first_name='Nested',
+            last_name='User',
+        )
+        self.element = BusinessElement.objects.create(name='products')
+        # root <- level1 <- ... <- level5: пользователь на самой вложенной.
+        self.roles = [Role.objects.create(name='root')]
+        for level in range(1, 6):
+            role = Role.objects.create(name=f'level{level}')
+            role.parents.add(self.roles[-1])
+            self.roles.append(role)
+        AccessRule.objects.create(
+            role=self.roles[0],
+            element=self.element,
+            read_all=True,
+        )
+        AccessRule.objects.create(
+            role=self.roles[3],
+            element=self.element,
+            delete_own=True,
+        )
+        UserRole.objects.create(user=self.user, role=self.roles[-1])
+
+    def test_nested_role_inherits_rules(self):
+        """Права предков объединяются в маску роли заранее"""
+        permission_matrix.invalidate()
+        with self.assertNumQueries(4):
+            self.assertTrue(check_permission(self.user, 'products', 'read'))
+        self.assertTrue(
+            check_permission(self.user, 'products', 'delete', self.user.id),
+        )
+        with self.assertRaises(PermissionDenied):
+            check_permission(self.user, 'products', 'delete')
+        self.assertEqual(
+            self.user.effective_rules['products'],
+            FLAG_BITS['read_all'] | FLAG_BITS['delete_own'],
+        )
+
+    def test_hierarchy_change_invalidates_matrix(self):
+        """Разрыв цепочки наследования отзывает права предков"""
+        self.assertTrue(check_permission(self.user, 'products', 'read'))
+        self.roles[1].parents.remove(self.roles[0])
+        with self.assertRaises(PermissionDenied):
+            check_permission(self.user, 'products', 'read')
+
+    def test_cycle_rejected(self):
+        with self.assertRaises(ValidationError), transaction.atomic():
+            self.roles[0].parents.add(self.roles[-1])
+        with self.assertRaises(ValidationError), transaction.atomic():
+            self.roles[-1].children.add(self.roles[0])
+        self.assertFalse(self.roles[0].parents.exists())
+
+
+class FilterPermittedTests(TestCase):
+    def setUp(self):
+        permission_matrix.invalidate()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create(
+            email='bulk@test.com',
+            first_name='Bulk',
+            last_name='User',
+        )
+        self.user.set_password('bulkpass')
+        self.user.save()
+        self.role = Role.objects.create(name='user')
+        self.element = BusinessElement.objects.create(name='products')
+        AccessRule.objects.create(
+            role=self.role,
+            element=self.element,
+            read_own=True,
+        )
+        UserRole.objects.create(user=self.user, role=self.role)
+        self.products = [
+            {'id': i, 'name': f'P{i}', 'owner_id': i % 3 + self.user.id - 1}
+            for i in range(3000)
+        ]
+
+    def test_filter_objects_and_owner_ids(self):
+        """Отбираются только свои объекты, без запросов на каждый"""
+        permitted = filter_permitted(
+            self.user,
+            'products',
+            'read',
+            self.products,
+        )
+        self.assertEqual(len(permitted), 1000)
+        self.assertTrue(
+            all(p['owner_id'] == self.user.id for p in permitted),
+        )
+        owner_ids = [self.user.id, self.user.id + 1, self.user.id]
+        self.assertEqual(
+            filter_permitted(self.user, 'products', 'read', owner_ids),
+            [self.user.id, self.user.id],
+        )
+        self.assertEqual(
+            filter_permitted(self.user, 'products', 'delete', owner_ids),
+            [],
+        )
+
+    def test_filter_queryset_adds_owner_condition(self):
+        """Для *_own фильтрация уходит в SQL"""
+        other = CustomUser.objects.create(
+            email='other@test.com',
+            first_name='Other',
+            last_name='User',
+        )
+        UserRole.objects.create(user=other, role=self.role)
+        queryset = filter_permitted_queryset(
+            self.user,
+            'products',
+            'read',
+            UserRole.objects.all(),
+            owner_field='user_id',
+        )
+        self.assertEqual(list(queryset.values_list('user_id', flat=True)), [
+            self.user.id,
+        ])
+        self.assertFalse(
+            filter_permitted_queryset(
+                self.user,
+                'products',
+                'update',
+                UserRole.objects.all(),
+                owner_field='user_id',
+            ).exists(),
+        )
+
+
+@override_settings(AUTH_STATELESS_TOKENS=True)
+class StatelessTokenTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        permission_matrix.invalidate()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create(
+            email='snapshot@test.com',
+            first_name='Snap',
+            last_name='Shot',
+        )
+        self.user.set_password('snappass')
+        self.user.save()
+        role = Role.objects.create(name='user')
+        element = BusinessElement.objects.create(name='products')
+        AccessRule.objects.create(role=role, element=element, read_own=True)
+        UserRole.objects.create(user=self.user, role=role)
+        login_resp = self.client.post(
+            '/api/auth/login/',
+            {'email': 'snapshot@test.com', 'password': 'snappass'},
+            format='json',
+        )
+        self.token = login_resp.data['token']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def test_products_list_without_user_query(self):
+        """Снимок в токене избавляет от загрузки CustomUser"""
+        self.client.get('/api/products/')
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.wsgi_request.user.id, self.user.id)
+
+    def test_profile_update_loads_user_lazily(self):
+        response = self.client.patch(
+            '/api/auth/profile/',
+            {'first_name': 'Lazy'},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Lazy')
+
+    def test_role_revocation_seen_by_other_workers(self):
+        """
+        Смена ролей хранится в общем L2: воркер без pub/sub-сообщения
+        не доверяет ролям из старого токена
+        """
+        self.assertEqual(
+            self.client.get('/api/products/').status_code,
+            status.HTTP_200_OK,
+        )
+        revoke_role('user', [self.user.id])
+        permission_matrix._role_changes.clear()
+        permission_matrix._user_roles.clear()
+        response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_delete_account_revokes_snapshot(self):
+        """После удаления аккаунта токен перестаёт приниматься"""
+        response = self.client.delete('/api/auth/delete/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get('/api/products/')
+        self.assertIsNone(response.wsgi_request.user)
+
+
+class LazyUserTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        user = CustomUser.objects.create(
+            email='lazy@test.com',
+            first_name='Lazy',
+            last_name='User',
+        )
+        user.set_password('lazypass')
+        user.save()
+        login_resp = self.client.post(
+            '/api/auth/login/',
+            {'email': 'lazy@test.com', 'password': 'lazypass'},
+            format='json',
+        )
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {login_resp.data["token"]}',
+        )
+
+    @skipUnless(settings.API_DOCS, 'URLconf собран без схемы API')
+    @override_settings(DEBUG=True)
+    def test_schema_does_not_resolve_user(self):
+        """Документация не проверяет токен и не ходит в БД за пользователем"""
+        with mock.patch.object(
+            middleware,
+            'decode_token',
+            wraps=middleware.decode_token,
+        ) as decode:
+            with self.assertNumQueries(0):
+                response = self.client.get('/api/schema/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        decode.assert_not_called()
+
+    def test_user_resolved_once_per_request(self):
+        with mock.patch.object(
+            middleware,
+            'decode_token',
+            wraps=middleware.decode_token,
+        ) as decode:
+            response = self.client.patch(
+                '/api/auth/profile/',
+                {'first_name': 'Once'},
+                format='json',
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(decode.call_count, 1)
+
+
+class AsyncAuthViewsTests(TestCase):
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+        self.pool = HasherPool(workers=1, max_queue=0)
+        patcher = mock.patch.object(
+            views,
+            'get_hasher_pool',
+            return_value=self.pool,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.pool.shutdown)
+
+    def post(self, path, data):
+        return self.factory.post(
+            path,
+            json.dumps(data),
+            content_type='application/json',
+        )
+
+    async def test_register_and_login(self):
+        response = await views.register_async(self.post(
+            '/api/auth/register/',
+            {
+                'email': 'async@test.com',
+                'password': 'asyncpass',
+                'password_repeat': 'asyncpass',
+                'first_name': 'Async',
+                'last_name': 'User',
+            },
+        ))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = await views.login_async(self.post(
+            '/api/auth/login/',
+            {'email': 'async@test.com', 'password': 'asyncpass'},
+        ))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('token', json.loads(response.content))
+        response = await views.login_async(self.post(
+            '/api/auth/login/',
+            {'email': 'async@test.com', 'password': 'wrongpass'},
+        ))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_saturated_pool_returns_503(self):
+        """Переполненный пул сразу отвечает 503 с Retry-After"""
+        await CustomUser.objects.acreate(
+            email='busy@test.com',
+            first_name='Busy',
+            last_name='User',
+            password_hash='x',
+        )
+        release = threading.Event()
+        self.pool.submit(release.wait)
+        try:
+            response = await views.login_async(self.post(
+                '/api/auth/login/',
+                {'email': 'busy@test.com', 'password': 'busypass'},
+            ))
+        finally:
+            release.set()
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+        self.assertEqual(response['Retry-After'], '1')
+
+
+class AsyncProductViewsTests(TestCase):
+    def setUp(self):
+        permission_matrix.invalidate()
+        self.factory = AsyncRequestFactory()
+        self.user = CustomUser.objects.create(
+            email='async-owner@test.com',
+            first_name='Async',
+            last_name='Owner',
+        )
+        other = CustomUser.objects.create(
+            email='async-other@test.com',
+            first_name='Async',
+            last_name='Other',
+        )
+        role = Role.objects.create(name='user')
+        element = BusinessElement.objects.create(name='products')
+        AccessRule.objects.create(
+            role=role,
+            element=element,
+            read_own=True,
+            create=True,
+            update_own=True,
+            delete_own=True,
+        )
+        UserRole.objects.create(user=self.user, role=role)
+        Product.objects.bulk_create(
+            Product(name=f'A{i}', owner=self.user if i % 2 else other)
+            for i in range(40)
+        )
+        self.foreign = Product.objects.filter(owner=other).first()
+        self.token = issue_token(self.user)
+        self.auth = {'headers': {'Authorization': f'Bearer {self.token}'}}
+
+    def call(self, view, request, **kwargs):
+        """Запрос через async-цепочку AuthMiddleware → view."""
+
+        async def get_response(request):
+            return await view(request, **kwargs)
+
+        chain = middleware.AuthMiddleware(
+            middleware.PermissionCacheMiddleware(get_response),
+        )
+        response = async_to_sync(chain)(request)
+        return response.status_code, json.loads(response.content)
+
+    def test_role_lookup_with_expired_snapshot(self):
+        """Истёкший L1-снимок пересобирается вне event loop"""
+        permission_matrix.snapshot()
+        permission_matrix._user_roles.clear()
+        permission_matrix.l2.clear()
+        permission_matrix._built_at = 0
+        role_ids = async_to_sync(permission_matrix.arole_ids)(self.user.id)
+        self.assertEqual(
+            role_ids,
+            tuple(self.user.userrole_set.values_list('role_id', flat=True)),
+        )
+
+    def test_list_pages_match_sync_view(self):
+        """Async-страницы и курсоры совпадают с sync-пагинацией"""
+        code, first = self.call(
+            views.products_list_async,
+            self.factory.get('/api/products/?page_size=10', **self.auth),
+        )
+        self.assertEqual(code, status.HTTP_200_OK)
+        self.assertIsNone(first['previous'])
+        self.assertEqual(len(first['results']), 10)
+        self.assertTrue(
+            all(p['owner_id'] == self.user.id for p in first['results']),
+        )
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        sync_first = client.get('/api/products/?page_size=10').data
+        self.assertEqual(first['results'], sync_first['results'])
+
+        next_url = first['next'].replace('http://testserver', '')
+        code, second = self.call(
+            views.products_list_async,
+            self.factory.get(next_url, **self.auth),
+        )
+        self.assertEqual(
+            client.get(next_url).data['results'],
+            second['results'],
+        )
+        self.assertEqual(len(second['results']), 10)
+        self.assertIsNotNone(second['previous'])
+        self.assertIsNone(second['next'])
+        code, back = self.call(
+            views.products_list_async,
+            self.factory.get(
+                second['previous'].replace('http://testserver', ''),
+                **self.auth,
+            ),
+        )
+        self.assertEqual(back['results'], first['results'])
+
+    def test_detail_create_update_delete(self):
+        code, _ = self.call(
+            views.products_list_async,
+            self.factory.get('/api/products/'),
+        )
+        self.assertEqual(code, status.HTTP_401_UNAUTHORIZED)
+        code, created = self.call(
+            views.products_list_async,
+            self.factory.post(
+                '/api/products/',
+                {'name': 'Async product'},
+                content_type='application/json',
+                **self.auth,
+            ),
+        )
+        self.assertEqual(code, status.HTTP_201_CREATED)
+        self.assertEqual(created['owner_id'], self.user.id)
+        code, updated = self.call(
+            views.product_detail_async,
+            self.factory.put(
+                '/',
+                {'name': 'Renamed'},
+                content_type='application/json',
+                **self.auth,
+            ),
+            product_id=created['id'],
+        )
+        self.assertEqual(updated['name'], 'Renamed')
+        code, _ = self.call(
+            views.product_detail_async,
+            self.factory.get('/', **self.auth),
+            product_id=self.foreign.id,
+        )
+        self.assertEqual(code, status.HTTP_403_FORBIDDEN)
+        code, _ = self.call(
+            views.product_detail_async,
+            self.factory.delete('/', **self.auth),
+            product_id=created['id'],
+        )
+        self.assertEqual(code, status.HTTP_200_OK)
+        self.assertFalse(Product.objects.filter(id=created['id']).exists())
+
+
+@override_settings(BCRYPT_ROUNDS=4)
+class PasswordRehashTests(TestCase):
+    def test_login_upgrades_hash_cost(self):
+        """Хэш с другой стоимостью пересчитывается при успешном входе"""
+        user = CustomUser.objects.create(
+            email='rehash@test.com',
+            first_name='Re',
+            last_name='Hash',
+            password_hash=hash_password('rehashpass', rounds=5),
+        )
+        response = APIClient().post(
+            '/api/auth/login/',
+            {'email': 'rehash@test.com', 'password': 'rehashpass'},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        user.refresh_from_db()
+        self.assertEqual(hash_rounds(user.password_hash), 4)
+        self.assertTrue(user.check_password('rehashpass'))
+        self.assertFalse(user.check_password('wrongpass'))
+
+    def test_bcrypt_benchmark_recommends_rounds(self):
+        out = io.StringIO()
+        call_command(
+            'bcrypt_benchmark',
+            min_rounds=4,
+            max_rounds=5,
+            samples=1,
+            target_ms=10000,
+            stdout=out,
+        )
+        self.assertIn('BCRYPT_ROUNDS=5', out.getvalue())
+
+
+@override_settings(LOGIN_THROTTLE_EMAIL=3, LOGIN_THROTTLE_IP=5)
+class LoginThrottleTests(TestCase):
+    def setUp(self):
+        caches['login_throttle'].clear()
+        self.client = APIClient()
+        user = CustomUser.objects.create(
+            email='victim@test.com',
+            first_name='Victim',
+            last_name='User',
+        )
+        user.set_password('rightpass')
+        user.save()
+
+    def login(self, email, password):
+        return self.client.post(
+            '/api/auth/login/',
+            {'email': email, 'password': password},
+            format='json',
+        )
+
+    def test_windows_survive_many_keys(self):
+        """Сотни IP не вытесняют окна друг друга из кэша"""
+        throttle = throttling.login_throttle
+        ips = [f'10.0.{i // 256}.{i % 256}' for i in range(400)]
+        for ip in ips:
+            for attempt in range(settings.LOGIN_THROTTLE_IP):
+                throttle.register_failure(f'{attempt}@{ip}.test', ip)
+        # Email новый: блокирует только окно IP.
+        blocked = [ip for ip in ips if throttle.retry_after('new@x.test', ip)]
+        self.assertEqual(len(blocked), len(ips))
+
+    def test_email_blocked_without_db_or_bcrypt(self):
+        """После лимита неудач попытки отклоняются без БД и bcrypt"""
+        for _ in range(3):
+            response = self.login('victim@test.com', 'wrongpass')
+            self.assertEqual(response.status_code, 401)
+        with mock.patch.object(throttling, 'verify_password') as verify:
+            with self.assertNumQueries(0):
+                response = self.login('Victim@test.com', 'rightpass')
+        verify.assert_not_called()
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_ip_limit_spans_emails(self):
+        for index in range(5):
+            self.login(f'nobody{index}@test.com', 'wrongpass')
+        response = self.login('victim@test.com', 'rightpass')
+        self.assertEqual(response.status_code, 429)
+
+    def test_unknown_email_checks_dummy_hash(self):
+        """Для несуществующего email тоже выполняется bcrypt"""
+        with mock.patch.object(
+            throttling,
+            'verify_password',
+            wraps=throttling.verify_password,
+        ) as verify:
+            response = self.login('ghost@test.com', 'somepass')
+        self.assertEqual(response.status_code, 401)
+        verify.assert_called_once_with(
+            'somepass',
+            throttling.dummy_password_hash(),
+        )
+
+    def test_success_resets_email_failures(self):
+        for _ in range(2):
+            self.login('victim@test.com', 'wrongpass')
+        response = self.login('victim@test.com', 'rightpass')
+        self.assertEqual(response.status_code, 200)
+        for _ in range(2):
+            self.login('victim@test.com', 'wrongpass')
+        response = self.login('victim@test.com', 'rightpass')
+        self.assertEqual(response.status_code, 200)
+
+
+class TokenLifecycleTests(TestCase):
+    def setUp(self):
+        denylist.reset()
+        self.client = APIClient()
+        user = CustomUser.objects.create(
+            email='tokens@test.com',
+            first_name='Token',
+            last_name='User',
+        )
+        user.set_password('tokenpass')
+        user.save()
+        response = self.client.post(
+            '/api/auth/login/',
+            {'email': 'tokens@test.com', 'password': 'tokenpass'},
+            format='json',
+        )
+        self.access = response.data['token']
+        self.refresh = response.data['refresh']
+
+    def authorize(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_tokens_expire_and_have_jti(self):
+        payload = decode_token(self.access)
+        self.assertIn('jti', payload)
+        self.assertIn('exp', payload)
+        self.authorize(self.refresh)
+        response = self.client.post('/api/auth/logout/')
+        self.assertIsNone(response.wsgi_request.user)
+
+    def test_refresh_rotates_token(self):
+        """Refresh-токен одноразовый: после обмена повторно не принимается"""
+        response = self.client.post(
+            '/api/auth/refresh/',
+            {'refresh': self.refresh},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('token', response.data)
+        response = self.client.post(
+            '/api/auth/refresh/',
+            {'refresh': self.refresh},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_refresh_reuse_rejected_across_workers(self):
+        """Токен, отозванный другим воркером, не обменивается повторно"""
+        payload = decode_token(self.refresh, REFRESH)
+        denylist.maybe_sync()
+        RevokedToken.objects.create(
+            jti=payload['jti'],
+            expires_at=timezone.now() + timedelta(days=1),
+        )
+        self.assertFalse(denylist.is_revoked(payload['jti']))
+        response = self.client.post(
+            '/api/auth/refresh/',
+            {'refresh': self.refresh},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertNotIn('token', response.data)
+
+    def test_non_object_bodies_rejected(self):
+        """JSON-массив в теле даёт 401, а не 500"""
+        for url in ('/api/auth/login/', '/api/auth/refresh/'):
+            response = self.client.post(url, [self.refresh], format='json')
+            self.assertEqual(
+                response.status_code,
+                status.HTTP_401_UNAUTHORIZED,
+            )
+        self.authorize(self.access)
+        response = self.client.post(
+            '/api/auth/logout/',
+            [self.refresh],
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_logout_revokes_access_token(self):
+        self.authorize(self.access)
+        response = self.client.post(
+            '/api/auth/logout/',
+            {'refresh': self.refresh},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(RevokedToken.objects.count(), 2)
+        with self.assertNumQueries(0):
+            response = self.client.post('/api/auth/logout/')
+        self.assertIsNone(response.wsgi_request.user)
+
+    def test_denylist_syncs_from_table(self):
+        """Отзыв, сделанный другим процессом, подтягивается из таблицы"""
+        payload = decode_token(self.access)
+        RevokedToken.objects.create(
+            jti=payload['jti'],
+            expires_at=RevokedToken._meta.get_field('expires_at').to_python(
+                '2999-01-01T00:00:00Z',
+            ),
+        )
+        self.assertFalse(denylist.is_revoked(payload['jti']))
+        denylist._synced_at = None
+        self.assertTrue(denylist.is_revoked(payload['jti']))
+
+    def test_denylist_sync_rescans_overlap(self):
+        """Строка с меньшим id, закоммиченная позже, не теряется"""
+        expires_at = RevokedToken._meta.get_field('expires_at').to_python(
+            '2999-01-01T00:00:00Z',
+        )
+        RevokedToken.objects.create(
+            id=1000, jti='later-id', expires_at=expires_at,
+        )
+        denylist._synced_at = None
+        self.assertTrue(denylist.is_revoked('later-id'))
+        payload = decode_token(self.access)
+        RevokedToken.objects.create(
+            id=500, jti=payload['jti'], expires_at=expires_at,
+        )
+        interval = settings.TOKEN_DENYLIST_SYNC_INTERVAL
+        denylist._synced_at -= interval + 1
+        RevokedToken.objects.filter(id=500).update(
+            created_at=timezone.now() - timedelta(seconds=interval + 5),
+        )
+        self.assertTrue(denylist.is_revoked(payload['jti']))
+
+
+class ProductApiTests(TestCase):
+    def setUp(self):
+        permission_matrix.invalidate()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create(
+            email='products@test.com',
+            first_name='Product',
+            last_name='Owner',
+        )
+        self.user.set_password('productpass')
+        self.user.save()
+        self.other = CustomUser.objects.create(
+            email='stranger@test.com',
+            first_name='Stranger',
+            last_name='User',
+        )
+        role = Role.objects.create(name='user')
+        element = BusinessElement.objects.create(name='products')
+        AccessRule.objects.create(
+            role=role,
+            element=element,
+            read_own=True,
+            create=True,
+            update_own=True,
+            delete_own=True,
+        )
+        UserRole.objects.create(user=self.user, role=role)
+        Product.objects.bulk_create(
+            Product(
+                name=f'P{i}',
+                owner=self.user if i % 3 == 0 else self.other,
+            )
+            for i in range(3000)
+        )
+        login_resp = self.client.post(
+            '/api/auth/login/',
+            {'email': 'products@test.com', 'password': 'productpass'},
+            format='json',
+        )
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {login_resp.data["token"]}',
+        )
+
+    def test_bearer_request_needs_no_csrf(self):
+        """Запрос с Bearer-токеном не проверяется на CSRF, как в сессиях"""
+        client = APIClient(enforce_csrf_checks=True)
+        client.credentials(**self.client._credentials)
+        response = client.post(
+            '/api/products/',
+            {'name': 'Без CSRF'},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_list_is_scoped_and_paginated(self):
+        """Только свои продукты, постранично, с постоянным числом запросов"""
+        self.client.get('/api/products/')
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/products/?page_size=100')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = [p['id'] for p in response.data['results']]
+        self.assertEqual(len(ids), 100)
+        self.assertEqual(ids, sorted(ids))
+        seen = len(ids)
+        next_url = response.data['next']
+        while next_url:
+            response = self.client.get(next_url)
+            results = response.data['results']
+            self.assertTrue(
+                all(p['owner_id'] == self.user.id for p in results),
+            )
+            seen += len(results)
+            next_url = response.data['next']
+        self.assertEqual(seen, 1000)
+
+    def test_permission_lookups_memoized_per_request(self):
+        """
+        Роли разрешаются один раз за запрос, решение движка политик
+        переживает запрос и не пересобирается
+        """
+        permissions.policy_engine.clear()
+        with mock.patch.object(
+            permissions.policy_engine,
+            'compile',
+            wraps=permissions.policy_engine.compile,
+        ) as compile_decision:
+            response = self.client.get('/api/products/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            compiled = compile_decision.call_count
+            self.assertGreater(compiled, 0)
+            self.assertEqual(
+                list(response.wsgi_request.permission_cache),
+                [self.user.id],
+            )
+            self.client.get('/api/products/')
+            self.assertEqual(compile_decision.call_count, compiled)
+        self.assertIsNone(permissions._request_cache.get())
+
+    def test_detail_checks_ownership(self):
+        own = Product.objects.filter(owner=self.user).first()
+        foreign = Product.objects.filter(owner=self.other).first()
+        response = self.client.get(f'/api/products/{own.id}/')
+        self.assertEqual(response.data['name'], own.name)
+        response = self.client.put(
+            f'/api/products/{foreign.id}/',
+            {'name': 'Stolen'},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.delete(f'/api/products/{own.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(Product.objects.filter(id=own.id).exists())
+        response = self.client.get(f'/api/products/{own.id}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_create_sets_owner(self):
+        response = self.client.post(
+            '/api/products/',
+            {'name': 'Tablet'},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['owner_id'], self.user.id)
+
+
+class PermissionCacheTests(TestCase):
+    def setUp(self):
+        caches['permissions'].clear()
+        self.channel = LocalChannel()
+        self.worker_a = PermissionMatrix(channel=self.channel)
+        self.worker_b = PermissionMatrix(channel=self.channel)
+        self.user = CustomUser.objects.create(
+            email='cache@test.com',
+            first_name='Cache',
+            last_name='User',
+        )
+        self.role = Role.objects.create(name='user')
+        element = BusinessElement.objects.create(name='products')
+        AccessRule.objects.create(
+            role=self.role,
+            element=element,
+            read_own=True,
+        )
+        UserRole.objects.create(user=self.user, role=self.role)
+
+    def test_second_worker_is_served_from_l2(self):
+        """Второй воркер берёт матрицу и роли из общего L2 без запросов"""
+        read_own = FLAG_BITS['read_own']
+        mask = self.worker_a.mask(self.user.id, 'products')
+        self.assertEqual(mask, read_own)
+        with self.assertNumQueries(0):
+            mask = self.worker_b.mask(self.user.id, 'products')
+        self.assertEqual(mask, read_own)
+
+    def test_invalidation_reaches_other_workers(self):
+        """Сообщение в канале сбрасывает L1 во всех воркерах"""
+        self.worker_a.mask(self.user.id, 'products')
+        self.worker_b.mask(self.user.id, 'products')
+        AccessRule.objects.filter(role=self.role).update(read_all=True)
+        self.worker_a.invalidate()
+        self.assertTrue(
+            self.worker_b.mask(self.user.id, 'products')
+            & FLAG_BITS['read_all'],
+        )
+        UserRole.objects.filter(user=self.user).update(
+            role=Role.objects.create(name='guest'),
+        )
+        self.worker_b.invalidate_user(self.user.id)
+        self.assertEqual(self.worker_a.mask(self.user.id, 'products'), 0)
+
+    def test_lru_cache_evicts_and_expires(self):
+        lru = LRUCache(maxsize=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertNotIn('b', lru)
+        self.assertEqual(lru.get('a'), 1)
+        expired = LRUCache(maxsize=2, ttl=-1)
+        expired.set('a', 1)
+        self.assertIsNone(expired.get('a'))
+
+
+class UserPermissionsLoadingTests(TestCase):
+    def setUp(self):
+        permission_matrix.invalidate()
+        products = BusinessElement.objects.create(name='products')
+        orders = BusinessElement.objects.create(name='orders')
+        reader = Role.objects.create(name='reader')
+        writer = Role.objects.create(name='writer')
+        AccessRule.objects.create(role=reader, element=products, read_all=True)
+        AccessRule.objects.create(role=writer, element=products, create=True)
+        AccessRule.objects.create(role=writer, element=orders, read_own=True)
+        self.users = []
+        for index in range(3):
+            user = CustomUser.objects.create(
+                email=f'loaded{index}@test.com',
+                first_name='Loaded',
+                last_name='User',
+            )
+            UserRole.objects.create(user=user, role=reader)
+            UserRole.objects.create(user=user, role=writer)
+            self.users.append(user)
+        self.roleless = CustomUser.objects.create(
+            email='roleless@test.com',
+            first_name='No',
+            last_name='Roles',
+        )
+        self.expected_rules = {
+            'products': FLAG_BITS['read_all'] | FLAG_BITS['create'],
+            'orders': FLAG_BITS['read_own'],
+        }
+
+    def test_get_with_permissions_is_one_query(self):
+        """Пользователь и его роли загружаются одним запросом"""
+        permission_matrix.has_element('products')
+        with self.assertNumQueries(1):
+            user = CustomUser.objects.get_with_permissions(
+                id=self.users[0].id,
+                is_active=True,
+            )
+            self.assertEqual(user.email, 'loaded0@test.com')
+            self.assertEqual(len(user.role_ids), 2)
+            self.assertEqual(user.effective_rules, self.expected_rules)
+            check_permission(user, 'products', 'read', 0)
+        user = CustomUser.objects.get_with_permissions(id=self.roleless.id)
+        self.assertEqual(user.role_ids, ())
+        with self.assertRaises(CustomUser.DoesNotExist):
+            CustomUser.objects.get_with_permissions(id=0)
+
+    def test_with_permissions_prefetches_roles(self):
+        permission_matrix.has_element('products')
+        with self.assertNumQueries(2):
+            users = list(
+                CustomUser.objects.with_permissions().exclude(
+                    id=self.roleless.id,
+                ),
+            )
+            for user in users:
+                self.assertTrue(user.has_loaded_roles)
+                self.assertEqual(user.effective_rules, self.expected_rules)
+
+
+class ImportUsersCommandTests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w', encoding='utf-8') as target:
+            target.write(content)
+        return path
+
+    def test_import_csv_with_roles(self):
+        path = self.write(
+            'users.csv',
+            'email,password,first_name,last_name\n'
+            'a@test.com,passA,Ann,A\n'
+            'b@test.com,passB,Bob,B\n'
+            'a@test.com,dup,Ann,Again\n'
+            ',nopass,No,Email\n'
+            'not-an-email,passC,Bad,Email\n'
+            'c@TEST.com,passC,Cid,C\n',
+        )
+        errors = io.StringIO()
+        call_command(
+            'import_users',
+            path,
+            batch_size=2,
+            workers=0,
+            rounds=4,
+            stdout=io.StringIO(),
+            stderr=errors,
+        )
+        self.assertEqual(CustomUser.objects.count(), 3)
+        self.assertTrue(CustomUser.objects.filter(email='c@test.com').exists())
+        self.assertEqual(
+            errors.getvalue().splitlines(),
+            [
+                'Запись 4 отклонена: нет email',
+                "Запись 5 отклонена: некорректный email 'not-an-email'",
+            ],
+        )
+        user = CustomUser.objects.get(email='b@test.com')
+        self.assertTrue(user.check_password('passB'))
+        self.assertEqual(
+            list(user.userrole_set.values_list('role__name', flat=True)),
+            ['user'],
+        )
+        self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+
+    def test_resume_from_checkpoint_with_process_pool(self):
+        """Импорт продолжается с записи из контрольной точки"""
+        path = self.write(
+            'users.jsonl',
+            '\n'.join(
+                json.dumps({
+                    'email': f'user{index}@test.com',
+                    'password': f'pass{index}',
+                    'first_name': 'Imported',
+                    'last_name': 'User',
+                })
+                for index in range(5)
+            ),
+        )
+        self.write('users.jsonl.checkpoint', '2')
+        call_command(
+            'import_users',
+            path,
+            workers=2,
+            rounds=4,
+            stdout=io.StringIO(),
+        )
+        self.assertEqual(
+            sorted(CustomUser.objects.values_list('email', flat=True)),
+            ['user2@test.com', 'user3@test.com', 'user4@test.com'],
+        )
+
+    def test_long_names_rejected_and_conflicts_ignored(self):
+        """Длинное имя отклоняется, занятый email не роняет пачку"""
+        path = self.write(
+            'users.jsonl',
+            '\n'.join(
+                json.dumps(record)
+                for record in (
+                    {'email': 'long@test.com', 'password': 'p',
+                     'first_name': 'x' * 101},
+                    {'email': 'race@test.com', 'password': 'p'},
+                    {'email': 'calm@test.com', 'password': 'p'},
+                )
+            ),
+        )
+
+        def register_concurrently(password, rounds):
+            CustomUser.objects.get_or_create(
+                email='race@test.com',
+                defaults={'first_name': 'Race'},
+            )
+            return hash_password(password, rounds)
+
+        errors = io.StringIO()
+        with mock.patch(
+            'core.management.commands.import_users.hash_password',
+            register_concurrently,
+        ):
+            call_command(
+                'import_users',
+                path,
+                workers=0,
+                rounds=4,
+                stdout=io.StringIO(),
+                stderr=errors,
+            )
+        self.assertEqual(
+            errors.getvalue().splitlines(),
+            ['Запись 1 отклонена: first_name длиннее 100 символов'],
+        )
+        self.assertEqual(
+            sorted(CustomUser.objects.values_list('email', flat=True)),
+            ['calm@test.com', 'race@test.com'],
+        )
+        self.assertEqual(
+            CustomUser.objects.get(email='race@test.com').first_name,
+            'Race',
+        )
+        self.assertEqual(UserRole.objects.count(), 2)
+
+
+class BenchmarkCommandTests(TestCase):
+    def test_benchmark_reports_and_detects_regressions(self):
+        """JSON с результатами, откат данных и ошибка при регрессии"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, 'bench.json')
+            call_command(
+                'benchmark_api',
+                users=5,
+                products=20,
+                roles=2,
+                requests=5,
+                login_requests=2,
+                warmup=1,
+                bcrypt_rounds=4,
+                output=output,
+                stdout=io.StringIO(),
+            )
+            with open(output, encoding='utf-8') as source:
+                results = json.load(source)['results']
+            self.assertEqual(
+                set(results),
+                {
+                    'login',
+                    'auth_middleware',
+                    'products_list',
+                    'products_list_all',
+                    'product_detail',
+                },
+            )
+            self.assertEqual(
+                results['products_list']['queries_per_request'],
+                2,
+            )
+            self.assertFalse(CustomUser.objects.exists())
+            for result in results.values():
+                result['p95_ms'] = 0
+            with open(output, 'w', encoding='utf-8') as target:
+                json.dump({'results': results}, target)
+            with self.assertRaisesMessage(CommandError, 'p95'):
+                call_command(
+                    'benchmark_api',
+                    users=5,
+                    products=20,
+                    requests=5,
+                    endpoint=['auth_middleware'],
+                    baseline=output,
+                    stdout=io.StringIO(),
+                )
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        permission_matrix.invalidate()
+        instrumentation.reset_metrics()
+        self.user = CustomUser.objects.create(
+            email='metrics@test.com',
+            first_name='Metrics',
+            last_name='User',
+        )
+        self.user.set_password('metricspass')
+        self.user.save()
+        role = Role.objects.create(name='user')
+        element = BusinessElement.objects.create(name='products')
+        AccessRule.objects.create(role=role, element=element, read_own=True)
+        UserRole.objects.create(user=self.user, role=role)
+        self.token = issue_token(self.user)
+
+    @override_settings(INSTRUMENTATION_ENABLED=True)
+    def test_server_timing_log_and_metrics(self):
+        client = APIClient(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        with self.assertLogs('core.instrumentation', 'INFO') as logs:
+            response = client.get('/api/products/')
+        timing = response['Server-Timing']
+        for span in ('auth;', 'jwt;', 'permission;', 'total;'):
+            self.assertIn(span, timing)
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['view'], 'products_list')
+        self.assertEqual(record['status'], 200)
+        self.assertIn(f'desc="{record["queries"]} queries"', timing)
+        self.assertGreater(record['queries'], 0)
+        metrics = client.get('/api/metrics/')
+        self.assertEqual(metrics.status_code, status.HTTP_200_OK)
+        body = metrics.content.decode()
+        self.assertIn(
+            'http_request_duration_seconds_count'
+            '{view="products_list",method="GET"} 1',
+            body,
+        )
+        self.assertIn('span="permission"', body)
+
+    def test_disabled_by_default(self):
+        client = APIClient(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        response = client.get('/api/products/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(client.get('/api/metrics/').status_code, 404)
+
+
+class SigningKeyTests(TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.dir = tmpdir.name
+        self.jwks_path = os.path.join(self.dir, 'jwks.json')
+        self.user = CustomUser.objects.create(
+            email='keys@test.com',
+            first_name='Key',
+            last_name='User',
+        )
+
+    def generate(self, kid, algorithm='EdDSA', jwks_path=None):
+        path = os.path.join(self.dir, f'{kid}.pem')
+        call_command(
+            'generate_signing_key',
+            algorithm=algorithm,
+            private_key=path,
+            jwks=jwks_path or self.jwks_path,
+            kid=kid,
+            stdout=io.StringIO(),
+        )
+        return override_settings(
+            JWT_ALGORITHM=algorithm,
+            JWT_PRIVATE_KEY_FILE=path,
+            JWT_KEY_ID=kid,
+            JWT_JWKS_FILE=self.jwks_path,
+        )
+
+    def test_eddsa_token_verifiable_from_jwks(self):
+        """Другой сервис проверяет токен по JWKS без общего секрета"""
+        with self.generate('k1'):
+            token = issue_token(self.user)
+            self.assertEqual(
+                jwt.get_unverified_header(token),
+                {'alg': 'EdDSA', 'kid': 'k1', 'typ': 'JWT'},
+            )
+            self.assertEqual(decode_token(token)['user_id'], self.user.id)
+            response = self.client.get('/api/auth/jwks/')
+        self.assertIn('max-age', response['Cache-Control'])
+        (jwk,) = response.json()['keys']
+        self.assertNotIn('d', jwk)
+        payload = jwt.decode(
+            token,
+            jwt.PyJWK(jwk).key,
+            algorithms=[jwk['alg']],
+        )
+        self.assertEqual(payload['user_id'], self.user.id)
+
+    def test_rotation_keeps_old_tokens_valid(self):
+        with self.generate('k1'):
+            old_token = issue_token(self.user)
+        with self.generate('k2', algorithm='RS256'):
+            new_token = issue_token(self.user)
+            self.assertEqual(jwt.get_unverified_header(new_token)['kid'], 'k2')
+            self.assertEqual(decode_token(old_token)['user_id'], self.user.id)
+            self.assertEqual(decode_token(new_token)['user_id'], self.user.id)
+        with self.generate('rogue', jwks_path=os.path.join(self.dir, 'x')):
+            rogue_token = issue_token(self.user)
+        with self.generate('k3'):
+            with self.assertRaises(jwt.InvalidTokenError):
+                decode_token(rogue_token)
+
+
+class VerifiedTokenCacheTests(TestCase):
+    def setUp(self):
+        verified_tokens.clear()
+        denylist.reset()
+        self.user = CustomUser.objects.create(
+            email='cached@test.com',
+            first_name='Cached',
+            last_name='Token',
+        )
+        self.token = issue_token(self.user)
+
+    def test_signature_verified_once(self):
+        with mock.patch(
+            'core.signing_keys.jwt.decode',
+            wraps=jwt.decode,
+        ) as decode:
+            for _ in range(3):
+                payload = decode_token(self.token)
+        self.assertEqual(payload['user_id'], self.user.id)
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual(
+            verified_tokens.stats(),
+            {'hits': 2, 'misses': 1, 'size': 1},
+        )
+
+    def test_size_follows_setting(self):
+        with override_settings(VERIFIED_TOKEN_CACHE_SIZE=0):
+            decode_token(self.token)
+            self.assertEqual(verified_tokens.stats()['size'], 0)
+        decode_token(self.token)
+        self.assertEqual(verified_tokens.stats()['size'], 1)
+
+    def test_revocation_evicts_and_is_enforced(self):
+        """Отзыв — и локальный, и из другого процесса — действует сразу"""
+        payload = decode_token(self.token)
+        revoke_token(payload)
+        self.assertEqual(verified_tokens.stats()['size'], 0)
+        with self.assertRaises(jwt.InvalidTokenError):
+            decode_token(self.token)
+        other = issue_token(self.user)
+        other_payload = decode_token(other)
+        RevokedToken.objects.create(
+            jti=other_payload['jti'],
+            expires_at=timezone.now() + timedelta(minutes=5),
+        )
+        denylist.reset()
+        with self.assertRaises(jwt.InvalidTokenError):
+            decode_token(other)
+
+    def test_expired_entry_is_not_served(self):
+        payload = decode_token(self.token)
+        verified_tokens.set(self.token, dict(payload, exp=0))
+        self.assertIsNone(verified_tokens.get(self.token, get_key_ring()))
+        self.assertEqual(verified_tokens.stats()['size'], 0)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TestCase):
+    """
+    Маршрутизация на SQLite-заглушке реплики с собственными данными.
+    Алиас добавляется на время класса, поэтому databases задаётся
+    в setUpClass, а не в теле класса (его читает test runner).
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        connections.settings['replica'] = connections.configure_settings({
+            'default': {'ENGINE': 'django.db.backends.sqlite3'},
+        })['default']
+        cls.old_replica_name = connections['replica'].creation.create_test_db(
+            verbosity=0,
+        )
+        cls.databases = {'default', 'replica'}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].creation.destroy_test_db(
+            cls.old_replica_name,
+            verbosity=0,
+        )
+        del connections['replica']
+        del connections.settings['replica']
+
+    def setUp(self):
+        permission_matrix.invalidate()
+        self.user = CustomUser.objects.create(
+            email='primary@test.com',
+            first_name='Primary',
+            last_name='User',
+        )
+        CustomUser.objects.using('replica').create(
+            id=self.user.id,
+            email='primary@test.com',
+            first_name='Replica',
+            last_name='User',
+        )
+
+    def test_user_reads_go_to_replica(self):
+        with mock.patch.object(
+            connections['default'],
+            'in_atomic_block',
+            False,
+        ):
+            user = CustomUser.objects.get_with_permissions(id=self.user.id)
+            self.assertEqual(user.first_name, 'Replica')
+            self.assertEqual(
+                list(RevokedToken.objects.all()),
+                [],
+            )
+            with use_primary():
+                self.assertEqual(
+                    CustomUser.objects.get(id=self.user.id).first_name,
+                    'Primary',
+                )
+            user.first_name = 'Updated'
+            user.save()
+        self.assertEqual(
+            CustomUser.objects.using('default').get(id=user.id).first_name,
+            'Updated',
+        )
+
+    def test_transactions_and_writes_stay_on_primary(self):
+        """Внутри транзакции и при записи используется основная БД"""
+        self.assertEqual(
+            CustomUser.objects.get(id=self.user.id).first_name,
+            'Primary',
+        )
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_write(CustomUser), 'default')
+        with mock.patch.object(
+            connections['default'],
+            'in_atomic_block',
+            False,
+        ):
+            self.assertEqual(router.db_for_read(Role), 'replica')
+            self.assertEqual(router.db_for_read(RevokedToken), 'default')
+            self.assertEqual(router.db_for_read(Product), 'default')
+
+    def test_auth_critical_reads_use_primary(self):
+        """Вход, refresh и роли не зависят от отставания реплики"""
+        self.user.set_password('primarypass')
+        self.user.save()
+        role = Role.objects.create(name='user')
+        UserRole.objects.create(user=self.user, role=role)
+        permission_matrix.invalidate()
+        with mock.patch.object(
+            connections['default'],
+            'in_atomic_block',
+            False,
+        ):
+            self.assertEqual(
+                permission_matrix.role_ids(self.user.id),
+                (role.id,),
+            )
+            response = APIClient().post(
+                '/api/auth/login/',
+                {'email': 'primary@test.com', 'password': 'primarypass'},
+                format='json',
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            CustomUser.objects.filter(id=self.user.id).update(
+                is_active=False,
+            )
+            response = APIClient().post(
+                '/api/auth/refresh/',
+                {'refresh': response.data['refresh']},
+                format='json',
+            )
+            self.assertEqual(
+                response.status_code,
+                status.HTTP_401_UNAUTHORIZED,
+            )
+
+
+class StartupReportTests(TestCase):
+    def test_production_profile_is_lean(self):
+        """Профиль production обслуживает API без admin, сессий и схемы"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, 'startup.json')
+            call_command(
+                'startup_report',
+                runs=1,
+                requests=5,
+                output=output,
+                stdout=io.StringIO(),
+            )
+            with open(output, encoding='utf-8') as source:
+                results = json.load(source)
+        dev, production = results['dev'], results['production']
+        self.assertTrue(dev['loaded']['drf_spectacular'])
+        self.assertFalse(any(production['loaded'].values()))
+        self.assertLess(
+            len(production['middleware']),
+            len(dev['middleware']),
+        )
+        for result in (dev, production):
+            self.assertEqual(result['paths']['/api/auth/jwks/']['status'], 200)
+            self.assertEqual(result['paths']['/api/products/']['status'], 401)
+
+
+# Маршруты схемы добавляются при импорте URLconf, override_settings
+# их не включит: без API_DOCS (APP_PROFILE=production) тесты пропускаются.
+@skipUnless(settings.API_DOCS, 'URLconf собран без схемы API')
+class SchemaArtifactTests(TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.directory = tmpdir.name
+        overrides = override_settings(API_SCHEMA_DIR=self.directory)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_schema_served_from_artifact(self):
+        """Файл схемы отдаётся без генерации, с ETag, 304 и gzip"""
+        call_command('build_api_schema', stdout=io.StringIO())
+        path = os.path.join(self.directory, 'openapi-1.0.0.json')
+        with open(path, 'rb') as source:
+            body = source.read()
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/schema/?format=json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, body)
+        self.assertIn('/api/products/', json.loads(body)['paths'])
+
+        response = self.client.get(
+            '/api/schema/?format=json',
+            HTTP_IF_NONE_MATCH=response['ETag'],
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get(
+            '/api/schema/?format=json',
+            HTTP_ACCEPT_ENCODING='gzip, br',
+        )
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), body)
+        for refused in ('gzip;q=0, br', 'br, *;q=0'):
+            response = self.client.get(
+                '/api/schema/?format=json',
+                HTTP_ACCEPT_ENCODING=refused,
+            )
+            self.assertNotIn('Content-Encoding', response)
+            self.assertEqual(response.content, body)
+        call_command('build_api_schema', check=True, stdout=io.StringIO())
+
+    def test_missing_artifact(self):
+        """Без файла схема генерируется только при DEBUG"""
+        response = self.client.get('/api/schema/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        with override_settings(DEBUG=True):
+            response = self.client.get('/api/schema/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertRaisesMessage(CommandError, 'устарела'):
+            call_command('build_api_schema', check=True, stdout=io.StringIO())
+        # Файл, собранный другим процессом, подхватывается без reset().
+        with open(schema_path('json'), 'wb') as target:
+            target.write(b'{}')
+        response = self.client.get('/api/schema/?format=json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, b'{}')
+
+
+@override_settings(AUDIT_ENABLED=True)
+class AuditLogTests(TestCase):
+    def test_events_written_in_batches(self):
+        """record() не ходит в БД; flush пишет пачку, export её читает"""
+        log = AuditLog(sink=DatabaseSink(), autostart=False)
+        with self.assertNumQueries(0):
+            for user_id in range(5):
+                log.record('login', 'failure', user_id, '10.0.0.1')
+            log.record('permission', 'deny', 3, element='products')
+        with self.assertNumQueries(1):
+            self.assertEqual(log.flush(), 6)
+        self.assertEqual(AuditEvent.objects.count(), 6)
+
+        output = io.StringIO()
+        call_command(
+            'audit_export',
+            source='database',
+            event='permission',
+            stdout=output,
+        )
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(
+            json.loads(lines[0])['detail'],
+            {'element': 'products'},
+        )
+
+    @override_settings(AUDIT_BUFFER_SIZE=10, AUDIT_SAMPLE_RATE=0)
+    def test_backpressure_samples_then_drops(self):
+        """Заполненный буфер: успехи сэмплируются, сверх лимита — сброс"""
+        batches = []
+        log = AuditLog(
+            sink=mock.Mock(write=batches.append),
+            autostart=False,
+        )
+        for _ in range(8):
+            log.record('login', 'failure')
+        log.record('login', 'success')
+        for _ in range(4):
+            log.record('token', 'failure')
+        self.assertEqual(
+            log.stats(),
+            {
+                'buffered': 10,
+                'written': 0,
+                'dropped': 2,
+                'sampled_out': 1,
+                'failed': 0,
+            },
+        )
+        log.flush()
+        self.assertEqual(sum(map(len, batches)), 10)
+
+    def test_flusher_recycles_db_connection(self):
+        """Фоновый поток закрывает оборванное соединение до и после записи"""
+        calls = []
+        log = AuditLog(
+            sink=mock.Mock(write=lambda batch: calls.append('write')),
+            autostart=False,
+        )
+        log.record('login', 'failure')
+        with mock.patch.object(
+            audit,
+            'close_old_connections',
+            side_effect=lambda: calls.append('close'),
+        ):
+            log._flush_in_thread()
+        self.assertEqual(calls, ['close', 'write', 'close'])
+
+    def test_jsonl_path_resolved_per_process(self):
+        """{pid} подставляется при записи, а не при импорте"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sink = JsonlSink(os.path.join(tmpdir, 'audit-{pid}.jsonl'), 0, 0)
+            entry = (0, 'login', 'failure', None, None, {})
+            for pid in (100, 200):
+                with mock.patch.object(os, 'getpid', return_value=pid):
+                    sink.write([entry])
+            self.assertEqual(
+                sorted(os.listdir(tmpdir)),
+                ['audit-100.jsonl', 'audit-200.jsonl'],
+            )
+
+    def test_export_reads_rotated_backups(self):
+        """Экспорт находит копии, даже если базового файла уже нет"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'audit-{pid}.jsonl')
+            sink = JsonlSink(path, 1, 3)
+            for pid, event in ((100, 'login'), (100, 'refresh'),
+                               (200, 'logout')):
+                with mock.patch.object(os, 'getpid', return_value=pid):
+                    sink.write([(0, event, 'success', None, None, {})])
+            self.assertNotIn('audit-100.jsonl', os.listdir(tmpdir))
+            output = io.StringIO()
+            with override_settings(
+                AUDIT_FILE=path,
+                AUDIT_FILE_MAX_BYTES=1,
+                AUDIT_FILE_BACKUPS=3,
+            ):
+                call_command('audit_export', source='jsonl', stdout=output)
+        events = [
+            json.loads(line)['event']
+            for line in output.getvalue().splitlines()
+        ]
+        self.assertEqual(events, ['login', 'refresh', 'logout'])
+
+    def test_login_token_and_denials_audited(self):
+        """Неудачный вход, плохой токен и отказ в доступе попадают в JSONL"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'audit-{pid}.jsonl')
+            overrides = override_settings(AUDIT_SINK='jsonl', AUDIT_FILE=path)
+            with overrides, mock.patch.object(
+                audit.audit_log,
+                'autostart',
+                False,
+            ):
+                user = CustomUser.objects.create(
+                    email='audit@test.com',
+                    first_name='Audit',
+                    last_name='User',
+                )
+                user.set_password('right')
+                user.save()
+                BusinessElement.objects.create(name='products')
+                permission_matrix.invalidate()
+                client = APIClient()
+                client.post(
+                    '/api/auth/login/',
+                    {'email': 'audit@test.com', 'password': 'wrong'},
+                    format='json',
+                )
+                client.credentials(HTTP_AUTHORIZATION='Bearer broken')
+                client.get('/api/products/')
+                client.credentials(
+                    HTTP_AUTHORIZATION=f'Bearer {issue_token(user)}',
+                )
+                client.post('/api/products/', {'name': 'X'}, format='json')
+                audit.audit_log.flush()
+
+                output = io.StringIO()
+                call_command(
+                    'audit_export',
+                    source='jsonl',
+                    format='csv',
+                    stdout=output,
+                )
+        rows = output.getvalue().splitlines()[1:]
+        self.assertEqual(
+            [row.split(',')[1:3] for row in rows],
+            [
+                ['login', 'failure'],
+                ['token', 'failure'],
+                ['permission', 'deny'],
+            ],
+        )
+
+
+class AccessAdministrationTests(TestCase):
+    def setUp(self):
+        permission_matrix.invalidate()
+        self.client = APIClient()
+        self.admin = CustomUser.objects.create(
+            email='root@test.com',
+            first_name='Root',
+            last_name='Admin',
+        )
+        self.admin.set_password('rootpass')
+        self.admin.save()
+        admin_role = Role.objects.create(name='admin')
+        Role.objects.create(name='user')
+        element = BusinessElement.objects.create(name='access_rules')
+        BusinessElement.objects.create(name='products')
+        AccessRule.objects.create(
+            role=admin_role,
+            element=element,
+            read_all=True,
+            create=True,
+            update_all=True,
+            delete_all=True,
+        )
+        UserRole.objects.create(user=self.admin, role=admin_role)
+        self.users = [
+            CustomUser.objects.create(
+                email=f'member{i}@test.com',
+                first_name='Member',
+                last_name=str(i),
+            )
+            for i in range(5)
+        ]
+        self.login('root@test.com', 'rootpass')
+
+    def login(self, email, password):
+        response = self.client.post(
+            '/api/auth/login/',
+            {'email': email, 'password': password},
+            format='json',
+        )
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {response.data["token"]}',
+        )
+
+    def test_upsert_rules_invalidates_per_batch(self):
+        """
+        Пачка правил сбрасывает кэш один раз на пачку, а не на строку:
+        сразу и повторно после коммита
+        """
+        rows = [
+            {'role': 'user', 'element': 'products', 'read_own': True},
+            {'role': 'admin', 'element': 'products', 'read_all': True},
+        ]
+        with mock.patch.object(
+            permission_matrix,
+            'invalidate',
+        ) as invalidate, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/access-rules/',
+                rows,
+                format='json',
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['upserted'], 2)
+        self.assertEqual(invalidate.call_count, 2)
+        rows[0]['create'] = True
+        self.client.post('/api/access-rules/', rows, format='json')
+        rule = AccessRule.objects.get(
+            role__name='user',
+            element__name='products',
+        )
+        self.assertTrue(rule.read_own and rule.create)
+        response = self.client.get('/api/access-rules/')
+        self.assertEqual(len(response.data), 3)
+
+    def test_unknown_role_is_rejected(self):
+        response = self.client.post(
+            '/api/access-rules/',
+            [{'role': 'ghost', 'element': 'products'}],
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with mock.patch.object(permission_matrix, 'invalidate') as invalidate:
+            response = self.client.post(
+                '/api/access-rules/',
+                [],
+                format='json',
+            )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        invalidate.assert_not_called()
+
+    def test_malformed_conditions_fail_closed(self):
+        """Правило с некорректными условиями не ломает проверки прав"""
+        rule = {
+            'role': 'admin',
+            'element': 'products',
+            'read_all': True,
+            'conditions': {'attributes': {'ip': {'x': 1}}},
+        }
+        response = self.client.post(
+            '/api/access-rules/',
+            [rule],
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # Строка, записанная в обход API, закрывает только своё правило.
+        AccessRule.objects.create(
+            role=Role.objects.get(name='admin'),
+            element=BusinessElement.objects.get(name='products'),
+            read_all=True,
+            conditions=rule['conditions'],
+        )
+        response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get('/api/access-rules/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_bulk_grant_and_revoke(self):
+        """Выдача и отзыв роли пачке пользователей — один сброс кэша"""
+        user_ids = [user.id for user in self.users]
+        with mock.patch.object(
+            permission_matrix,
+            'invalidate_users',
+        ) as invalidate_users:
+            response = self.client.post(
+                '/api/user-roles/',
+                {'role': 'user', 'user_ids': user_ids},
+                format='json',
+            )
+        self.assertEqual(response.data['granted'], 5)
+        self.assertEqual(invalidate_users.call_count, 1)
+        self.assertEqual(
+            UserRole.objects.filter(role__name='user').count(),
+            5,
+        )
+        with mock.patch.object(
+            permission_matrix,
+            'invalidate_users',
+        ) as invalidate_users:
+            response = self.client.delete(
+                '/api/user-roles/',
+                {'role': 'user', 'user_ids': user_ids[:3]},
+                format='json',
+            )
+        self.assertEqual(response.data['revoked'], 3)
+        self.assertEqual(invalidate_users.call_count, 1)
+        self.assertEqual(
+            set(invalidate_users.call_args.args[0]),
+            set(user_ids[:3]),
+        )
+
+    def test_non_admin_is_forbidden(self):
+        member = self.users[0]
+        member.set_password('memberpass')
+        member.save()
+        self.login(member.email, 'memberpass')
+        response = self.client.post(
+            '/api/user-roles/',
+            {'role': 'admin', 'user_ids': [member.id]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(UserRole.objects.filter(user=member).exists())
@@ -0,0 +1,80 @@
+import functools
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from core.hashing import hash_password, verify_password
+from core.instrumentation import timed
+
+FAILURES_KEY = 'login-failures:{}:{}'
+
+
+def get_client_ip(request):
+    return request.META.get('REMOTE_ADDR', '')
+
+
+@functools.lru_cache(maxsize=None)
+def _dummy_hash(rounds):
+    return hash_password('dummy-password-for-timing', rounds=rounds)
+
+
+def dummy_password_hash():
+    """Хэш для несуществующих email: время ответа не выдаёт аккаунты."""
+    return _dummy_hash(settings.BCRYPT_ROUNDS)
+
+
+@timed('password')
+def verify_dummy_password(password):
+    verify_password(password, dummy_password_hash())
+    return False
+
+
+class LoginThrottle:
+    """
+    Скользящее окно неудачных входов по email и по IP в локальном кэше.
+    Проверка выполняется до запросов к БД и до bcrypt.
+    """
+
+    def __init__(self, cache_alias=None):
+        self.cache = caches[cache_alias or settings.LOGIN_THROTTLE_CACHE]
+
+    def _limits(self, email, ip):
+        return (
+            ('email', str(email or '').lower(), settings.LOGIN_THROTTLE_EMAIL),
+            ('ip', ip, settings.LOGIN_THROTTLE_IP),
+        )
+
+    def _recent(self, key, now):
+        window_start = now - settings.LOGIN_THROTTLE_WINDOW
+        return [t for t in self.cache.get(key, ()) if t > window_start]
+
+    def retry_after(self, email, ip):
+        """Секунды до разблокировки или 0, если попытка разрешена."""
+        now = time.time()
+        wait = 0
+        for kind, value, limit in self._limits(email, ip):
+            failures = self._recent(FAILURES_KEY.format(kind, value), now)
+            if len(failures) >= limit:
+                oldest = failures[-limit]
+                wait = max(wait, oldest + settings.LOGIN_THROTTLE_WINDOW - now)
+        return int(wait) + 1 if wait else 0
+
+    def register_failure(self, email, ip):
+        now = time.time()
+        for kind, value, limit in self._limits(email, ip):
+            key = FAILURES_KEY.format(kind, value)
+            failures = self._recent(key, now)
+            failures.append(now)
+            self.cache.set(
+                key,
+                failures[-limit:],
+                settings.LOGIN_THROTTLE_WINDOW,
+            )
+
+    def reset(self, email):
+        email = str(email or '').lower()
+        self.cache.delete(FAILURES_KEY.format('email', email))
+
+
+login_throttle = LoginThrottle()
@@ -0,0 +1,297 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import jwt
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from core.instrumentation import timed
+from core.models import CustomUser, RevokedToken
+from core.permissions import permission_matrix
+from core.signing_keys import get_key_ring
+
+USER_STATUS_KEY = 'auth:user-active:{}'
+ACCESS = 'access'
+REFRESH = 'refresh'
+
+
+class TokenDenylist:
+    """
+    Отозванные jti в памяти процесса: проверка — поиск в dict без
+    запросов. Новые записи подтягиваются из RevokedToken не чаще раза
+    в TOKEN_DENYLIST_SYNC_INTERVAL секунд. Синхронизация идёт по
+    created_at с перекрытием TOKEN_DENYLIST_SYNC_OVERLAP, а не по
+    максимальному id: id из последовательности PostgreSQL фиксируются
+    не по порядку, и строка с меньшим id, закоммиченная позже, была бы
+    пропущена навсегда.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._revoked = {}
+            self._synced_at = None
+
+    def _sync(self):
+        now = time.time()
+        rows = RevokedToken.objects.filter(
+            expires_at__gt=datetime.fromtimestamp(now, timezone.utc),
+        )
+        if self._synced_at is not None:
+            since = self._synced_at - settings.TOKEN_DENYLIST_SYNC_OVERLAP
+            rows = rows.filter(
+                created_at__gte=datetime.fromtimestamp(since, timezone.utc),
+            )
+        revoked = {
+            jti: exp for jti, exp in self._revoked.items() if exp > now
+        }
+        for jti, expires_at in rows.values_list('jti', 'expires_at'):
+            revoked[jti] = expires_at.timestamp()
+        self._revoked = revoked
+        self._synced_at = now
+
+    def _is_stale(self):
+        return (
+            self._synced_at is None
+            or time.time() - self._synced_at
+            >= settings.TOKEN_DENYLIST_SYNC_INTERVAL
+        )
+
+    def maybe_sync(self):
+        if not self._is_stale():
+            return
+        with self._lock:
+            if self._is_stale():
+                self._sync()
+
+    async def amaybe_sync(self):
+        if self._is_stale():
+            await sync_to_async(self.maybe_sync)()
+
+    def is_revoked(self, jti):
+        self.maybe_sync()
+        return jti in self._revoked
+
+    def revoke(self, jti, exp):
+        """
+        True, если jti отозван этим вызовом. Уникальный jti в таблице —
+        единственная проверка, общая для всех воркеров.
+        """
+        _, created = RevokedToken.objects.get_or_create(
+            jti=jti,
+            defaults={
+                'expires_at': datetime.fromtimestamp(exp, timezone.utc),
+            },
+        )
+        # _sync под этой же блокировкой перебирает и подменяет словарь.
+        with self._lock:
+            self._revoked[jti] = exp
+        return created
+
+
+denylist = TokenDenylist()
+
+
+class VerifiedTokenCache:
+    """
+    LRU уже проверенных access-токенов: ключ — sha256 строки токена,
+    запись живёт до exp. Повторный запрос с тем же токеном обходится
+    без проверки подписи. При смене ключей подписи кэш сбрасывается.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._data = OrderedDict()
+            self._by_jti = {}
+            self._key_ring = None
+            self.hits = 0
+            self.misses = 0
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token, key_ring):
+        key = self._key(token)
+        with self._lock:
+            if key_ring is not self._key_ring:
+                self._data.clear()
+                self._by_jti.clear()
+                self._key_ring = key_ring
+            payload = self._data.get(key)
+            if payload is None:
+                self.misses += 1
+                return None
+            if payload['exp'] <= time.time():
+                self._discard(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def set(self, token, payload):
+        if self.maxsize <= 0:
+            return
+        key = self._key(token)
+        with self._lock:
+            self._data[key] = payload
+            self._by_jti[payload['jti']] = key
+            while len(self._data) > self.maxsize:
+                _, evicted = self._data.popitem(last=False)
+                self._by_jti.pop(evicted['jti'], None)
+
+    def _discard(self, key):
+        payload = self._data.pop(key, None)
+        if payload is not None:
+            self._by_jti.pop(payload['jti'], None)
+
+    def discard_jti(self, jti):
+        with self._lock:
+            key = self._by_jti.get(jti)
+            if key is not None:
+                self._discard(key)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data),
+        }
+
+
+verified_tokens = VerifiedTokenCache(settings.VERIFIED_TOKEN_CACHE_SIZE)
+
+
+@receiver(setting_changed)
+def _resize_verified_tokens(setting, **kwargs):
+    if setting == 'VERIFIED_TOKEN_CACHE_SIZE':
+        verified_tokens.maxsize = settings.VERIFIED_TOKEN_CACHE_SIZE
+        verified_tokens.clear()
+
+
+def _encode(payload, token_type, lifetime):
+    now = int(time.time())
+    payload.update({
+        'type': token_type,
+        'jti': uuid.uuid4().hex,
+        'iat': now,
+        'exp': now + lifetime,
+    })
+    return get_key_ring().encode(payload)
+
+
+def issue_token(user):
+    payload = {'user_id': user.id}
+    if settings.AUTH_STATELESS_TOKENS:
+        payload['roles'] = list(permission_matrix.role_ids(user.id))
+        payload['pv'] = permission_matrix.generation
+    return _encode(payload, ACCESS, settings.ACCESS_TOKEN_LIFETIME)
+
+
+def issue_refresh_token(user):
+    return _encode(
+        {'user_id': user.id},
+        REFRESH,
+        settings.REFRESH_TOKEN_LIFETIME,
+    )
+
+
+def issue_token_pair(user):
+    return {'token': issue_token(user), 'refresh': issue_refresh_token(user)}
+
+
+def _verify(token, token_type, key_ring):
+    payload = key_ring.decode(token, options={'require': ['exp', 'jti']})
+    if payload.get('type') != token_type:
+        raise jwt.InvalidTokenError('Unexpected token type.')
+    return payload
+
+
+@timed('jwt')
+def decode_token(token, token_type=ACCESS):
+    """
+    Access-токены берутся из verified_tokens, если уже проверялись;
+    denylist проверяется всегда — отзыв в другом процессе виден и
+    для закэшированных токенов.
+    """
+    key_ring = get_key_ring()
+    if token_type != ACCESS:
+        payload = _verify(token, token_type, key_ring)
+    else:
+        payload = verified_tokens.get(token, key_ring)
+        if payload is None:
+            payload = _verify(token, token_type, key_ring)
+            verified_tokens.set(token, payload)
+    if denylist.is_revoked(payload['jti']):
+        raise jwt.InvalidTokenError('Token has been revoked.')
+    return payload
+
+
+async def adecode_token(token, token_type=ACCESS):
+    await denylist.amaybe_sync()
+    return decode_token(token, token_type)
+
+
+def revoke_token(payload):
+    """False, если токен уже был отозван (например, другим запросом)."""
+    created = denylist.revoke(payload['jti'], payload['exp'])
+    verified_tokens.discard_jti(payload['jti'])
+    return created
+
+
+def get_bearer_token(request):
+    auth_header = request.META.get('HTTP_AUTHORIZATION')
+    if auth_header and auth_header.startswith('Bearer '):
+        return auth_header.split(' ')[1]
+    return None
+
+
+def remember_user_status(user_id, is_active):
+    cache.set(
+        USER_STATUS_KEY.format(user_id),
+        is_active,
+        settings.AUTH_USER_STATUS_TTL,
+    )
+
+
+def is_user_active(user_id):
+    """
+    Проверка is_active с коротким TTL: БД опрашивается не чаще раза
+    в AUTH_USER_STATUS_TTL секунд на пользователя.
+    """
+    is_active = cache.get(USER_STATUS_KEY.format(user_id))
+    if is_active is None:
+        is_active = CustomUser.objects.filter(
+            id=user_id,
+            is_active=True,
+        ).exists()
+        remember_user_status(user_id, is_active)
+    return is_active
+
+
+async def ais_user_active(user_id):
+    key = USER_STATUS_KEY.format(user_id)
+    is_active = await cache.aget(key)
+    if is_active is None:
+        is_active = await CustomUser.objects.filter(
+            id=user_id,
+            is_active=True,
+        ).aexists()
+        await cache.aset(key, is_active, settings.AUTH_USER_STATUS_TTL)
+    return is_active
@@ -1,17 +1,32 @@
+from django.conf import settings
 from django.urls import path
 
 from core import views
 
+if settings.ASYNC_AUTH_VIEWS:
+    register_view, login_view = views.register_async, views.login_async
+    products_view = views.products_list_async
+    product_detail_view = views.product_detail_async
+else:
+    register_view, login_view = views.register, views.login
+    products_view = views.products_list
+    product_detail_view = views.product_detail
+
 urlpatterns = [
-    path('auth/register/', views.register, name='register'),
-    path('auth/login/', views.login, name='login'),
+    path('auth/register/', register_view, name='register'),
+    path('auth/login/', login_view, name='login'),
+    path('auth/refresh/', views.refresh, name='refresh'),
     path('auth/logout/', views.logout, name='logout'),
     path('auth/delete/', views.delete_account, name='delete_account'),
     path('auth/profile/', views.update_profile, name='update_profile'),
-    path('products/', views.products_list, name='products_list'),
+    path('auth/jwks/', views.jwks, name='jwks'),
+    path('products/', products_view, name='products_list'),
     path(
         'products/<int:product_id>/',
-        views.product_detail,
+        product_detail_view,
         name='product_detail',
     ),
+    path('access-rules/', views.access_rules, name='access_rules'),
+    path('user-roles/', views.user_roles, name='user_roles'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
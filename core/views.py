@@ -1,12 +1,72 @@
+import json
+
 import jwt
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from drf_spectacular.utils import extend_schema
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import (
+    require_GET,
+    require_http_methods,
+    require_POST,
+)
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import APIException
 from rest_framework.response import Response
 
-from core.models import AccessRule, BusinessElement, CustomUser, UserRole
-from core.permissions import check_permission
-from core.serializers import RegisterSerializer, UserUpdateSerializer
+from core import audit
+from core.db_routers import use_primary
+from core.hashing import (
+    HasherPoolSaturated,
+    get_hasher_pool,
+    hash_password,
+    needs_rehash,
+    verify_password,
+)
+from core.instrumentation import render_metrics
+from core.models import AccessRule, CustomUser, Product
+from core.pagination import ProductCursorPagination
+from core.permissions import (
+    aprepare_permissions,
+    check_permission,
+    filter_permitted_queryset,
+    grant_role,
+    permission_context,
+    permission_matrix,
+    permission_scope,
+    revoke_role,
+    upsert_access_rules,
+)
+from core.schema import (
+    ANY_OBJECT,
+    examples,
+    extend_schema,
+    schema_artifacts,
+)
+from core.serializers import (
+    AccessRuleSerializer,
+    AccessRuleUpsertSerializer,
+    ProductSerializer,
+    RegisterSerializer,
+    RoleAssignmentSerializer,
+    UserUpdateSerializer,
+)
+from core.signing_keys import get_key_ring
+from core.throttling import (
+    dummy_password_hash,
+    get_client_ip,
+    login_throttle,
+    verify_dummy_password,
+)
+from core.tokens import (
+    REFRESH,
+    decode_token,
+    get_bearer_token,
+    issue_token_pair,
+    revoke_token,
+    verified_tokens,
+)
 
 
 @extend_schema(
@@ -17,8 +77,6 @@ from core.serializers import RegisterSerializer, UserUpdateSerializer
 )
 @api_view(['POST'])
 def register(request):
-    if not request.user:
-        return Response({'error': 'Authentication required'}, status=401)
     serializer = RegisterSerializer(data=request.data)
     if serializer.is_valid():
         serializer.save()
@@ -29,35 +87,114 @@ def register(request):
 @extend_schema(
     request=settings.USER_REQUEST_SCHEMA,
     responses=settings.USER_RESPONSES_SCHEMA,
-    examples=settings.EXAMPLES_LOGIN,
+    examples=examples(settings.EXAMPLES_LOGIN),
     tags=['Аутентификация'],
 )
+def _request_data(request):
+    """Тело запроса; JSON-массив или скаляр считается пустым объектом."""
+    return request.data if isinstance(request.data, dict) else {}
+
+
 @api_view(['POST'])
 def login(request):
-    if not request.user:
-        return Response({'error': 'Authentication required'}, status=401)
-    email = request.data.get('email')
-    password = request.data.get('password')
-    try:
-        user = CustomUser.objects.get(email=email, is_active=True)
-        if user.check_password(password):
-            token = jwt.encode(
-                {'user_id': user.id},
-                settings.SECRET_KEY,
-                algorithm='HS256',
-            )
-            return Response({'token': token})
-        else:
-            return Response({'error': 'Invalid credentials'}, status=401)
-    except CustomUser.DoesNotExist:
+    data = _request_data(request)
+    email = data.get('email')
+    password = data.get('password') or ''
+    if not isinstance(email, str) or not isinstance(password, str):
         return Response({'error': 'Invalid credentials'}, status=401)
+    ip = get_client_ip(request)
+    retry_after = login_throttle.retry_after(email, ip)
+    if retry_after:
+        audit.record('login', 'throttled', ip=ip, email=email)
+        return _throttled_response(Response, retry_after)
+    # Пользователи читаются с основной БД: вход сразу после регистрации
+    # не должен упираться в отставание реплики.
+    with use_primary():
+        user = CustomUser.objects.filter(email=email, is_active=True).first()
+    if user is None:
+        verify_dummy_password(password)
+    elif user.check_password(password):
+        login_throttle.reset(email)
+        audit.record('login', 'success', user.id, ip)
+        return Response(issue_token_pair(user))
+    login_throttle.register_failure(email, ip)
+    audit.record('login', 'failure', ip=ip, email=email)
+    return Response({'error': 'Invalid credentials'}, status=401)
 
 
-@extend_schema(tags=['Выход'])
+@extend_schema(
+    request=settings.REFRESH_REQUEST_SCHEMA,
+    responses=settings.USER_RESPONSES_SCHEMA,
+    tags=['Аутентификация'],
+)
+@api_view(['POST'])
+def refresh(request):
+    try:
+        payload = decode_token(
+            _request_data(request).get('refresh'),
+            REFRESH,
+        )
+    except (jwt.InvalidTokenError, TypeError) as exc:
+        audit.record(
+            'refresh',
+            'failure',
+            ip=get_client_ip(request),
+            reason=type(exc).__name__,
+        )
+        return Response({'error': 'Invalid refresh token'}, status=401)
+    with use_primary():
+        user = CustomUser.objects.filter(
+            id=payload.get('user_id'),
+            is_active=True,
+        ).first()
+    if user is None:
+        audit.record(
+            'refresh',
+            'failure',
+            payload.get('user_id'),
+            get_client_ip(request),
+            reason='inactive_user',
+        )
+        return Response({'error': 'Invalid refresh token'}, status=401)
+    # Новая пара выдаётся только тому, кто первым отозвал токен.
+    if not revoke_token(payload):
+        audit.record(
+            'refresh',
+            'failure',
+            user.id,
+            get_client_ip(request),
+            reason='reused',
+        )
+        return Response({'error': 'Invalid refresh token'}, status=401)
+    audit.record('refresh', 'success', user.id, get_client_ip(request))
+    return Response(issue_token_pair(user))
+
+
+def _revoke_request_tokens(request):
+    """Отзывает текущий access-токен и переданный refresh-токен."""
+    try:
+        revoke_token(decode_token(get_bearer_token(request)))
+    except (jwt.InvalidTokenError, TypeError):
+        pass
+    refresh_token = _request_data(request).get('refresh')
+    if refresh_token:
+        try:
+            revoke_token(decode_token(refresh_token, REFRESH))
+        except (jwt.InvalidTokenError, TypeError):
+            pass
+
+
+@extend_schema(
+    request=settings.REFRESH_REQUEST_SCHEMA,
+    responses=settings.MESSAGE_RESPONSE_SCHEMA,
+    tags=['Выход'],
+)
 @api_view(['POST'])
 def logout(request):
     if not request.user:
         return Response({'error': 'Authentication required'}, status=401)
+    _revoke_request_tokens(request)
+    audit.record('logout', 'success', request.user.id, get_client_ip(request))
     return Response({'message': 'Logged out'})
 
 
@@ -86,7 +223,11 @@ def update_profile(request):
     return Response(serializer.errors, status=400)
 
 
-@extend_schema(tags=['Удаление профиля'])
+@extend_schema(
+    request=None,
+    responses=settings.MESSAGE_RESPONSE_SCHEMA,
+    tags=['Удаление профиля'],
+)
 @api_view(['DELETE'])
 def delete_account(request):
     if not request.user:
@@ -94,70 +235,462 @@ def delete_account(request):
     user = request.user
     user.is_active = False
     user.save()
+    _revoke_request_tokens(request)
+    audit.record(
+        'account_delete',
+        'success',
+        user.id,
+        get_client_ip(request),
+    )
     return Response({'message': 'Account deactivated'})
 
 
 @extend_schema(
-    responses={200: settings.PRODUCT_SCHEMA},
-    description='Список доступных продуктов',
+    request=ProductSerializer,
+    responses={200: settings.PRODUCT_PAGE_SCHEMA},
+    description='Список доступных продуктов (курсорная пагинация)',
     tags=['Продукты'],
 )
+@extend_schema(methods=['GET'], operation_id='products_list')
 @api_view(['GET', 'POST'])
 def products_list(request):
     if not request.user:
         return Response({'error': 'Authentication required'}, status=401)
     element_name = 'products'
-    try:
-        element = BusinessElement.objects.get(name=element_name)
-    except BusinessElement.DoesNotExist:
+    if not permission_matrix.has_element(element_name):
         return Response({'error': 'Resource not configured'}, status=404)
 
+    context = permission_context(request)
     if request.method == 'GET':
         user = request.user
-        user_roles = UserRole.objects.filter(user=user).values_list(
-            'role_id',
-            flat=True,
-        )
-        rules = AccessRule.objects.filter(
-            role_id__in=user_roles,
-            element=element,
-        )
-        can_read = any(rule.read_all or rule.read_own for rule in rules)
-        if not can_read:
+        if permission_scope(user, element_name, 'read', context) is None:
             return Response({'error': 'Access denied'}, status=403)
-        result = []
-        for p in settings.MOCK_PRODUCTS:
-            try:
-                check_permission(user, element_name, 'read', p['owner_id'])
-                result.append(p)
-            except Exception:
-                pass
-        return Response(result)
+        queryset = filter_permitted_queryset(
+            user,
+            element_name,
+            'read',
+            Product.objects.all(),
+            context=context,
+        )
+        paginator = ProductCursorPagination()
+        page = paginator.paginate_queryset(queryset, request)
+        serializer = ProductSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
     elif request.method == 'POST':
-        check_permission(request.user, element_name, 'create')
-        return Response({'message': 'Product created'}, status=201)
+        check_permission(request.user, element_name, 'create', None, context)
+        serializer = ProductSerializer(data=request.data)
+        if serializer.is_valid():
+            serializer.save(owner_id=request.user.id)
+            return Response(serializer.data, status=201)
+        return Response(serializer.errors, status=400)
 
 
 @extend_schema(
+    request=ProductSerializer,
     responses={200: settings.PRODUCT_SCHEMA},
-    description='Список доступных продуктов',
+    description='Просмотр, изменение и удаление продукта',
     tags=['Продукты'],
 )
-@api_view(['PUT', 'DELETE'])
+@api_view(['GET', 'PUT', 'DELETE'])
 def product_detail(request, product_id):
     if not request.user:
         return Response({'error': 'Authentication required'}, status=401)
     element_name = 'products'
     try:
-        product = next(
-            p for p in settings.MOCK_PRODUCTS if p['id'] == int(product_id)
-        )
-    except StopIteration:
+        product = Product.objects.get(pk=product_id)
+    except Product.DoesNotExist:
         return Response({'error': 'Not found'}, status=404)
-    owner_id = product['owner_id']
-    if request.method == 'PUT':
-        check_permission(request.user, element_name, 'update', owner_id)
-        return Response({'message': 'Product updated'})
+    owner_id = product.owner_id
+    context = permission_context(request)
+    if request.method == 'GET':
+        check_permission(request.user, element_name, 'read', owner_id, context)
+        return Response(ProductSerializer(product).data)
+    elif request.method == 'PUT':
+        check_permission(
+            request.user,
+            element_name,
+            'update',
+            owner_id,
+            context,
+        )
+        serializer = ProductSerializer(
+            product,
+            data=request.data,
+            partial=True,
+        )
+        if serializer.is_valid():
+            serializer.save()
+            return Response(serializer.data)
+        return Response(serializer.errors, status=400)
     elif request.method == 'DELETE':
-        check_permission(request.user, element_name, 'delete', owner_id)
+        check_permission(
+            request.user,
+            element_name,
+            'delete',
+            owner_id,
+            context,
+        )
+        product.delete()
         return Response({'message': 'Product deleted'})
+
+
+@extend_schema(
+    request=AccessRuleUpsertSerializer(many=True),
+    responses=AccessRuleSerializer(many=True),
+    description='Список правил доступа и их массовое создание/обновление',
+    tags=['Правила доступа'],
+)
+@api_view(['GET', 'POST'])
+def access_rules(request):
+    if not request.user:
+        return Response({'error': 'Authentication required'}, status=401)
+    element_name = 'access_rules'
+    context = permission_context(request)
+    if request.method == 'GET':
+        check_permission(request.user, element_name, 'read', None, context)
+        rules = AccessRule.objects.select_related('role', 'element').order_by(
+            'id',
+        )
+        return Response(AccessRuleSerializer(rules, many=True).data)
+    elif request.method == 'POST':
+        check_permission(request.user, element_name, 'create', None, context)
+        check_permission(request.user, element_name, 'update', None, context)
+        serializer = AccessRuleUpsertSerializer(
+            data=request.data,
+            many=True,
+            allow_empty=False,
+        )
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=400)
+        upserted = upsert_access_rules(serializer.validated_data)
+        return Response({'upserted': upserted})
+
+
+@extend_schema(
+    request=RoleAssignmentSerializer,
+    responses={200: ANY_OBJECT},
+    description='Массовая выдача (POST) и отзыв (DELETE) роли',
+    tags=['Правила доступа'],
+)
+@api_view(['POST', 'DELETE'])
+def user_roles(request):
+    if not request.user:
+        return Response({'error': 'Authentication required'}, status=401)
+    element_name = 'access_rules'
+    context = permission_context(request)
+    serializer = RoleAssignmentSerializer(data=request.data)
+    if request.method == 'POST':
+        check_permission(request.user, element_name, 'create', None, context)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=400)
+        granted = grant_role(
+            serializer.validated_data['role'],
+            serializer.validated_data['user_ids'],
+        )
+        return Response({'granted': granted})
+    elif request.method == 'DELETE':
+        check_permission(request.user, element_name, 'delete', None, context)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=400)
+        revoked = revoke_role(
+            serializer.validated_data['role'],
+            serializer.validated_data['user_ids'],
+        )
+        return Response({'revoked': revoked})
+
+
+def _throttled_response(response_class, retry_after):
+    response = response_class(
+        {'error': 'Too many failed login attempts'},
+        status=429,
+    )
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def _hasher_busy_response():
+    response = JsonResponse(
+        {'error': 'Service busy, retry later'},
+        status=503,
+    )
+    response['Retry-After'] = str(settings.PASSWORD_HASHER_RETRY_AFTER)
+    return response
+
+
+def _json_body(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+async def _upgrade_password_hash(user, password):
+    try:
+        user.password_hash = await get_hasher_pool().run(
+            hash_password,
+            password,
+            settings.BCRYPT_ROUNDS,
+        )
+    except HasherPoolSaturated:
+        return
+    await user.asave(update_fields=['password_hash'])
+
+
+@csrf_exempt
+@require_POST
+async def register_async(request):
+    """
+    Async-версия register: bcrypt выполняется в пуле get_hasher_pool().
+    """
+    data = _json_body(request)
+    if data is None:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    serializer = RegisterSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+    try:
+        password_hash = await get_hasher_pool().run(
+            hash_password,
+            serializer.validated_data['password'],
+            settings.BCRYPT_ROUNDS,
+        )
+    except HasherPoolSaturated:
+        return _hasher_busy_response()
+    await sync_to_async(serializer.save)(password_hash=password_hash)
+    return JsonResponse({'message': 'User created'}, status=201)
+
+
+@csrf_exempt
+@require_POST
+async def login_async(request):
+    """
+    Async-версия login: bcrypt выполняется в пуле get_hasher_pool().
+    """
+    data = _json_body(request) or {}
+    email = data.get('email')
+    password = data.get('password') or ''
+    if not isinstance(email, str) or not isinstance(password, str):
+        return JsonResponse({'error': 'Invalid credentials'}, status=401)
+    ip = get_client_ip(request)
+    retry_after = login_throttle.retry_after(email, ip)
+    if retry_after:
+        audit.record('login', 'throttled', ip=ip, email=email)
+        return _throttled_response(JsonResponse, retry_after)
+    with use_primary():
+        user = await CustomUser.objects.filter(
+            email=email,
+            is_active=True,
+        ).afirst()
+    password_hash = user.password_hash if user else dummy_password_hash()
+    try:
+        is_valid = await get_hasher_pool().run(
+            verify_password,
+            password,
+            password_hash,
+        )
+    except HasherPoolSaturated:
+        return _hasher_busy_response()
+    if user is None or not is_valid:
+        login_throttle.register_failure(email, ip)
+        audit.record('login', 'failure', ip=ip, email=email)
+        return JsonResponse({'error': 'Invalid credentials'}, status=401)
+    login_throttle.reset(email)
+    audit.record('login', 'success', user.id, ip)
+    if needs_rehash(user.password_hash):
+        await _upgrade_password_hash(user, password)
+    tokens = await sync_to_async(issue_token_pair)(user)
+    return JsonResponse(tokens)
+
+
+def _api_error_response(exc):
+    return JsonResponse({'detail': exc.detail}, status=exc.status_code)
+
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+async def products_list_async(request):
+    """
+    Async-версия products_list: пользователь, права и страница
+    продуктов загружаются через async ORM.
+    """
+    user = await request.auser()
+    if not user:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    element_name = 'products'
+    await aprepare_permissions(user)
+    if not permission_matrix.has_element(element_name):
+        return JsonResponse({'error': 'Resource not configured'}, status=404)
+
+    context = permission_context(request)
+    if request.method == 'GET':
+        if permission_scope(user, element_name, 'read', context) is None:
+            return JsonResponse({'error': 'Access denied'}, status=403)
+        queryset = filter_permitted_queryset(
+            user,
+            element_name,
+            'read',
+            Product.objects.all(),
+            context=context,
+        )
+        try:
+            page, links = await ProductCursorPagination().apaginate(
+                queryset,
+                request,
+            )
+        except APIException as exc:
+            return _api_error_response(exc)
+        return JsonResponse({
+            **links,
+            'results': ProductSerializer(page, many=True).data,
+        })
+    try:
+        check_permission(user, element_name, 'create', None, context)
+    except APIException as exc:
+        return _api_error_response(exc)
+    data = _json_body(request)
+    if data is None:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    serializer = ProductSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+    product = await Product.objects.acreate(
+        owner_id=user.id,
+        **serializer.validated_data,
+    )
+    return JsonResponse(ProductSerializer(product).data, status=201)
+
+
+@csrf_exempt
+@require_http_methods(['GET', 'PUT', 'DELETE'])
+async def product_detail_async(request, product_id):
+    """Async-версия product_detail."""
+    user = await request.auser()
+    if not user:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    try:
+        product = await Product.objects.aget(pk=product_id)
+    except Product.DoesNotExist:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    await aprepare_permissions(user)
+    action = {'GET': 'read', 'PUT': 'update', 'DELETE': 'delete'}
+    try:
+        check_permission(
+            user,
+            'products',
+            action[request.method],
+            product.owner_id,
+            permission_context(request),
+        )
+    except APIException as exc:
+        return _api_error_response(exc)
+
+    if request.method == 'GET':
+        return JsonResponse(ProductSerializer(product).data)
+    elif request.method == 'PUT':
+        data = _json_body(request)
+        if data is None:
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        serializer = ProductSerializer(product, data=data, partial=True)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=400)
+        for field, value in serializer.validated_data.items():
+            setattr(product, field, value)
+        await product.asave(update_fields=list(serializer.validated_data))
+        return JsonResponse(ProductSerializer(product).data)
+    elif request.method == 'DELETE':
+        await product.adelete()
+        return JsonResponse({'message': 'Product deleted'})
+
+
+@require_GET
+def jwks(request):
+    """Открытые ключи для локальной проверки токенов другими сервисами."""
+    response = JsonResponse(get_key_ring().jwks())
+    response['Cache-Control'] = f'public, max-age={settings.JWT_JWKS_MAX_AGE}'
+    return response
+
+
+def _accepts_gzip(accept_encoding):
+    """gzip разрешён явно или через *, и его q не равен 0."""
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, *params = (part.strip() for part in item.split(';'))
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    quality = qualities.get('gzip', qualities.get('*', 0.0))
+    return quality > 0
+
+
+def _schema_format(request):
+    requested = request.GET.get('format')
+    if requested in ('json', 'yaml'):
+        return requested
+    if 'json' in request.headers.get('Accept', ''):
+        return 'json'
+    return 'yaml'
+
+
+@require_GET
+def api_schema(request):
+    """
+    Схема OpenAPI из файлов build_api_schema: из памяти, с ETag и gzip.
+    Без файлов схема генерируется drf-spectacular только при DEBUG.
+    """
+    artifact = schema_artifacts.get(_schema_format(request))
+    if artifact is None:
+        if not settings.DEBUG:
+            raise Http404('Schema is not built.')
+        from drf_spectacular.views import SpectacularAPIView
+
+        return SpectacularAPIView.as_view()(request)
+    gzipped = _accepts_gzip(request.headers.get('Accept-Encoding', ''))
+    etag = artifact.gzip_etag if gzipped else artifact.etag
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(
+            artifact.gzip_body if gzipped else artifact.body,
+            content_type=artifact.content_type,
+        )
+        if gzipped:
+            response['Content-Encoding'] = 'gzip'
+    response['ETag'] = etag
+    response['Cache-Control'] = (
+        f'public, max-age={settings.API_SCHEMA_MAX_AGE}'
+    )
+    patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+    return response
+
+
+@require_GET
+def metrics(request):
+    """Гистограммы InstrumentationMiddleware в текстовом формате Prometheus."""
+    if not settings.INSTRUMENTATION_ENABLED:
+        raise Http404()
+    token_cache = verified_tokens.stats()
+    lines = [
+        '# TYPE auth_verified_token_cache_hits_total counter',
+        f'auth_verified_token_cache_hits_total {token_cache["hits"]}',
+        '# TYPE auth_verified_token_cache_misses_total counter',
+        f'auth_verified_token_cache_misses_total {token_cache["misses"]}',
+        '# TYPE auth_verified_token_cache_size gauge',
+        f'auth_verified_token_cache_size {token_cache["size"]}',
+    ]
+    for name, value in audit.audit_log.stats().items():
+        kind = 'gauge' if name == 'buffered' else 'counter'
+        suffix = '' if name == 'buffered' else '_total'
+        lines += [
+            f'# TYPE auth_audit_events_{name}{suffix} {kind}',
+            f'auth_audit_events_{name}{suffix} {value}',
+        ]
+    return HttpResponse(
+        render_metrics() + '\n'.join(lines) + '\n',
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )